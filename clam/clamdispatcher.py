@@ -16,82 +16,206 @@ import datetime
 import subprocess
 import time
 import signal
-import shutil
+import select
 import json
+import socket
+import traceback
+import importlib
 
 VERSION = '3.3.0'
 
 sys.path.append(sys.path[0] + '/..')
 
-import clam.common.data #pylint: disable=wrong-import-position
-import clam.common.status
-from clam.common.util import computediskusage
+import clam.common.status #pylint: disable=wrong-import-position
+import clam.common.projectindex
+import clam.common.journal
+import clam.common.jobqueue
+import clam.common.launcher
+import clam.common.trash
+from clam.common.util import computediskusage, shellsafe, unescapeshelloperators
+#clam.common.data is deliberately not imported here, it is heavy and only needed if the settings module injects custom formats
 
 
+def children(pid):
+    """Returns the pids of the direct children of a process (from /proc)"""
+    result = []
+    try:
+        for tid in os.listdir('/proc/%d/task' % pid):
+            with open('/proc/%d/task/%s/children' % (pid, tid),'r') as f:
+                result += [ int(child) for child in f.read().split() ]
+    except (FileNotFoundError, ProcessLookupError):
+        pass #process (or thread) ended in the meantime
+    return result
+
+def processtree(pid):
+    """Returns the pid and the pids of all of its descendants"""
+    pids = [pid]
+    i = 0
+    while i < len(pids):
+        pids += children(pids[i])
+        i += 1
+    return pids
+
+def rss(pid):
+    """Returns the resident memory of a single process in kB (from /proc), 0 if the process no longer exists"""
+    try:
+        with open('/proc/%d/status' % pid,'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return 0 #kernel threads and zombies have no VmRSS
+
 def mem(pid, size="rss"):
-    """memory sizes: rss, rsz, vsz."""
+    """Returns the resident memory (in kB) of the process and all of its descendants. Reads /proc where available, falls back to ps (only the process itself) otherwise. memory sizes for ps: rss, rsz, vsz."""
+    if os.path.exists('/proc/%d/task' % pid) and size == "rss":
+        return sum(rss(p) for p in processtree(pid))
     return int(os.popen('ps -p %d -o %s | tail -1' % (pid, size)).read())
 
 def total_seconds(delta):
     return delta.days * 86400 + delta.seconds + (delta.microseconds / 1000000.0)
 
-def updateindex(projectpath):
-    """Update the index"""
-    totalsize = 0.0
-    if os.path.exists(os.path.join(projectpath,'..','.index')):
-        with open(os.path.join(projectpath,'..','.index'),'r',encoding='utf-8') as f:
+#interval bounds (seconds) for checking the journal for abort requests
+ABORTCHECK_MININTERVAL = 0.1
+ABORTCHECK_MAXINTERVAL = 2.0
+#minimum interval (seconds) for sampling the memory usage of the process tree (the maximum is DISPATCHER_POLLINTERVAL)
+MEMCHECK_MININTERVAL = 1.0
+#time (seconds) an aborted process gets to terminate before it is killed
+KILLTIMEOUT = 30
+
+class ChildWatcher:
+    """Waits for a child process to exit without polling. Blocks on a pidfd where available (Linux >= 5.3), otherwise on SIGCHLD delivered through a wakeup pipe.
+    The wait is also interrupted by any of the specified signals, these are collected in ``signalled``."""
+
+    def __init__(self, pid, signals=()):
+        self.pid = pid
+        self.pidfd = None
+        self.signals = tuple(signals)
+        self.signalled = set()
+        self.pipe = os.pipe()
+        for fd in self.pipe:
+            os.set_blocking(fd, False)
+        try:
+            self.pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            signal.signal(signal.SIGCHLD, lambda signum, frame: None) #a handler is needed for the wakeup fd to be written
+        for signum in self.signals:
+            signal.signal(signum, lambda signum, frame: self.signalled.add(signum))
+        signal.set_wakeup_fd(self.pipe[1])
+
+    def wait(self, timeout, interruptible=True):
+        """Wait at most timeout seconds for the child to exit (or, if interruptible, for one of the signals to arrive), returns (pid, status, rusage) like os.wait4(), pid is 0 if the child is still running.
+        Other wakeups (such as unrelated signals) do not cut the wait short."""
+        deadline = time.monotonic() + timeout
+        while True:
+            result = os.wait4(self.pid, os.WNOHANG)
+            if result[0] != 0 or (interruptible and self.signalled):
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return result
+            select.select([self.pipe[0]] + ([self.pidfd] if self.pidfd is not None else []), [], [], remaining)
             try:
-                data = json.load(f)
-            except ValueError:
-                #delete the entire index
-                os.unlink(os.path.join(projectpath,'..','.index'))
-                return False
-    else:
-        data = {"projects": [], 'totalsize': 0.0}
+                while os.read(self.pipe[0], 512):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        signal.set_wakeup_fd(-1)
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+        else:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for signum in self.signals:
+            signal.signal(signum, signal.SIG_IGN) #late signals are of no concern anymore
+        for fd in self.pipe:
+            os.close(fd)
+
+def terminate(pid, watcher, timeout=KILLTIMEOUT):
+    """Ask the process to terminate and give it timeout seconds to do so (further abort signals do not shorten this), kill it otherwise. Returns the resource usage (or None if the process was already gone)."""
+    try:
+        os.kill(pid, signal.SIGTERM)
+        returnedpid, _, rusage = watcher.wait(timeout, interruptible=False)
+        if returnedpid == 0:
+            #the process doesn't listen, kill it
+            print("[CLAM Dispatcher] Process did not terminate within " + str(timeout) + "s, killing it", file=sys.stderr)
+            os.kill(pid, signal.SIGKILL)
+            _, _, rusage = os.wait4(pid, 0)
+        return rusage
+    except OSError:
+        return None
+
+def getstats(begintime, walltime, queuewait, statuscode, aborted, rusage, peakmem):
+    """Collect the resource usage of a finished job in a dictionary (see clam.common.projectindex.JOBFIELDS)"""
+    stats = {
+        'begintime': begintime.strftime('%Y-%m-%d %H:%M:%S'),
+        'endtime': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'walltime': round(walltime, 3),
+        'queuewait': round(queuewait, 3),
+        'exitstatus': statuscode,
+        'aborted': int(aborted),
+    }
+    if rusage is not None:
+        stats['usertime'] = round(rusage.ru_utime, 3)
+        stats['systemtime'] = round(rusage.ru_stime, 3)
+        stats['maxrss'] = rusage.ru_maxrss #kB, of the largest process in the tree
+        stats['inblock'] = rusage.ru_inblock
+        stats['oublock'] = rusage.ru_oublock
+        stats['nvcsw'] = rusage.ru_nvcsw
+        stats['nivcsw'] = rusage.ru_nivcsw
+    if peakmem:
+        stats['peakmem'] = peakmem #kB, of the entire process tree
+    return stats
+
+def updateindex(projectpath, stats=None):
+    """Update the project index, only the output directory needs to be recounted as the input can not change whilst the process runs. Resource usage statistics are written to the project's .stats file and added to the job history."""
+    projectpath = projectpath.rstrip('/')
     if not os.path.isdir(projectpath):
         return False
-    d = datetime.datetime.fromtimestamp(os.stat(projectpath)[8])
-    project = os.path.basename(projectpath.rstrip('/'))
-    projectsize, filecount = computediskusage(projectpath)
-    with open(os.path.join(projectpath,'.du'),'w') as f:
-        f.write(str(projectsize) + "\n")
-        f.write(str(filecount))
-    index = None
-    for i, projectdata in enumerate(data['projects']):
-        if projectdata[0] == project:
-            index = i
-        else:
-            totalsize += projectdata[2]
-    projectdata = ( project , d.strftime("%Y-%m-%d %H:%M:%S"), round(projectsize,2), clam.common.status.DONE )
-    changed = True
-    if index is None:
-        data['projects'].append(  projectdata   )
-        data["totalsize"] = totalsize + projectsize
-    elif data["projects"][index] != projectdata:
-        data["projects"][index] = projectdata
-        data["totalsize"] = totalsize + projectsize
-    else:
-        changed = False
-        if totalsize != data['totalsize']:
-            data["totalsize"] = totalsize
-            changed = True
-    if changed:
-        with open(os.path.join(projectpath,'..','.index'),'w',encoding='utf-8') as f:
-            json.dump(data,f, ensure_ascii=False)
+    userdir = os.path.dirname(projectpath)
+    root = os.path.dirname(os.path.dirname(userdir)) #projectpath is ROOT/projects/user/project
+    project = os.path.basename(projectpath)
+    outputsize, filecount = computediskusage(os.path.join(projectpath,'output'))
+    index = clam.common.projectindex.ProjectIndex(root, wal=None) #the webservice decides on the journal mode
+    index.setusage(os.path.basename(userdir), project, 'output', outputsize, filecount, clam.common.status.DONE)
+    index.update(os.path.basename(userdir), project, clam.common.status.DONE, clam.common.projectindex.timestamp(projectpath))
+    if stats:
+        with open(os.path.join(projectpath,'.stats'),'w',encoding='utf-8') as f:
+            json.dump(stats, f)
+        index.addjob(os.path.basename(userdir), project, stats)
+    #free the slot(s) taken by the project
+    clam.common.jobqueue.JobQueue(root, wal=None).removerunning(os.path.basename(userdir), project)
     return True
 
-def main():
-    if len(sys.argv) < 4:
-        print("[CLAM Dispatcher] ERROR: Invalid syntax, use clamdispatcher.py [pythonpath] settingsmodule projectdir cmd arg1 arg2 ... got: " + " ".join(sys.argv[1:]), file=sys.stderr)
-        with open('.done','w') as f:
-            f.write(str(1))
-        if os.path.exists('.pid'): os.unlink('.pid')
+def deleteproject(projectpath):
+    """Move the project directory into the trash (the webservice purges it) and remove the project from the project index, for projects that were deleted by the user whilst running"""
+    projectpath = projectpath.rstrip('/')
+    userdir = os.path.dirname(projectpath)
+    root = os.path.dirname(os.path.dirname(userdir)) #projectpath is ROOT/projects/user/project
+    try:
+        clam.common.trash.move(root, projectpath)
+    except FileNotFoundError:
+        pass #deleted by the webservice already
+    clam.common.projectindex.ProjectIndex(root, wal=None).remove(os.path.basename(userdir), os.path.basename(projectpath))
+
+def main(args=None):
+    """Run the dispatcher, args are the command line arguments (defaults to sys.argv[1:])"""
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) == 3 and args[0] == '--serve':
+        return serve(args[1], args[2])
+    if len(args) < 3:
+        print("[CLAM Dispatcher] ERROR: Invalid syntax, use clamdispatcher.py [pythonpath] settingsmodule projectdir cmd arg1 arg2 ... (or clamdispatcher.py --serve socket settingsmodule) got: " + " ".join(args), file=sys.stderr)
+        if len(args) >= 2 and os.path.isdir(args[1]):
+            clam.common.journal.append(args[1], clam.common.journal.FINISHED, code=1)
         return 1
 
     print("[CLAM Dispatcher] Running with " + sys.executable, file=sys.stderr)
 
-    settingsmodule = sys.argv[1]
-    projectdir = sys.argv[2]
+    settingsmodule = args[0]
+    projectdir = args[1]
     if projectdir == 'NONE': #Actions
         tmpdir = None
         projectdir = None
@@ -105,23 +229,20 @@ def main():
 
     print("[CLAM Dispatcher] Started CLAM Dispatcher v" + str(VERSION) + " with " + settingsmodule + " (" + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ")", file=sys.stderr)
 
-    cmd = sys.argv[3]
-    cmd = clam.common.data.unescapeshelloperators(cmd) #shell operators like pipes and redirects were passed in an escaped form
-    for arg in sys.argv[4:]:
-        arg_u = clam.common.data.unescapeshelloperators(arg)
+    cmd = args[2]
+    cmd = unescapeshelloperators(cmd) #shell operators like pipes and redirects were passed in an escaped form
+    for arg in args[3:]:
+        arg_u = unescapeshelloperators(arg)
         if arg_u != arg:
             cmd += " " + arg_u #shell operator (pipe or something)
         else:
-            cmd += " " + clam.common.data.shellsafe(arg,'"')
+            cmd += " " + shellsafe(arg,'"')
 
 
     if not cmd:
         print("[CLAM Dispatcher] FATAL ERROR: No command specified!", file=sys.stderr)
         if projectdir:
-            f = open(projectdir + '.done','w')
-            f.write(str(1))
-            f.close()
-            if os.path.exists(projectdir + '.pid'): os.unlink(projectdir + '.pid')
+            clam.common.journal.append(projectdir, clam.common.journal.FINISHED, code=1)
         return 1
     elif projectdir and not os.path.isdir(projectdir):
         print("[CLAM Dispatcher] FATAL ERROR: Project directory "+ projectdir + " does not exist", file=sys.stderr)
@@ -132,7 +253,7 @@ def main():
         settings = __import__(settingsmodule , globals(), locals(),0)
         try:
             if settings.CUSTOM_FORMATS:
-                clam.common.data.CUSTOM_FORMATS = settings.CUSTOM_FORMATS
+                importlib.import_module('clam.common.data').CUSTOM_FORMATS = settings.CUSTOM_FORMATS
                 print("[CLAM Dispatcher] Dependency injection for custom formats succeeded", file=sys.stderr)
         except AttributeError:
             pass
@@ -140,9 +261,7 @@ def main():
         print("[CLAM Dispatcher] FATAL ERROR: Unable to import settings module, settingsmodule is " + settingsmodule + ", error: " + str(e), file=sys.stderr)
         print("[CLAM Dispatcher]              Your settings module should have been (automatically) installed either in your virtual environment or globally", file=sys.stderr)
         if projectdir:
-            f = open(projectdir + '.done','w')
-            f.write(str(1))
-            f.close()
+            clam.common.journal.append(projectdir, clam.common.journal.FINISHED, code=1)
         return 1
 
     settingkeys = dir(settings)
@@ -168,100 +287,109 @@ def main():
         pid = process.pid
         print("[CLAM Dispatcher] Running with pid " + str(pid) + " (" + begintime.strftime('%Y-%m-%d %H:%M:%S') + ")", file=sys.stderr)
         sys.stderr.flush()
+        #the service may signal us once it knows our pid, so the handler has to be in place before it is recorded
+        watcher = ChildWatcher(pid, (clam.common.journal.ABORTSIGNAL,) if projectdir else ())
         if projectdir:
-            with open(projectdir + '.pid','w') as f:
-                f.write(str(pid))
+            clam.common.journal.append(projectdir, clam.common.journal.PID, pid=pid, dispatcher=os.getpid())
+            journal = clam.common.journal.Journal(projectdir)
+            journal.read()
     else:
         print("[CLAM Dispatcher] Unable to launch process", file=sys.stderr)
         sys.stderr.flush()
         if projectdir:
-            with open(projectdir + '.done','w') as f:
-                f.write(str(1))
+            clam.common.journal.append(projectdir, clam.common.journal.FINISHED, code=1)
         return 1
 
-    #intervalf = lambda s: min(s/10.0, 15)
     abort = False
     idle = 0
-    done = False
-    lastpolltime = datetime.datetime.now()
-    lastabortchecktime = datetime.datetime.now()
-
-    while not done:
-        d = total_seconds(datetime.datetime.now() - begintime)
+    rusage = None
+    peakmem = 0 #peak resident memory (kB) of the process tree, as sampled
+    #timers (in seconds since the epoch) for the periodic checks
+    now = time.time()
+    nextabortcheck = now + ABORTCHECK_MININTERVAL
+    #memory is sampled for the peak memory statistics wherever /proc is available, and for the limit if one is set
+    nextmemcheck = now + min(MEMCHECK_MININTERVAL, settings.DISPATCHER_POLLINTERVAL) if settings.DISPATCHER_MAXRESMEM > 0 or os.path.exists('/proc/%d/task' % pid) else None
+    deadline = now + settings.DISPATCHER_MAXTIME if settings.DISPATCHER_MAXTIME > 0 else None
+
+    while True:
+        now = time.time()
+        timeout = min(t for t in (nextabortcheck if projectdir else None, nextmemcheck, deadline, now + 3600) if t is not None) - now
         try:
-            returnedpid, statuscode = os.waitpid(pid, os.WNOHANG)
-            if returnedpid != 0:
-                print("[CLAM Dispatcher] Process ended (" + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ", " + str(d)+"s) ", file=sys.stderr)
-                done = True
+            waitbegin = time.time()
+            returnedpid, statuscode, rusage = watcher.wait(max(timeout, 0))
+            idle += time.time() - waitbegin
         except OSError: #no such process
+            d = total_seconds(datetime.datetime.now() - begintime)
             print("[CLAM Dispatcher] Process lost! (" + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ", " + str(d)+"s)", file=sys.stderr)
             statuscode = 1
-            done = True
-
-        if done:
+            break
+        d = total_seconds(datetime.datetime.now() - begintime)
+        if returnedpid != 0:
+            print("[CLAM Dispatcher] Process ended (" + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ", " + str(d)+"s) ", file=sys.stderr)
             break
 
-        if total_seconds(datetime.datetime.now() - lastabortchecktime) >= min(10, d* 0.5):  #every 10 seconds, faster at beginning
-            if projectdir and os.path.exists(projectdir + '.abort'):
+        now = time.time()
+        if watcher.signalled:
+            watcher.signalled.clear()
+            nextabortcheck = now #an abort was requested, check the journal right away
+        if projectdir and now >= nextabortcheck:
+            if journal.read().abortrequested:
                 abort = True
-            if abort:
-                print("[CLAM Dispatcher] ABORTING PROCESS ON SIGNAL! (" + str(d)+"s)", file=sys.stderr)
-                os.system("sleep 30 && kill -9 " + str(pid) + " &") #deathtrap in case the process doesn't listen within 30 seconds
-                os.kill(pid, signal.SIGTERM)
-                os.waitpid(pid, 0)
-                if projectdir:
-                    os.unlink(projectdir + '.abort')
-                    with open(projectdir + '.aborted','w') as f:
-                        f.close()
-                done = True
-                break
-            lastabortchecktime = datetime.datetime.now()
-
-
-        if d <= 1:
-            idle += 0.05
-            time.sleep(0.05)
-        elif d <= 2:
-            idle += 0.2
-            time.sleep(0.2)
-        elif d <= 10:
-            idle += 0.5
-            time.sleep(0.5)
-        else:
-            idle += 1
-            time.sleep(1)
+            nextabortcheck = now + min(ABORTCHECK_MAXINTERVAL, max(ABORTCHECK_MININTERVAL, d * 0.5)) #faster at the beginning
 
-        if settings.DISPATCHER_MAXRESMEM > 0 and total_seconds(datetime.datetime.now() - lastpolltime) >= settings.DISPATCHER_POLLINTERVAL:
+        if nextmemcheck is not None and now >= nextmemcheck:
             resmem = mem(pid)
-            if resmem > settings.DISPATCHER_MAXRESMEM * 1024:
+            peakmem = max(peakmem, resmem)
+            if settings.DISPATCHER_MAXRESMEM > 0 and resmem > settings.DISPATCHER_MAXRESMEM * 1024:
                 print("[CLAM Dispatcher] PROCESS EXCEEDS MAXIMUM RESIDENT MEMORY USAGE (" + str(resmem) + ' >= ' + str(settings.DISPATCHER_MAXRESMEM) + ')... ABORTING', file=sys.stderr)
                 abort = True
                 statuscode = 2
-            lastpolltime = datetime.datetime.now()
-        elif settings.DISPATCHER_MAXTIME > 0 and d > settings.DISPATCHER_MAXTIME:
+            nextmemcheck = now + min(settings.DISPATCHER_POLLINTERVAL, max(MEMCHECK_MININTERVAL, d * 0.5)) #more often at the beginning, short jobs get sampled too
+        if deadline is not None and now >= deadline:
             print("[CLAM Dispatcher] PROCESS TIMED OUT.. NO COMPLETION WITHIN " + str(d) + " SECONDS ... ABORTING", file=sys.stderr)
             abort = True
             statuscode = 3
 
+        if abort:
+            print("[CLAM Dispatcher] ABORTING PROCESS ON SIGNAL! (" + str(d)+"s)", file=sys.stderr)
+            rusage = terminate(pid, watcher)
+            if projectdir:
+                clam.common.journal.append(projectdir, clam.common.journal.ABORTED)
+            break
+
+    watcher.close()
+
     if projectdir:
-        with open(projectdir + '.done','w') as f:
-            f.write(str(statuscode))
-        if os.path.exists(projectdir + '.pid'): os.unlink(projectdir + '.pid')
+        if peakmem:
+            clam.common.journal.append(projectdir, clam.common.journal.FINISHED, code=statuscode, peakmem=peakmem)
+        else:
+            clam.common.journal.append(projectdir, clam.common.journal.FINISHED, code=statuscode)
+
+        #queue wait is the time between the submission (as recorded by the service, when it entered the job queue if it had to wait for resources) and the actual launch
+        queuewait = 0.0
+        state = journal.read()
+        submitted = state.queuedtimestamp or state.startedtimestamp
+        if submitted:
+            queuewait = max(0.0, begintime.timestamp() - submitted)
+        stats = getstats(begintime, total_seconds(datetime.datetime.now() - begintime), queuewait, statuscode, abort, rusage, peakmem)
 
         #update project index cache
         print("[CLAM Dispatcher] Updating project index", file=sys.stderr)
-        updateindex(projectdir)
+        updateindex(projectdir, stats)
+
+        if state.deleterequested:
+            #the project was deleted while it was running, the service left the actual deletion to us
+            print("[CLAM Dispatcher] Deleting project", file=sys.stderr)
+            deleteproject(projectdir)
 
 
     if tmpdir and os.path.exists(tmpdir):
         print("[CLAM Dispatcher] Removing temporary files", file=sys.stderr)
+        root = os.path.dirname(os.path.dirname(os.path.dirname(projectdir.rstrip('/')))) if projectdir else settings.ROOT
         for filename in os.listdir(tmpdir):
             filepath = os.path.join(tmpdir,filename)
             try:
-                if os.path.isdir(filepath):
-                    shutil.rmtree(filepath)
-                else:
-                    os.unlink(filepath)
+                clam.common.trash.move(root, filepath) #purged by the webservice
             except: #pylint: disable=bare-except
                 print("[CLAM Dispatcher] Unable to remove " + filename, file=sys.stderr)
 
@@ -273,5 +401,97 @@ def main():
 
     return statuscode
 
+def serve(socketpath, settingsmodule):
+    """Run as launcher: a fork server listening on a Unix socket, that forks a dispatcher for every launch request. The dispatcher and the settings are imported only once, so dispatchers start in milliseconds. See clam.common.launcher for the client side."""
+    try:
+        __import__(settingsmodule , globals(), locals(),0)
+    except ImportError as e:
+        print("[CLAM Launcher] FATAL ERROR: Unable to import settings module " + settingsmodule + ", error: " + str(e), file=sys.stderr)
+        return 1
+    if clam.common.launcher.ping(socketpath):
+        print("[CLAM Launcher] Another launcher is already listening on " + socketpath, file=sys.stderr)
+        return 0
+    if os.path.exists(socketpath):
+        os.unlink(socketpath) #stale
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    oldmask = os.umask(0o077) #only accessible by the user running the service
+    try:
+        listener.bind(socketpath)
+    finally:
+        os.umask(oldmask)
+    listener.listen(64)
+    listener.settimeout(clam.common.launcher.IDLETIMEOUT)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN) #dispatchers are reaped automatically
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) #clean up the socket when terminated
+    print("[CLAM Launcher] Listening on " + socketpath + " (pid " + str(os.getpid()) + ", settings " + settingsmodule + ")", file=sys.stderr)
+    sys.stderr.flush()
+    uid = os.getuid()
+    running = True
+    try:
+        while running:
+            try:
+                connection, _ = listener.accept()
+            except socket.timeout:
+                print("[CLAM Launcher] Idle for " + str(clam.common.launcher.IDLETIMEOUT) + "s, exiting", file=sys.stderr)
+                break
+            with connection:
+                try:
+                    connection.settimeout(10)
+                    if clam.common.launcher.peeruid(connection) != uid:
+                        raise clam.common.launcher.LauncherError("Permission denied")
+                    request = json.loads(clam.common.launcher.readline(connection).decode('utf-8'))
+                    if request.get('action') == 'launch':
+                        reply = {'pid': fork(listener, request['args'], request['stderr'], request['cwd'])}
+                    elif request.get('action') == 'ping':
+                        reply = {'pid': os.getpid(), 'settingsmodule': settingsmodule}
+                    elif request.get('action') == 'shutdown':
+                        print("[CLAM Launcher] Shutting down on request", file=sys.stderr)
+                        reply = {}
+                        running = False
+                    else:
+                        raise clam.common.launcher.LauncherError("Invalid request")
+                except (OSError, ValueError, KeyError, clam.common.launcher.LauncherError) as e:
+                    reply = {'error': str(e)}
+                try:
+                    connection.sendall((json.dumps(reply) + "\n").encode('utf-8'))
+                except OSError:
+                    pass #client went away
+    finally:
+        listener.close()
+        try:
+            os.unlink(socketpath)
+        except FileNotFoundError:
+            pass
+    return 0
+
+def fork(listener, args, stderr, cwd):
+    """Fork a dispatcher from the launcher, returns its pid (in the launcher)"""
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+    #in the dispatcher
+    statuscode = 1
+    try:
+        listener.close()
+        os.setsid()
+        for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        fd = os.open(stderr, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        os.dup2(fd, 2)
+        os.close(fd)
+        os.chdir(cwd)
+        statuscode = main(args)
+    except BaseException: #pylint: disable=broad-except
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(statuscode if isinstance(statuscode, int) else 1) #pylint: disable=protected-access
+    return 0 #never reached
+
 if __name__ == '__main__':
     sys.exit(main())
@@ -17,11 +17,13 @@
 #pylint: disable=redefined-builtin,trailing-whitespace,superfluous-parens,bad-classmethod-argument,wrong-import-order,wrong-import-position,ungrouped-imports
 
 import shutil
+import tempfile
 import os
 import io
 import stat
 import subprocess
 import importlib
+import importlib.util
 import glob
 import sys
 import datetime
@@ -31,6 +33,9 @@ import hashlib
 import argparse
 import time
 import socket
+import threading
+import concurrent.futures
+import fcntl
 import json
 import mimetypes
 import flask
@@ -38,6 +43,7 @@ import werkzeug
 import requests
 import base64
 import copy
+import collections
 
 import clam.common.status
 import clam.common.parameters
@@ -46,26 +52,23 @@ import clam.common.auth
 import clam.common.oauth
 import clam.common.data
 import clam.common.viewers
+import clam.common.projectindex
+import clam.common.journal
+import clam.common.jobqueue
+import clam.common.launcher
+import clam.common.trash
+import clam.common.resumable
+import clam.common.blobstore
+import clam.common.fetcher
+import clam.common.manifest
 from clam.common.util import globsymlinks, setdebug, setlog, setlogfile, printlog, printdebug, xmlescape, withheaders, computediskusage, parse_accept_header
 import clam.config.defaults as settings #will be overridden by real settings later
 settings.INTERNALURLPREFIX = ''
 
-from urllib.parse import urlencode, unquote
+from urllib.parse import urlencode, unquote, urlparse, quote
 
-try:
-    from requests_oauthlib import OAuth2Session
-except ImportError:
-    print( "WARNING: No OAUTH2 support available in your version of Python! Install python-requests-oauthlib if you plan on using OAUTH2 for authentication!", file=sys.stderr)
-
-try:
-    import MySQLdb
-except ImportError:
-    print("WARNING: No MySQL support available in your version of Python! pip install mysqlclient if you plan on using MySQL for authentication",file=sys.stderr)
-
-try:
-    import foliatools
-except ImportError:
-    foliatools = None
+#requests_oauthlib (OAuth2), MySQLdb (MySQL authentication) and foliatools (FoLiA viewer) are optional and imported on
+#demand, only when the service is configured to use them
 
 try:
     import uwsgi
@@ -78,7 +81,6 @@ VERSION = clam.common.data.VERSION
 
 DEBUG = False
 
-DATEMATCH = re.compile(r'^[\d\.\-\s:]*$')
 
 settingsmodule = None #will be overwritten later
 
@@ -86,6 +88,13 @@ setlog(sys.stderr)
 
 HOST = PORT = None
 
+PROJECTINDEX = None #will be instantiated on first use (getindex())
+JOBQUEUE = None #will be instantiated on first use (getjobqueue())
+JOBSCHEDULER = None #will be instantiated when the service starts, if QUEUE is enabled
+PURGER = None #will be instantiated when the service starts
+FETCHER = None #will be instantiated on first use (getfetcher())
+LAUNCHERFAILED = None #time the dispatcher launcher last failed to start
+
 
 
 def error(msg):
@@ -126,6 +135,10 @@ def userdb_lookup_mysql(user, **authsettings):
         printdebug("User not in accesslist")
         raise KeyError
     if isinstance(passwd,bytes): passwd = str(passwd,'utf-8')
+    try:
+        import MySQLdb
+    except ImportError:
+        raise ImportError("No MySQL support available in your version of Python! pip install mysqlclient if you plan on using MySQL for authentication")
     db = MySQLdb.connect(host=host,user=mysqluser,passwd=passwd,db=database, charset='utf8', use_unicode=True)
     cursor = db.cursor()
     #simple protection against sql injection
@@ -202,7 +215,7 @@ def validate_users_mysql():
 class Login(object):
     @staticmethod
     def GET():
-        oauthsession = OAuth2Session(settings.OAUTH_CLIENT_ID, redirect_uri=os.path.join(settings.OAUTH_CLIENT_URL,"login"), scope=settings.OAUTH_SCOPE)
+        oauthsession = clam.common.oauth.session(settings.OAUTH_CLIENT_ID, redirect_uri=os.path.join(settings.OAUTH_CLIENT_URL,"login"), scope=settings.OAUTH_SCOPE)
         if 'error' in flask.request.values:
             error = flask.request.values['error']
             try:
@@ -412,34 +425,76 @@ def entryshortcut(credentials = None, fromstart=False): #pylint: disable=too-man
 
     return None
 
+def getindex():
+    """Returns the project index (a single instance per process)"""
+    global PROJECTINDEX
+    if PROJECTINDEX is None:
+        PROJECTINDEX = clam.common.projectindex.ProjectIndex(settings.ROOT, wal=not settings.WORKERS)
+    return PROJECTINDEX
+
+def getjobqueue():
+    """Returns the job queue (a single instance per process)"""
+    global JOBQUEUE
+    if JOBQUEUE is None:
+        JOBQUEUE = clam.common.jobqueue.JobQueue(settings.ROOT, wal=not settings.WORKERS)
+    return JOBQUEUE
+
+def getfetcher():
+    """Returns the fetcher for url uploads (a single instance per process, so its connections are shared)"""
+    global FETCHER
+    if FETCHER is None or FETCHER.pid != os.getpid(): #connections do not survive the fork of a pre-forking WSGI server
+        FETCHER = clam.common.fetcher.Fetcher(settings.ROOT + clam.common.fetcher.CACHEDIR if settings.URLCACHE else None, settings.URLFETCH_TIMEOUT, int(settings.URLCACHE_MAXSIZE * 1024 * 1024), max(10, settings.URLFETCH_WORKERS), settings.URLFETCH_MAXDURATION)
+        FETCHER.pid = os.getpid()
+    return FETCHER
+
+def trash(path):
+    """Move a file or directory into the trash, from where the purger removes it in the background"""
+    clam.common.trash.move(settings.ROOT, path)
+    if PURGER is not None:
+        PURGER.wake()
+
+def getlauncher():
+    """Returns the socket of the dispatcher launcher, starting the launcher if it is not running yet. Returns None if it can not be started, dispatchers are then started through the shell."""
+    global LAUNCHERFAILED #pylint: disable=global-statement
+    socketpath = settings.ROOT + clam.common.launcher.LAUNCHERSOCKET
+    if clam.common.launcher.ping(socketpath, settingsmodule):
+        return socketpath
+    if LAUNCHERFAILED and time.time() - LAUNCHERFAILED < 60:
+        return None #don't hold up every launch while the launcher is broken
+    with open(settings.ROOT + "launcher.lock",'w') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX) #only one process starts the launcher
+        if clam.common.launcher.ping(socketpath, settingsmodule):
+            return socketpath
+        clam.common.launcher.shutdown(socketpath) #a launcher for other settings
+        cmd = settings.DISPATCHER + ' --serve ' + socketpath + ' ' + settingsmodule
+        venv = os.environ.get('VIRTUAL_ENV')
+        if venv:
+            cmd = f". {venv}/bin/activate && " + cmd
+        printlog("Starting dispatcher launcher: " + cmd)
+        subprocess.Popen(cmd, cwd=settings.CLAMDIR, shell=True, stdin=subprocess.DEVNULL, start_new_session=True)
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            time.sleep(0.05)
+            if clam.common.launcher.ping(socketpath, settingsmodule):
+                LAUNCHERFAILED = None
+                return socketpath
+    printlog("WARNING: Unable to start the dispatcher launcher, starting dispatchers through the shell")
+    LAUNCHERFAILED = time.time()
+    return None
+
 def getprojects(user):
-    projects = []
-    totalsize = 0.0
     path = settings.ROOT + "projects/" + user
-    if os.path.exists(os.path.join(path,'.index')):
-        with io.open(os.path.join(path,'.index'),'r',encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-            except ValueError:
-                printlog("Invalid json in .index")
-                os.unlink(os.path.join(path,'.index'))
-                return getprojects(user)
-            totalsize = float(data['totalsize'])
-            projects = data['projects']
-    else:
+    index = getindex()
+    if not index.indexed(user) and not index.migrate(user, path):
         printdebug("Computing index for " + user + "...")
         for f in glob.glob(path + '/*'):
             if os.path.isdir(f):
-                d = datetime.datetime.fromtimestamp(os.stat(f)[8])
                 project = os.path.basename(f)
-                projectsize, filecount = Project.getdiskusage(user,project )
-                totalsize += projectsize
-                projects.append( ( project , d.strftime("%Y-%m-%d %H:%M:%S"), round(projectsize,2), Project.simplestatus(project,user)  ) )
-        printdebug("Writing index for " + user + "...")
+                Project.getdiskusage(user,project)
+                index.update(user, project, Project.simplestatus(project,user), clam.common.projectindex.timestamp(f))
         if os.path.exists(path):
-            with io.open(os.path.join(path,'.index'),'w',encoding='utf-8') as f_index:
-                json.dump({'totalsize': totalsize, 'projects': projects},f_index, ensure_ascii=False)
-    return projects, round(totalsize)
+            index.setindexed(user)
+    return index.projects(user), round(index.totalsize(user))
 
 
 
@@ -466,6 +521,39 @@ def mainentry(credentials = None):
         return index((user,oauth_access_token))
 
 
+def projectsstatus(credentials = None):
+    """Compact JSON status report for many projects at once, answered from the project index. Takes a list of project IDs as projects= parameter(s) (repeated or comma separated), defaults to all projects of the user (only if LISTPROJECTS is enabled). If running=1 is set, only running projects are reported."""
+    user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+    requested = [ project.strip() for value in flask.request.values.getlist('projects') for project in value.split(',') if project.strip() ]
+    if not requested and not settings.LISTPROJECTS:
+        return withheaders(flask.make_response("Listing projects is not allowed on this service, specify the projects to report on",403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+
+    projects, _ = getprojects(user)
+    indexed = { project: (size, status) for project, _, size, status in projects }
+    if not requested:
+        requested = sorted(indexed.keys())
+    onlyrunning = flask.request.values.get('running','') in ('1','yes','true')
+
+    result = []
+    for project in requested:
+        if project not in indexed or not Project.validate(project) or not Project.exists(project, user):
+            if not onlyrunning:
+                result.append({'project': project, 'error': "Project not found"})
+            continue
+        size, statuscode = indexed[project]
+        if onlyrunning and statuscode != clam.common.status.RUNNING:
+            continue
+        if statuscode == clam.common.status.READY:
+            #nothing to probe for projects that were never started
+            entry = {'project': project, 'statuscode': statuscode, 'message': "Accepting new input files and selection of parameters", 'completion': 0, 'exitstatus': None, 'size': size}
+        else:
+            statuscode, statusmsg, _, completion = Project.status(project, user)
+            if onlyrunning and statuscode != clam.common.status.RUNNING:
+                continue
+            entry = {'project': project, 'statuscode': statuscode, 'message': statusmsg, 'completion': completion, 'exitstatus': Project.exitstatus(project, user) if statuscode == clam.common.status.DONE else None, 'size': size}
+        result.append(entry)
+    return withheaders(flask.make_response(json.dumps(result)), 'application/json', {'allow_origin': settings.ALLOW_ORIGIN})
+
 def index(credentials = None):
     """Get list of projects or shortcut to other functionality"""
 
@@ -709,6 +797,8 @@ class Admin:
                 u = os.path.basename(f)
                 usersprojects[u], totalsize[u] = getprojects(u)
                 usersprojects[u].sort()
+        jobsummary = getindex().jobsummary()
+        jobtotals = jobsummary.pop(None)
 
         return withheaders(flask.make_response(flask.render_template('admin.html',
                 version=VERSION,
@@ -730,6 +820,8 @@ class Admin:
                 url=getrooturl(),
                 usersprojects = sorted(usersprojects.items()),
                 totalsize=totalsize,
+                jobsummary=sorted(jobsummary.items()),
+                jobtotals=jobtotals,
                 allow_origin=settings.ALLOW_ORIGIN,
                 oauth_access_token=oauth_encrypt(oauth_access_token)
         )), "text/html; charset=UTF-8", {'allow_origin':settings.ALLOW_ORIGIN}) #pylint: disable=bad-continuation
@@ -778,19 +870,64 @@ class Admin:
         elif command == 'abort':
             p = Project()
             if p.abort(project, targetuser):
+                if Project.state(project, targetuser).aborting:
+                    return withheaders(flask.make_response("Aborting",202),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
                 return withheaders(flask.make_response("Ok"),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
             else:
                 return withheaders(flask.make_response('Failed',403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
         elif command == 'delete':
             d = Project.path(project, targetuser)
             if os.path.isdir(d):
-                shutil.rmtree(d)
+                if Project.abort(project, targetuser, delete=True) and Project.state(project, targetuser).aborting:
+                    #deleted by the dispatcher once the process has ended
+                    return withheaders(flask.make_response("Aborting, the project will be deleted once the process has ended",202),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+                trash(d)
+                getindex().remove(targetuser, project)
                 return withheaders(flask.make_response("Ok"),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
             else:
                 return withheaders(flask.make_response('Not Found',403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+        elif command == 'reconcile':
+            #full recount of the disk usage, use project '*' for all projects of the user
+            if project == '*':
+                projects = [ os.path.basename(d) for d in glob.glob(settings.ROOT + "projects/" + targetuser + '/*') if os.path.isdir(d) ]
+            elif os.path.isdir(Project.path(project, targetuser)):
+                projects = [project]
+            else:
+                return withheaders(flask.make_response('Not Found',403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+            totalsize = 0.0
+            for p in projects:
+                size, _ = Project.getdiskusage(targetuser, p)
+                totalsize += size
+            printlog("Reconciled disk usage of " + str(len(projects)) + " project(s) of user " + targetuser + ": " + str(round(totalsize,2)) + " MB")
+            return withheaders(flask.make_response("Ok, " + str(len(projects)) + " project(s), " + str(round(totalsize,2)) + " MB"),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
         else:
             return withheaders(flask.make_response('No such command: ' + command,403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
 
+    @staticmethod
+    def stats(credentials=None):
+        """Resource usage summary over the job history (JSON), per user and in total, along with the most recent jobs and the current occupation of the scheduler"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        if not settings.ADMINS or user not in settings.ADMINS:
+            return flask.make_response('You shall not pass!!! You are not an administrator!',403)
+        index = getindex()
+        summary = index.jobsummary()
+        try:
+            limit = int(flask.request.values.get('limit', 100))
+        except ValueError:
+            limit = 100
+        data = {
+            'total': summary.pop(None),
+            'users': summary,
+            'jobs': index.jobs(flask.request.values.get('user'), limit),
+            'scheduler': {
+                'slots': settings.MAXCONCURRENTPROJECTS,
+                'running': [ {'user': u, 'project': p, 'weight': w} for u, p, w in runningjobs() ],
+                'queued': len(getjobqueue()),
+                'workers': [ {'name': name, 'host': host, 'slots': capacity, 'used': used, 'lastseen': round(time.time() - heartbeat, 1)} for name, host, _, capacity, used, heartbeat in getjobqueue().workers() ],
+            },
+        }
+        return withheaders(flask.make_response(json.dumps(data)), 'application/json', {'allow_origin': settings.ALLOW_ORIGIN})
+
     @staticmethod
     def downloader(targetuser, project, type, filename, credentials=None):
         user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
@@ -818,9 +955,7 @@ class Admin:
             mimetype = 'application/octet-stream'
         headers['allow_origin'] = settings.ALLOW_ORIGIN
         try:
-            return withheaders(flask.Response( (line for line in outputfile) ), mimetype, headers )
-        except UnicodeError:
-            return withheaders(flask.make_response("Output file " + str(outputfile) + " is not in the expected encoding! Make sure encodings for output templates service configuration file are accurate.",500),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+            return sendfile(str(outputfile), mimetype, headers)
         except FileNotFoundError:
             raise flask.abort(404)
         except IOError:
@@ -872,6 +1007,202 @@ def getbinarydata(path, buffersize=16*1024):
                 break
             else:
                 yield data
+
+def sendfile(path, contenttype, headers):
+    """Returns a response that sends the file as it is on disk. With SENDFILE set, the web server in front of CLAM is asked to send it (X-Accel-Redirect for nginx, X-Sendfile for Apache and lighttpd), otherwise it is passed to the WSGI server as a file (which may use sendfile()), either way it is never loaded into memory"""
+    if settings.SENDFILE == 'x-accel-redirect':
+        response = flask.Response(status=200)
+        response.headers['X-Accel-Redirect'] = settings.SENDFILE_PREFIX + quote(os.path.relpath(path, settings.ROOT))
+    elif settings.SENDFILE == 'x-sendfile':
+        response = flask.Response(status=200)
+        response.headers['X-Sendfile'] = os.fsencode(os.path.abspath(path)).decode('latin-1') #the path as raw bytes, headers are latin-1
+    else:
+        response = flask.send_file(os.path.abspath(path), contenttype, conditional=True)
+    return withheaders(response, contenttype, headers)
+
+
+class ProjectState:
+    """Snapshot of the state of a project, built from a single scan of the project directory and its journal (or, for legacy projects, the .pid, .done and .aborted sentinel files). Obtain it through Project.state(), which memoizes it for the duration of a request."""
+
+    def __init__(self, project, user):
+        self.project = project
+        self.user = user
+        self.path = Project.path(project, user)
+        self.files = set()
+        self.contents = {}
+        self._running = None
+        self._status = None
+        self._journal = False #not read yet
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    self.files.add(entry.name)
+            self.exists = True
+        except (FileNotFoundError, NotADirectoryError):
+            self.exists = False
+
+    def has(self, filename):
+        """Does the file exist in the project directory (at the time of the snapshot)?"""
+        return filename in self.files
+
+    def read(self, filename):
+        """Returns the (stripped) contents of a small sentinel file in the project directory, or None if it does not exist"""
+        if filename not in self.contents:
+            self.contents[filename] = None
+            if filename in self.files:
+                try:
+                    with open(self.path + filename,'r',encoding='utf-8') as f:
+                        self.contents[filename] = f.read(1024).strip()
+                except FileNotFoundError:
+                    pass
+        return self.contents[filename]
+
+    @property
+    def journal(self):
+        """The state according to the project's journal, or None for legacy projects that only have sentinel files"""
+        if self._journal is False:
+            self._journal = clam.common.journal.read(self.path) if self.has(clam.common.journal.JOURNALFILE) else None
+        return self._journal
+
+    @property
+    def pid(self):
+        if self.journal is not None:
+            return self.journal.pid if self.journal.started and not self.journal.done else 0
+        try:
+            return int(self.read('.pid'))
+        except (TypeError, ValueError):
+            return 0
+
+    @property
+    def done(self):
+        if self.journal is not None:
+            return self.journal.done
+        return self.has('.done')
+
+    @property
+    def queued(self):
+        """Is the project waiting in the job queue?"""
+        return self.journal is not None and self.journal.queued is not None
+
+    @property
+    def aborted(self):
+        if self.journal is not None:
+            return self.journal.aborted
+        return self.has('.aborted')
+
+    @property
+    def exitstatus(self):
+        if self.journal is not None:
+            return self.journal.exitstatus
+        return int(self.read('.done'))
+
+    @property
+    def stats(self):
+        """Resource usage of the last run (a dictionary, see clam.common.projectindex.JOBFIELDS), or None if not available"""
+        if self.has('.stats'):
+            try:
+                with open(self.path + '.stats','r',encoding='utf-8') as f:
+                    return json.load(f)
+            except (FileNotFoundError, ValueError):
+                pass
+        return None
+
+    @property
+    def aborting(self):
+        """Was an abort requested that the dispatcher has not completed yet?"""
+        if self.journal is not None:
+            return self.journal.abortrequested and not self.journal.done
+        return self.has('.abort') and not self.has('.done')
+
+    @property
+    def worker(self):
+        """Name of the worker agent running the project, None if the webservice runs it itself"""
+        if self.journal is not None:
+            return self.journal.worker
+        return None
+
+    @property
+    def alive(self):
+        """Is the process, or the dispatcher supervising it, still there? Unlike running, this never alters the journal."""
+        if not self.pid or self.done:
+            return False
+        if self.worker:
+            #runs on another host, we rely on the heartbeat of the worker agent
+            heartbeat = getjobqueue().worker(self.worker)
+            return heartbeat is not None and time.time() - heartbeat <= settings.WORKER_TIMEOUT
+        for pid in (self.pid, self.journal.dispatcher if self.journal is not None else 0):
+            if pid:
+                try:
+                    os.kill(pid, 0) #raises error if pid doesn't exist
+                    return True
+                except OSError:
+                    pass
+        return False
+
+    @property
+    def running(self):
+        if self._running is None:
+            self._running = self.alive
+            if not self._running and self.pid and not self.done:
+                try:
+                    #last change of the run state
+                    changed = os.path.getmtime(self.path + (clam.common.journal.JOURNALFILE if self.journal is not None else '.pid'))
+                except FileNotFoundError:
+                    changed = time.time()
+                if time.time() - changed > settings.LOST_GRACEPERIOD:
+                    #process is gone without the dispatcher finishing up (for longer than it takes it to do so), mark as failed
+                    printlog("Process of project '" + self.project + "' was lost")
+                    clam.common.journal.append(self.path, clam.common.journal.FINISHED, code=1, lost=True)
+                    self.files.add(clam.common.journal.JOURNALFILE)
+                    self._journal = clam.common.journal.read(self.path)
+        return self._running
+
+    def simplestatus(self):
+        if self.done:
+            return clam.common.status.DONE
+        elif self.running:
+            return clam.common.status.RUNNING
+        elif self.queued:
+            return clam.common.status.QUEUED
+        else:
+            return clam.common.status.READY
+
+    def status(self):
+        """Returns a (statuscode, statusmessage, statuslog, completion) tuple"""
+        if self._status is None:
+            if self.running:
+                statuslog, completion = clam.common.status.readlog(self.path + ".status")
+                if self.aborting:
+                    if self.journal is not None and self.journal.deleterequested:
+                        self._status = (clam.common.status.RUNNING, "Aborting, waiting for the process to end, the project will be deleted afterwards", statuslog, completion)
+                    else:
+                        self._status = (clam.common.status.RUNNING, "Aborting, waiting for the process to end", statuslog, completion)
+                elif statuslog:
+                    self._status = (clam.common.status.RUNNING, statuslog[0][0],statuslog, completion)
+                else:
+                    self._status = (clam.common.status.RUNNING, "The system is running",  [], 0) #running
+            elif self.done:
+                statuslog, completion = clam.common.status.readlog(self.path + ".status")
+                if self.aborted:
+                    if not statuslog:
+                        completion = 100
+                    self._status = (clam.common.status.DONE, "Aborted! Output may be partial or unavailable", statuslog, completion)
+                elif statuslog:
+                    self._status = (clam.common.status.DONE, statuslog[0][0],statuslog, completion)
+                else:
+                    self._status = (clam.common.status.DONE, "Done", statuslog, 100)
+            elif self.queued:
+                position = getjobqueue().position(self.user, self.project)
+                if position is None:
+                    #taken from the queue, being launched right now
+                    self._status = (clam.common.status.QUEUED, "Queued, about to be started", [], 0)
+                else:
+                    self._status = (clam.common.status.QUEUED, "Queued, waiting for resources to become available (position " + str(position) + " of " + str(len(getjobqueue())) + ")", [], 0)
+            else:
+                self._status = (clam.common.status.READY, "Accepting new input files and selection of parameters", [], 0)
+        return self._status
+
+
 class Project:
     """This class simply groups project methods, is not instantiated and does not offer any kind of persistence, all methods are static"""
 
@@ -887,11 +1218,28 @@ class Project:
 
     @staticmethod
     def getdiskusage(user, project):
+        """Full recount of the disk usage of the project, updates the counters in the project index. This walks the entire input and output directories, normally the index is kept up to date incrementally (see Project.adjustdiskusage())"""
         path = settings.ROOT + "projects/" + user + '/' + project + "/"
-        size, count = computediskusage(path)
-        with open(os.path.join(path,'.du'),'w') as f:
-            f.write(str(size) + "\n")
-            f.write(str(count))
+        return getindex().reconcile(user, project, path)
+
+    @staticmethod
+    def adjustdiskusage(user, project, section, size, files):
+        """Adjust the disk usage counters for the project in the index, size is in bytes, both size and files may be negative. Section is either input or output."""
+        getindex().adjust(user, project, section, size / 1024 / 1024, files)
+
+    @staticmethod
+    def filediskusage(*paths):
+        """Returns the size (in bytes) and number of files for the specified paths, counted the same way as computediskusage() does (i.e. symbolic links count as the file they point to, directories are walked), non-existing paths are ignored"""
+        size = 0
+        count = 0
+        for path in paths:
+            if os.path.isdir(path):
+                dirsize, dircount = computediskusage(path)
+                size += dirsize * 1024 * 1024
+                count += dircount
+            elif os.path.exists(path):
+                size += os.path.getsize(path)
+                count += 1
         return size, count
 
     @staticmethod
@@ -938,174 +1286,189 @@ class Project:
             if not os.path.isdir(settings.ROOT + "projects/" + user + '/' + project + '/tmp'):
                 return withheaders(flask.make_response("tmp directory " + settings.ROOT + "projects/" + user + '/' + project + "/tmp/  could not be created succesfully",403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
 
-        Project.updateindex(user, project, 0.0, clam.common.status.READY)
+        Project.invalidatestate(project, user)
+        Project.updateindex(user, project, clam.common.status.READY)
 
         return None #checks rely on this
 
     @staticmethod
-    def updateindex(user: str, project: str, size: float, status: int) -> None:
-        #Add project to index cache file
-        indexfile = os.path.join(settings.ROOT , "projects" , user,'.index')
-        if os.path.exists(indexfile):
-            with open(os.path.join(indexfile),'r',encoding='utf-8') as f:
-                try:
-                    data = json.load(f)
-                    index = -1
-                    if 'projects' in data:
-                        for i, projectdata in enumerate(data['projects']):
-                            current_project, current_timestamp, current_size, current_status = projectdata
-                            if current_project == project:
-                                if current_size == size and current_status == status:
-                                    return #all is well, project already in index, nothing to do
-                                # Project found, but something changed, update it!
-                                index = i
-                                break
-                    d = datetime.datetime.fromtimestamp(os.stat(os.path.join(settings.ROOT ,"projects" , user , project))[8])
-                    projectdata = ( project , d.strftime("%Y-%m-%d %H:%M:%S"), size, status )
-                    if index != -1:
-                        data['projects'][index] = projectdata
-                    else:
-                        data['projects'].append(projectdata)
-                    with open(indexfile,'w',encoding='utf-8') as f:
-                        json.dump(data,f, ensure_ascii=False)
-                except ValueError:
-                    #something went wrong, delete the entire index (will be recomputed)
-                    os.unlink(indexfile)
+    def updateindex(user: str, project: str, status: int) -> None:
+        """Add or update the project (status and modification time) in the project index"""
+        getindex().update(user, project, status, clam.common.projectindex.timestamp(os.path.join(settings.ROOT ,"projects" , user , project)))
+
+    @staticmethod
+    def state(project, user):
+        """Returns a ProjectState snapshot for the project, memoized for the duration of the current request"""
+        if flask.has_request_context():
+            states = flask.g.setdefault('projectstates', {})
+            if (user, project) not in states:
+                states[(user, project)] = ProjectState(project, user)
+            return states[(user, project)]
+        return ProjectState(project, user)
+
+    @staticmethod
+    def invalidatestate(project, user):
+        """Discard the memoized state of the project, needs to be called after anything that changes the project's state within a request"""
+        if flask.has_request_context() and 'projectstates' in flask.g:
+            flask.g.projectstates.pop((user, project), None)
 
     @staticmethod
     def pid(project, user):
-        pidfile = Project.path(project, user) + '.pid'
-        if os.path.isfile(pidfile):
-            f = open(pidfile,'r')
-            pid = int(f.read(os.path.getsize(pidfile)))
-            f.close()
-            return pid
-        else:
-            return 0
+        return Project.state(project, user).pid
 
     @staticmethod
     def running(project, user):
-        pidfile = Project.path(project, user) + '.pid'
-        if os.path.isfile(pidfile) and not os.path.isfile(Project.path(project, user) + ".done"):
-            f = open(pidfile,'r')
-            pid = int(f.read(os.path.getsize(pidfile)))
-            f.close()
-            try:
-                os.kill(pid, 0) #raises error if pid doesn't exist
+        return Project.state(project, user).running
+
+
+    @staticmethod
+    def abort(project, user, delete=False):
+        """Abort the project. If it is running, the abort is requested from its dispatcher and this returns right away, without waiting for the process to end; with delete set, the dispatcher deletes the project once the process has ended. Returns False if there was nothing to abort."""
+        state = Project.state(project, user)
+        if state.queued:
+            if Project.dequeue(project, user):
                 return True
-            except:
-                f = open(Project.path(project, user) + ".done", 'w')
-                f.write(str(1) )
-                f.close()
-                os.unlink(pidfile)
-                return False
+            Project.invalidatestate(project, user)
+            state = Project.state(project, user)
+            if not state.running and not state.done:
+                #the scheduler took it from the queue but has not started it yet, the request is carried over to the dispatcher it launches
+                printlog("Aborting project '" + project + "', which is being started")
+                clam.common.journal.append(Project.path(project, user), clam.common.journal.ABORT, delete=delete)
+                Project.invalidatestate(project, user)
+                return True
+        if not state.running:
+            return False #also if the process is gone, its pid may have been reused by now
+        printlog("Aborting process of project '" + project + "'" )
+        if state.journal is None:
+            #legacy run (started before there was a journal), signal through sentinel files, its dispatcher writes .done once the process has ended
+            f = open(Project.path(project,user) + ".abort", 'w')
+            f.close()
+            os.chmod( Project.path(project,user) + ".abort", 0o777)
         else:
-            return False
+            if delete:
+                clam.common.journal.append(Project.path(project, user), clam.common.journal.ABORT, delete=True)
+            else:
+                clam.common.journal.append(Project.path(project, user), clam.common.journal.ABORT)
+            if state.journal.dispatcher and not state.journal.worker and not settings.REMOTEHOST:
+                #wake the dispatcher so it acts on the request right away, otherwise it is picked up at its next periodic check of the journal
+                try:
+                    os.kill(state.journal.dispatcher, clam.common.journal.ABORTSIGNAL)
+                except OSError:
+                    pass #already gone
+        Project.invalidatestate(project, user)
+        return True
+
+    @staticmethod
+    def weight(project, user, parameters):
+        """Returns the number of slots the project takes when it runs: the highest weight of the profiles it matches"""
+        if all(profile.weight == 1 for profile in settings.PROFILES):
+            return 1 #no need to match anything
+        weights = [ profile.weight for profile in settings.PROFILES if profile.match(Project.path(project, user), parameters)[0] ]
+        return max(weights) if weights else 1
 
+    @staticmethod
+    def enqueue(project, user, cmd, weight=1):
+        """Add the project to the job queue, it will be started by the scheduler once there are sufficient resources. Returns the position in the queue."""
+        position = getjobqueue().push(user, project, cmd, weight)
+        clam.common.journal.append(Project.path(project, user), clam.common.journal.QUEUED)
+        printlog("Queued project '" + project + "' of user " + user + " at position " + str(position))
+        Project.invalidatestate(project, user)
+        Project.updateindex(user, project, clam.common.status.QUEUED)
+        if JOBSCHEDULER is not None:
+            JOBSCHEDULER.wake()
+        return position
 
     @staticmethod
-    def abort(project, user):
-        if Project.pid(project, user) == 0:
+    def dequeue(project, user):
+        """Remove the project from the job queue, returns False if it was not queued (anymore)"""
+        if not getjobqueue().remove(user, project):
             return False
-        printlog("Aborting process of project '" + project + "'" )
-        f = open(Project.path(project,user) + ".abort", 'w')
-        f.close()
-        os.chmod( Project.path(project,user) + ".abort", 0o777)
-        while not os.path.exists(Project.path(project, user) + ".done"):
-            printdebug("Waiting for process to die")
-            time.sleep(1)
+        printlog("Removed project '" + project + "' of user " + user + " from the queue")
+        clam.common.journal.append(Project.path(project, user), clam.common.journal.DEQUEUED)
+        Project.invalidatestate(project, user)
+        Project.updateindex(user, project, clam.common.status.READY)
         return True
 
+    @staticmethod
+    def launch(project, user, cmd, weight=1):
+        """Launch the dispatcher for the project with the specified command, returns the pid or None on failure. The project is registered as running, taking the specified number of slots, until the dispatcher finishes."""
+        pid = None
+        socketpath = getlauncher() if settings.LAUNCHER and not settings.REMOTEHOST else None
+        if socketpath:
+            printlog("Starting dispatcher through launcher with " + settings.COMMAND + ": " + repr(cmd) + " ..." )
+            try:
+                #the command is passed unsplit, the dispatcher hands it to the shell as it is (like the shell fallback below)
+                pid = clam.common.launcher.launch(socketpath, [settingsmodule, Project.path(project, user), cmd], Project.path(project, user) + "output/error.log", settings.CLAMDIR)
+            except (OSError, ValueError, clam.common.launcher.LauncherError) as e:
+                printlog("WARNING: Launcher failed to start dispatcher, falling back to the shell: " + str(e))
+        if pid is None:
+            cmd = Project.dispatchercommand(project, user, cmd)
+            printlog("Starting dispatcher " +  settings.DISPATCHER + " with " + settings.COMMAND + ": " + repr(cmd) + " ..." )
+            #process = subprocess.Popen(cmd,cwd=Project.path(project), shell=True)
+            process = subprocess.Popen(cmd,cwd=settings.CLAMDIR, shell=True)
+            if not process:
+                return None
+            pid = process.pid
+        printlog("Started dispatcher with pid " + str(pid) )
+        clam.common.journal.append(Project.path(project, user), clam.common.journal.STARTED, pid=pid)
+        getjobqueue().addrunning(user, project, pid, weight)
+        getjobqueue().setshare(user, served=time.time())
+        Project.invalidatestate(project, user)
+        Project.updateindex(user, project, clam.common.status.RUNNING)
+        return pid
+
+    @staticmethod
+    def dispatchercommand(project, user, cmd):
+        """Returns the shell command that runs the dispatcher for the project with the specified (shell-safe) command"""
+        cmd += " 2> " + Project.path(project, user) + "output/error.log" #add error output
+
+        #if settings.DISPATCHER == 'clamdispatcher' and os.path.exists(settings.CLAMDIR + '/' + settings.DISPATCHER + '.py') and stat.S_IXUSR & os.stat(settings.CLAMDIR + '/' + settings.DISPATCHER+'.py')[stat.ST_MODE]:
+        #    #backward compatibility for old configurations without setuptools
+        #    cmd = settings.CLAMDIR + '/' + settings.DISPATCHER + '.py'
+        #else:
+        cmd = settings.DISPATCHER + ' ' + settingsmodule + ' ' + Project.path(project, user) + ' ' + cmd
+        venv = os.environ.get('VIRTUAL_ENV')
+        if venv:
+            cmd = f". {venv}/bin/activate && " + cmd
+        elif settings.REMOTEHOST:
+            if settings.REMOTEUSER:
+                cmd = "ssh -o NumberOfPasswordPrompts=0 " + settings.REMOTEUSER + "@" + settings.REMOTEHOST + " " + cmd
+            else:
+                cmd = "ssh -o NumberOfPasswordPrompts=0 " + settings.REMOTEHOST + " " + cmd
+        return cmd
+
     @staticmethod
     def done(project,user):
-        return os.path.isfile(Project.path(project, user) + ".done")
+        return Project.state(project, user).done
 
     @staticmethod
     def aborted(project,user):
-        return os.path.isfile(Project.path(project, user) + ".aborted")
+        return Project.state(project, user).aborted
 
 
     @staticmethod
     def exitstatus(project, user):
-        f = open(Project.path(project, user) + ".done")
-        status = int(f.read(1024))
-        f.close()
-        return status
+        return Project.state(project, user).exitstatus
 
     @staticmethod
     def exists(project, credentials):
         """Check if the project exists"""
         user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
         printdebug("Checking if project " + project + " exists for " + user)
-        return os.path.isdir(Project.path(project, user))
+        return Project.state(project, user).exists
 
     @staticmethod
     def statuslog(project, user):
-        statuslog = []
-        statusfile = Project.path(project,user) + ".status"
-        totalcompletion = 0
-        if os.path.isfile(statusfile): #pylint: disable=too-many-nested-blocks
-            prevmsg = None
-            with open(statusfile, 'r', encoding='utf-8') as f:
-                for line in f: #pylint: disable=too-many-nested-blocks
-                    line = line.strip()
-                    if line:
-                        message = ""
-                        completion = 0
-                        timestamp = ""
-                        for field in line.split("\t"):
-                            if field:
-                                if field[-1] == '%' and field[:-1].isdigit():
-                                    completion = int(field[:-1])
-                                    if completion > 0:
-                                        totalcompletion = completion
-                                elif DATEMATCH.match(field):
-                                    if field.isdigit():
-                                        try:
-                                            d = datetime.datetime.fromtimestamp(float(field))
-                                            timestamp = d.strftime("%d/%b/%Y %H:%M:%S")
-                                        except ValueError:
-                                            pass
-                                else:
-                                    message += " " + field
-
-                        if message and (message != prevmsg):
-                            #print "STATUSLOG: t=",timestamp,"c=",completion,"msg=" + message.strip()
-                            statuslog.append( (message.strip(), timestamp, completion) )
-                            prevmsg = message
-            statuslog.reverse()
-        return statuslog, totalcompletion
+        """Returns the status log (newest entry first) and the total completion, the status file is read incrementally"""
+        return clam.common.status.readlog(Project.path(project,user) + ".status")
 
     @staticmethod
     def status(project, user):
-        if Project.running(project, user):
-            statuslog, completion = Project.statuslog(project, user)
-            if statuslog:
-                return (clam.common.status.RUNNING, statuslog[0][0],statuslog, completion)
-            else:
-                return (clam.common.status.RUNNING, "The system is running",  [], 0) #running
-        elif Project.done(project, user):
-            statuslog, completion = Project.statuslog(project, user)
-            if Project.aborted(project,user):
-                if not statuslog:
-                    completion = 100
-                return (clam.common.status.DONE, "Aborted! Output may be partial or unavailable", statuslog, completion)
-            else:
-                if statuslog:
-                    return (clam.common.status.DONE, statuslog[0][0],statuslog, completion)
-                else:
-                    return (clam.common.status.DONE, "Done", statuslog, 100)
-        else:
-            return (clam.common.status.READY, "Accepting new input files and selection of parameters", [], 0)
+        return Project.state(project, user).status()
 
     @staticmethod
     def simplestatus(project, user):
-        if Project.done(project, user):
-            return clam.common.status.DONE
-        elif Project.running(project, user):
-            return clam.common.status.RUNNING
-        else:
-            return clam.common.status.READY
+        return Project.state(project, user).simplestatus()
 
     @staticmethod
     def status_json(project, credentials=None):
@@ -1120,12 +1483,81 @@ class Project:
             return "{success: false, error: 'No accesstoken given'}"
         if accesstoken != Project.getaccesstoken(user,project):
             return "{success: false, error: 'Invalid accesstoken given'}"
-        if not os.path.exists(Project.path(project, user)):
+        if not Project.exists(project, user):
             return "{success: false, error: 'Destination does not exist'}"
 
         statuscode, statusmsg, statuslog, completion = Project.status(project,user)
         return json.dumps({'success':True, 'statuscode':statuscode,'statusmsg':statusmsg, 'statuslog': statuslog, 'completion': completion})
 
+    @staticmethod
+    def events(project, credentials=None):
+        """Server-Sent Events stream pushing changes in status, status log and completion for the project, as an alternative to polling. The stream is closed when the project is done, or after EVENTS_MAXDURATION seconds as it occupies a worker (thread) of the WSGI server; the client then reconnects and resumes after the last log entry it received (Last-Event-ID). Authentication is like status_json (user and accesstoken parameters)"""
+        user = flask.request.values.get('user', 'anonymous')
+        if 'accesstoken' not in flask.request.values:
+            return withheaders(flask.make_response("No accesstoken given",403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+        if flask.request.values['accesstoken'] != Project.getaccesstoken(user,project):
+            return withheaders(flask.make_response("Invalid accesstoken given",403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+        if not Project.exists(project, user):
+            return withheaders(flask.make_response("Project " + project + " was not found for user " + user,404),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+
+        def event(eventtype, data, eventid=None):
+            return ("id: " + eventid + "\n" if eventid else "") + "event: " + eventtype + "\ndata: " + json.dumps(data) + "\n\n"
+
+        def entryid(entry):
+            """Identifies a status log entry, sent as the ID of log events so a reconnecting client can resume after it"""
+            return hashlib.sha1(json.dumps(entry).encode('utf-8')).hexdigest()[:16]
+
+        lasteventid = flask.request.headers.get('Last-Event-ID')
+
+        def generate():
+            yield "retry: " + str(int(settings.EVENTS_INTERVAL * 1000)) + "\n\n"
+            laststate = None
+            lastentry = None
+            started = lastsent = time.time()
+            first = True
+            while True:
+                state = ProjectState(project, user) #fresh snapshot on every iteration
+                if not state.exists:
+                    yield event('error', {'error': "Project no longer exists"})
+                    return
+                statuscode, statusmsg, statuslog, completion = state.status()
+                if first and lasteventid:
+                    #reconnected, resume after the last entry the client received (if it is still in the log)
+                    for entry in statuslog:
+                        if entryid(entry) == lasteventid:
+                            lastentry = entry
+                            break
+                first = False
+                if statuslog and statuslog[0] != lastentry:
+                    #only send the log entries that are new since the last event (oldest first)
+                    newentries = []
+                    for entry in statuslog:
+                        if entry == lastentry:
+                            break
+                        newentries.append(entry)
+                    newentries.reverse()
+                    lastentry = statuslog[0]
+                    yield event('log', newentries, entryid(lastentry))
+                    lastsent = time.time()
+                if (statuscode, statusmsg, completion) != laststate:
+                    laststate = (statuscode, statusmsg, completion)
+                    data = {'statuscode': statuscode, 'statusmsg': statusmsg, 'completion': completion}
+                    if statuscode == clam.common.status.DONE:
+                        data['exitstatus'] = state.exitstatus
+                        data['aborted'] = state.aborted
+                        yield event('done', data)
+                        return
+                    yield event('status', data)
+                    lastsent = time.time()
+                elif time.time() - lastsent >= settings.EVENTS_HEARTBEAT:
+                    yield ": heartbeat\n\n"
+                    lastsent = time.time()
+                if settings.EVENTS_MAXDURATION and time.time() - started >= settings.EVENTS_MAXDURATION:
+                    return #free the worker, the client reconnects
+                time.sleep(settings.EVENTS_INTERVAL)
+
+        return withheaders(flask.Response(generate()), "text/event-stream", headers={'allow_origin': settings.ALLOW_ORIGIN, 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     @staticmethod
     def inputindex(project, user, d = ''):
         prefix = Project.path(project, user) + 'input/'
@@ -1160,15 +1592,12 @@ class Project:
     @staticmethod
     def inputindexbytemplate(project, user, inputtemplate):
         """Retrieve sorted index for the specified input template"""
-        index = [] #pylint: disable=redefined-outer-name
-        prefix = Project.path(project, user) + 'input/'
-        for linkf, f in globsymlinks(prefix + '.*.INPUTTEMPLATE.' + inputtemplate.id + '.*'):
-            seq = int(linkf.split('.')[-1])
-            index.append( (seq,f) )
+        with clam.common.manifest.Manifest(Project.path(project, user)) as manifest:
+            index = manifest.files(inputtemplate.id) #pylint: disable=redefined-outer-name
 
         #yield CLAMFile objects in proper sequence
-        for seq, f in sorted(index):
-            yield seq, clam.common.data.CLAMInputFile(Project.path(project, user), f[len(prefix):])
+        for seq, f, _ in index:
+            yield seq, clam.common.data.CLAMInputFile(Project.path(project, user), f)
 
 
     @staticmethod
@@ -1208,7 +1637,9 @@ class Project:
         #quick mode skips metadata loading and may be useful on very large projects
         quick = 'quick' in flask.request.values and str(flask.request.values['quick']) == "1"
 
+        stats = None
         if statuscode == clam.common.status.DONE:
+            stats = Project.state(project, user).stats
             outputpaths = list(Project.outputindex(project, user,'',quick=quick))
             if Project.exitstatus(project, user) != 0: #non-zero codes indicate errors!
                 errors = "yes"
@@ -1252,6 +1683,7 @@ class Project:
                 statusmessage=statusmsg,
                 statuslog=statuslog,
                 completion=completion,
+                stats=stats,
                 errors=errors,
                 errormsg=errormsg,
                 parameterdata=parameters,
@@ -1349,6 +1781,8 @@ class Project:
         statuscode, _, _, _  = Project.status(project, user)
         if statuscode != clam.common.status.READY:
             return withheaders(flask.redirect(getrooturl() + '/' + project),headers={'allow_origin': settings.ALLOW_ORIGIN})
+        if AsyncUpload.pending(Project.path(project, user)):
+            return withheaders(flask.make_response("Uploaded files are still being processed, try again once the upload is done",409),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
 
         #Generate arguments based on POSTed parameters
         commandlineparams = []
@@ -1356,7 +1790,25 @@ class Project:
 
         errors, parameters, commandlineparams = clam.common.data.processparameters(postdata, settings.PARAMETERS)
 
-        sufresources, resmsg = sufficientresources(user, project)
+        queue = False
+        weight = 1
+        sufresources, resmsg = checkquota(user, project)
+        if sufresources and settings.WORKERS:
+            #projects are run by worker agents, which decide for themselves whether they have the resources
+            weight = Project.weight(project, user, parameters)
+            if settings.QUEUE_MAXLENGTH and len(getjobqueue()) >= settings.QUEUE_MAXLENGTH:
+                sufresources, resmsg = False, "The job queue is full."
+            else:
+                queue = True
+        elif sufresources:
+            weight = Project.weight(project, user, parameters)
+            sufresources, resmsg = availableresources(user, weight)
+            #with a job queue, the project waits for resources instead of being refused (and does not overtake projects that are already waiting)
+            if settings.QUEUE and (not sufresources or len(getjobqueue()) > 0):
+                if settings.QUEUE_MAXLENGTH and len(getjobqueue()) >= settings.QUEUE_MAXLENGTH:
+                    sufresources, resmsg = False, "The job queue is full."
+                else:
+                    sufresources = queue = True
         if not sufresources:
             printlog("*** NOT ENOUGH SYSTEM RESOURCES AVAILABLE: " + resmsg + " ***")
             return withheaders(flask.make_response("There are not enough system resources available to accommodate your request. " + resmsg + " .Please try again later.",503),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
@@ -1403,32 +1855,10 @@ class Project:
             cmd = cmd.replace('$OAUTH_ACCESS_TOKEN',oauth_access_token)
             cmd = clam.common.data.escapeshelloperators(cmd)
             #everything should be shell-safe now
-            cmd += " 2> " + Project.path(project, user) + "output/error.log" #add error output
-
-
-            #if settings.DISPATCHER == 'clamdispatcher' and os.path.exists(settings.CLAMDIR + '/' + settings.DISPATCHER + '.py') and stat.S_IXUSR & os.stat(settings.CLAMDIR + '/' + settings.DISPATCHER+'.py')[stat.ST_MODE]:
-            #    #backward compatibility for old configurations without setuptools
-            #    cmd = settings.CLAMDIR + '/' + settings.DISPATCHER + '.py'
-            #else:
-            cmd = settings.DISPATCHER + ' ' + settingsmodule + ' ' + Project.path(project, user) + ' ' + cmd
-            venv = os.environ.get('VIRTUAL_ENV')
-            if venv:
-                cmd = f". {venv}/bin/activate && " + cmd
-            elif settings.REMOTEHOST:
-                if settings.REMOTEUSER:
-                    cmd = "ssh -o NumberOfPasswordPrompts=0 " + settings.REMOTEUSER + "@" + settings.REMOTEHOST + " " + cmd
-                else:
-                    cmd = "ssh -o NumberOfPasswordPrompts=0 " + settings.REMOTEHOST + " " + cmd
 
-            printlog("Starting dispatcher " +  settings.DISPATCHER + " with " + settings.COMMAND + ": " + repr(cmd) + " ..." )
-            #process = subprocess.Popen(cmd,cwd=Project.path(project), shell=True)
-            process = subprocess.Popen(cmd,cwd=settings.CLAMDIR, shell=True)
-            if process:
-                pid = process.pid
-                printlog("Started dispatcher with pid " + str(pid) )
-                with open(Project.path(project, user) + '.pid','w') as f: #will be handled by dispatcher!
-                    f.write(str(pid))
-                Project.updateindex(user, project, 0.0, clam.common.status.RUNNING)
+            if queue:
+                Project.enqueue(project, user, cmd, weight)
+            if queue or Project.launch(project, user, cmd, weight):
                 if shortcutresponse is True:
                     #redirect to project page to lose parameters in URL
                     return withheaders(flask.redirect(getrooturl() + '/' + project),headers={'allow_origin': settings.ALLOW_ORIGIN})
@@ -1450,37 +1880,31 @@ class Project:
             return withheaders(flask.make_response("No such project: " + project + " for user " + user,404),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
         statuscode, _, _, _  = Project.status(project, user)
         msg = ""
-        if statuscode == clam.common.status.RUNNING:
-            Project.abort(project, user)
+        if not abortonly and AsyncUpload.pending(Project.path(project, user)):
+            return withheaders(flask.make_response("Uploaded files are still being processed, try again once the upload is done",409),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+        if statuscode in (clam.common.status.RUNNING, clam.common.status.QUEUED):
+            Project.abort(project, user, delete=not abortonly)
+            state = Project.state(project, user)
+            if state.aborting:
+                #the dispatcher ends the process (and deletes the project, if requested) in the background
+                if abortonly:
+                    msg = "Aborting"
+                elif state.journal is None:
+                    msg = "Aborting, delete the project again once the process has ended" #legacy dispatchers do not delete projects
+                else:
+                    msg = "Aborting, the project will be deleted once the process has ended"
+                return withheaders(flask.make_response(msg,202),'text/plain',{'Content-Length':len(msg), 'allow_origin': settings.ALLOW_ORIGIN})
             msg = "Aborted"
         if not abortonly:
             printlog("Deleting project '" + project + "'" )
-            shutil.rmtree(Project.path(project, user))
+            try:
+                trash(Project.path(project, user))
+            except FileNotFoundError:
+                pass #the dispatcher deleted it already
+            getindex().remove(user, project)
+            Project.invalidatestate(project, user)
             msg += " Deleted"
         msg = msg.strip()
-        indexfile = os.path.join(settings.ROOT , "projects" , user,'.index')
-        if os.path.exists(indexfile):
-            #delete project from the index cache
-            data = {}
-            with open(indexfile,'r',encoding='utf-8') as f:
-                try:
-                    data = json.load(f)
-                except ValueError:
-                    #delete the entire index
-                    data = {'projects': []}
-                    os.unlink(indexfile)
-            totalsize = 0.0
-            newdata = {
-                'projects': [],
-                'totalsize': 0.0,
-            }
-            for i, projectdata in enumerate(data['projects']):
-                if projectdata[0] != project:
-                    newdata['projects'].append(projectdata)
-                    totalsize += projectdata[2]
-            newdata['totalsize'] = totalsize
-            with open(indexfile,'w',encoding='utf-8') as f:
-                json.dump(newdata,f, ensure_ascii=False)
 
         return withheaders(flask.make_response(msg),'text/plain',{'Content-Length':len(msg), 'allow_origin': settings.ALLOW_ORIGIN})  #200
 
@@ -1608,9 +2032,7 @@ class Project:
             headers['allow_origin'] = settings.ALLOW_ORIGIN
             printdebug("Returning output file " + str(outputfile) + " with mimetype " + mimetype + " and headers: " + repr(headers))
             try:
-                return withheaders(flask.Response( (line for line in outputfile) ), mimetype, headers )
-            except UnicodeError:
-                return flask.make_response("Output file " + str(outputfile) + " is not in the expected encoding! Make sure encodings for output templates service configuration file are accurate.",500)
+                return sendfile(str(outputfile), mimetype, headers)
             except FileNotFoundError:
                 raise flask.abort(404)
             except IOError:
@@ -1634,7 +2056,9 @@ class Project:
             return withheaders(flask.make_response(msg), 'text/plain',{'Content-Length':len(msg), 'allow_origin': settings.ALLOW_ORIGIN}) #200
         elif os.path.isdir(Project.path(project, user) + filename):
             #Deleting specified directory
-            shutil.rmtree(Project.path(project, user) + filename)
+            size, count = Project.filediskusage(Project.path(project, user) + filename)
+            trash(Project.path(project, user) + filename)
+            Project.adjustdiskusage(user, project, 'output', -size, -count)
             msg = "Deleted"
             return withheaders(flask.make_response(msg), 'text/plain',{'Content-Length':len(msg), 'allow_origin': settings.ALLOW_ORIGIN}) #200
         else:
@@ -1643,10 +2067,12 @@ class Project:
             except:
                 raise flask.abort(404)
 
+            size, count = Project.filediskusage(Project.path(project, user) + 'output/' + filename, Project.path(project, user) + 'output/' + file.metafilename())
             success = file.delete()
             if not success:
                 raise flask.abort(404)
             else:
+                Project.adjustdiskusage(user, project, 'output', -size, -count)
                 msg = "Deleted"
                 return withheaders(flask.make_response(msg), 'text/plain',{'Content-Length':len(msg), 'allow_origin': settings.ALLOW_ORIGIN}) #200
 
@@ -1656,15 +2082,20 @@ class Project:
         """Reset system, delete all output files and prepare for a new run"""
         d = Project.path(project, user) + "output"
         if os.path.isdir(d):
-            shutil.rmtree(d)
+            trash(d)
             os.makedirs(d)
+            getindex().setusage(user, project, 'output', 0.0, 0)
         else:
             raise flask.abort(404)
-        if os.path.exists(Project.path(project, user) + ".done"):
+        if os.path.exists(Project.path(project, user) + ".done"): #legacy
             os.unlink(Project.path(project, user) + ".done")
         if os.path.exists(Project.path(project, user) + ".status"):
             os.unlink(Project.path(project, user) + ".status")
-        Project.updateindex(user, project, 0.0, clam.common.status.READY)
+        if os.path.exists(Project.path(project, user) + ".stats"):
+            os.unlink(Project.path(project, user) + ".stats")
+        clam.common.journal.append(Project.path(project, user), clam.common.journal.RESET)
+        Project.invalidatestate(project, user)
+        Project.updateindex(user, project, clam.common.status.READY)
 
     @staticmethod
     def getarchive(project, user, format=None):
@@ -1695,7 +2126,7 @@ class Project:
             }
             if contentencoding:
                 extraheaders['Content-Encoding'] = contentencoding
-            return withheaders(flask.Response( getbinarydata(archivefile) ), contenttype, extraheaders )
+            return sendfile(archivefile, contenttype, extraheaders)
 
 
     @staticmethod
@@ -1747,14 +2178,87 @@ class Project:
             headers['allow_origin'] = settings.ALLOW_ORIGIN
             try:
                 printdebug("Returning input file " + str(inputfile) + " with mimetype " + mimetype)
-                return withheaders(flask.Response( (line for line in inputfile) ), mimetype, headers )
-            except UnicodeError:
-                return withheaders(flask.make_response("Input file " + str(inputfile) + " is not in the expected encoding! Make sure encodings for output templates service configuration file are accurate.",500),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+                return sendfile(str(inputfile), mimetype, headers)
             except FileNotFoundError:
                 raise flask.abort(404)
             except IOError:
                 raise flask.abort(404)
 
+    @staticmethod
+    def uploadstatus(project, uploadid, credentials=None):
+        """Status of an upload whose files are processed in the background: 202 with the progress (JSON) while it is being processed, the upload response once done"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        status = None
+        if all(c in '0123456789abcdef' for c in uploadid):
+            status = AsyncUpload.read(Project.path(project, user), uploadid)
+        if status is None:
+            return withheaders(flask.make_response("No such upload",404),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+        if not status.get('finished'):
+            msg = json.dumps({'id': uploadid, 'url': getrooturl() + '/' + project + '/upload/' + uploadid + '/', 'total': status['total'], 'done': status['done']})
+            return withheaders(flask.make_response(msg, 202), 'application/json', {'allow_origin': settings.ALLOW_ORIGIN})
+        AsyncUpload.remove(Project.path(project, user), uploadid) #the result is handed out only once
+        return withheaders(flask.make_response(status['body'], status['code']), status['contenttype'], {'allow_origin': settings.ALLOW_ORIGIN})
+
+    @staticmethod
+    def newresumable(project, credentials=None):
+        """Start a resumable upload, the size (in bytes) of the file to upload is mandatory"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        response = Project.create(project, user)
+        if response is not None:
+            return response
+        if Project.simplestatus(project, user) != clam.common.status.READY:
+            return withheaders(flask.make_response("No input files accepted at this stage",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        postdata = flask.request.values
+        try:
+            size = int(postdata['size'])
+            if size < 0:
+                raise ValueError
+        except (KeyError, ValueError):
+            return withheaders(flask.make_response("No valid size specified",400),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        budget = uploadbudget(user, project)
+        if budget is not None and size > budget * 1024 * 1024:
+            return withheaders(flask.make_response("You exceeded your disk quota, unable to accept a file of this size",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        session = clam.common.resumable.Session.create(Project.path(project, user), size, os.path.basename(postdata.get('filename','')))
+        printlog("Started resumable upload " + session.id + " of " + str(size) + " bytes")
+        url = getrooturl() + '/' + project + '/resumable/' + session.id + '/'
+        return withheaders(flask.make_response(json.dumps(session.json(url)), 201), 'application/json', {'Location': url, 'allow_origin': settings.ALLOW_ORIGIN})
+
+    @staticmethod
+    def resumable(project, uploadid, credentials=None):
+        """Handles a resumable upload: GET reports which ranges were received, PUT sends a range (given by the Content-Range header), POST adds the completed file to the input files (taking the same parameters as adding an input file does) and DELETE discards the upload"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        session = clam.common.resumable.Session.load(Project.path(project, user), uploadid)
+        if session is None:
+            return withheaders(flask.make_response("No such upload",404),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+        url = getrooturl() + '/' + project + '/resumable/' + session.id + '/'
+
+        if flask.request.method == 'PUT':
+            match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)$', flask.request.headers.get('Content-Range','').strip())
+            if not match or int(match.group(2)) < int(match.group(1)) or (match.group(3) != '*' and int(match.group(3)) != session.size):
+                return withheaders(flask.make_response("No valid Content-Range specified",400),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+            begin, end = int(match.group(1)), int(match.group(2)) + 1
+            if flask.request.content_length is not None and flask.request.content_length != end - begin:
+                return withheaders(flask.make_response("The length of the body does not match the Content-Range",400),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+            try:
+                written = session.write(begin, flask.request.stream, end - begin)
+            except ValueError as e:
+                return withheaders(flask.make_response(str(e),416),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+            if written != end - begin:
+                #what was received is kept, the client can find out what is missing with a GET
+                return withheaders(flask.make_response("Received " + str(written) + " of the " + str(end - begin) + " bytes in the Content-Range",400),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        elif flask.request.method == 'DELETE':
+            session.discard()
+            return withheaders(flask.make_response("Deleted"),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        elif flask.request.method == 'POST':
+            if Project.simplestatus(project, user) != clam.common.status.READY:
+                return withheaders(flask.make_response("No input files accepted at this stage",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+            if not session.complete():
+                return withheaders(flask.make_response("The upload is not complete yet",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+            postdata = flask.request.values
+            return addfile(project, postdata.get('filename', session.name), user, postdata, resumable=session)
+
+        return withheaders(flask.make_response(json.dumps(session.json(url))), 'application/json', {'allow_origin': settings.ALLOW_ORIGIN})
+
     @staticmethod
     def deleteinputfile(project, filename, credentials=None):
         """Delete an input file"""
@@ -1764,12 +2268,20 @@ class Project:
 
         if len(filename) == 0:
             #Deleting all input files
-            shutil.rmtree(Project.path(project, user) + 'input')
+            trash(Project.path(project, user) + 'input')
             os.makedirs(Project.path(project, user) + 'input') #re-add new input directory
+            with clam.common.manifest.Manifest(Project.path(project, user)) as manifest:
+                manifest.clear()
+            getindex().setusage(user, project, 'input', 0.0, 0)
             return "Deleted" #200
         elif os.path.isdir(Project.path(project, user) + filename):
             #Deleting specified directory
-            shutil.rmtree(Project.path(project, user) + filename)
+            size, count = Project.filediskusage(Project.path(project, user) + filename)
+            trash(Project.path(project, user) + filename)
+            if filename.strip('/').startswith('input/'):
+                with clam.common.manifest.Manifest(Project.path(project, user)) as manifest:
+                    manifest.remove(filename.strip('/')[len('input/'):])
+            Project.adjustdiskusage(user, project, 'input', -size, -count)
             return "Deleted" #200
         else:
             try:
@@ -1777,10 +2289,13 @@ class Project:
             except:
                 raise flask.abort(404)
 
+            #the file and its metadata (file.delete() also removes it from the input manifest)
+            size, count = Project.filediskusage(Project.path(project, user) + 'input/' + filename, Project.path(project, user) + 'input/' + file.metafilename())
             success = file.delete()
             if not success:
                 raise flask.abort(404)
             else:
+                Project.adjustdiskusage(user, project, 'input', -size, -count)
                 msg = "Deleted"
                 return withheaders(flask.make_response(msg),'text/plain', {'Content-Length': len(msg), 'allow_origin': settings.ALLOW_ORIGIN}) #200
 
@@ -1851,6 +2366,9 @@ class Project:
                     return "" #200
                 else:
                     assert False
+            elif 'file' in flask.request.files or ('url' in postdata and postdata['url']):
+                #batch upload of one or more files and/or urls
+                return addfiles(project, user, postdata)
             else:
                 return withheaders(flask.make_response("No filename or inputsource specified",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
         else:
@@ -1859,12 +2377,106 @@ class Project:
 
 
 
-def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'): #pylint: disable=too-many-return-statements
-    """Add a new input file, this invokes the actual uploader"""
+class AsyncUpload:
+    """Progress and result of an upload whose files are processed in the background (see addfile()). Kept in a small JSON file in the project directory, so any process of the webservice can report on it."""
+
+    PREFIX = '.upload-'
+
+    def __init__(self, projectpath, uploadid, total):
+        self.filename = projectpath + AsyncUpload.PREFIX + uploadid
+        self.total = total
+        self.done = 0
+        self.lock = threading.Lock()
+        self.lastwrite = 0
+        self.write()
+
+    def write(self, **result):
+        data = {'total': self.total, 'done': self.done, 'host': socket.gethostname(), 'pid': os.getpid()}
+        data.update(result)
+        with open(self.filename + '.tmp','w',encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(self.filename + '.tmp', self.filename) #readers never see a partial file
+        self.lastwrite = time.time()
+
+    def progress(self):
+        """Count a processed file, the progress is written out at most once a second"""
+        with self.lock:
+            self.done += 1
+            if time.time() - self.lastwrite >= 1:
+                self.write()
+
+    def finish(self, code, contenttype, body):
+        """Store the response for the upload"""
+        with self.lock:
+            self.write(finished=True, code=code, contenttype=contenttype, body=body)
+
+    @staticmethod
+    def read(projectpath, uploadid):
+        """Returns the state of the upload as a dictionary (with the response under body, code and contenttype once finished), or None if there is no such upload. An upload whose process is gone, or that made no progress for UPLOAD_TIMEOUT seconds, is marked as failed."""
+        filename = projectpath + AsyncUpload.PREFIX + uploadid
+        try:
+            with open(filename,'r',encoding='utf-8') as f:
+                status = json.load(f)
+                mtime = os.fstat(f.fileno()).st_mtime
+        except (FileNotFoundError, ValueError):
+            return None
+        if not status.get('finished'):
+            stale = time.time() - mtime > settings.UPLOAD_TIMEOUT
+            if not stale and status.get('pid') and status.get('host') == socket.gethostname():
+                try:
+                    os.kill(status['pid'], 0)
+                except ProcessLookupError:
+                    stale = True
+            if stale:
+                printlog("Processing of upload " + uploadid + " was interrupted")
+                status.update(finished=True, code=500, contenttype="text/plain", body="Processing of the uploaded files was interrupted")
+                with open(filename + '.tmp','w',encoding='utf-8') as f:
+                    json.dump(status, f)
+                os.replace(filename + '.tmp', filename)
+        return status
+
+    @staticmethod
+    def remove(projectpath, uploadid):
+        """Remove the state of an upload (once its result was collected)"""
+        try:
+            os.unlink(projectpath + AsyncUpload.PREFIX + uploadid)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def pending(projectpath):
+        """Is any upload still being processed in the background? The results of uploads that were never collected are removed after UPLOAD_TIMEOUT seconds."""
+        pending = False
+        try:
+            entries = [ entry for entry in os.scandir(projectpath) if entry.name.startswith(AsyncUpload.PREFIX) and not entry.name.endswith('.tmp') ]
+        except FileNotFoundError:
+            return False
+        for entry in entries:
+            uploadid = entry.name[len(AsyncUpload.PREFIX):]
+            status = AsyncUpload.read(projectpath, uploadid)
+            if status is None:
+                continue
+            if not status.get('finished'):
+                pending = True
+            else:
+                try:
+                    if time.time() - entry.stat().st_mtime > settings.UPLOAD_TIMEOUT:
+                        AsyncUpload.remove(projectpath, uploadid)
+                except FileNotFoundError:
+                    pass
+        return pending
+
+
+def addfile(project, filename, user, postdata, inputsource=None,returntype='xml', resumable=None, upload=None, inputtemplate=None, nextseq=None, fetched=None): #pylint: disable=too-many-return-statements
+    """Add a new input file, this invokes the actual uploader. The file may come from a completed resumable upload session, or (for a url) have been fetched already (see addfiles()).
+
+    For batch uploads (see addfiles()), the uploaded file, the input template and the sequence number are determined by the caller and passed explicitly, and returntype 'batch' returns a tuple of the upload XML (without the enclosing clamupload element), the fatal error (if any), whether there were parameter errors, and the number of files added."""
 
 
     def errorresponse(msg, code=403, xml=""):
-        if returntype == 'json':
+        if returntype == 'batch':
+            return "<upload filename=\"" + xmlescape(filename) + "\"><error>" + xmlescape(msg) + "</error></upload>\n", msg, False, 0
+        elif returntype == 'json':
             return withheaders(flask.make_response(json.dumps({
                 "success": False,
                 "error": msg,
@@ -1877,17 +2489,28 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
                 #ignore msg, send only xml
                 return withheaders(flask.make_response(xml,403),headers={'allow_origin': settings.ALLOW_ORIGIN})
 
+    def failresponse(msg, code, contenttype="text/plain"):
+        """Plain response with the specified status code, for batch uploads the error is reported like any other"""
+        if returntype == 'batch':
+            return errorresponse(msg, code)
+        return withheaders(flask.make_response(msg,code),contenttype,headers={'allow_origin': settings.ALLOW_ORIGIN})
+
     inputtemplate_id = flask.request.headers.get('Inputtemplate','')
-    inputtemplate = None
     metadata = None
+    if upload is None and resumable is None and 'file' in flask.request.files:
+        upload = flask.request.files['file']
 
 
     printdebug('Handling addfile, postdata contains fields ' + ",".join(postdata.keys()) )
 
+    asyncrequested = postdata.get('async','') not in ('','0','no','false')
+    if asyncrequested and returntype != 'xml':
+        return failresponse("Processing uploaded files in the background (async) is only supported for requests with an XML response",400)
+
     if 'inputtemplate' in postdata:
         inputtemplate_id = postdata['inputtemplate']
 
-    if inputtemplate_id:
+    if inputtemplate_id and not inputtemplate:
         #An input template must always be provided
         for profile in settings.PROFILES:
             for t in profile.input:
@@ -1896,7 +2519,7 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
         if not inputtemplate:
             #Inputtemplate not found, send 404
             printlog("Specified inputtemplate (" + inputtemplate_id + ") not found!")
-            return withheaders(flask.make_response("Specified inputtemplate (" + inputtemplate_id + ") not found!",404),headers={'allow_origin': settings.ALLOW_ORIGIN})
+            return failresponse("Specified inputtemplate (" + inputtemplate_id + ") not found!",404,"text/xml; charset=UTF-8")
         printdebug('Inputtemplate explicitly provided: ' + inputtemplate.id )
     if not inputtemplate:
         #See if an inputtemplate is explicitly specified in the filename
@@ -1929,18 +2552,19 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
 
 
 
-    #See if other previously uploaded input files use this inputtemplate
-    if inputtemplate.unique:
-        nextseq = 0 #unique
-    else:
-        nextseq = 1 #will hold the next sequence number for this inputtemplate (in multi-mode only)
-
-    for seq, inputfile in Project.inputindexbytemplate(project, user, inputtemplate): #pylint: disable=unused-variable
+    #See if other previously uploaded input files use this inputtemplate (a batch upload already did)
+    if nextseq is None:
         if inputtemplate.unique:
-            return errorresponse("You have already submitted a file of this type, you can only submit one. Delete it first. (Inputtemplate=" + inputtemplate.id + ", unique=True)")
+            nextseq = 0 #unique
         else:
-            if seq >= nextseq:
-                nextseq = seq + 1 #next available sequence number
+            nextseq = 1 #will hold the next sequence number for this inputtemplate (in multi-mode only)
+
+        for seq, inputfile in Project.inputindexbytemplate(project, user, inputtemplate): #pylint: disable=unused-variable
+            if inputtemplate.unique:
+                return errorresponse("You have already submitted a file of this type, you can only submit one. Delete it first. (Inputtemplate=" + inputtemplate.id + ", unique=True)")
+            else:
+                if seq >= nextseq:
+                    nextseq = seq + 1 #next available sequence number
 
 
     if not filename: #Actually, I don't think this can occur at this stage, but we'll leave it in to be sure (yes it can, when the entry shortcut is used!)
@@ -1952,7 +2576,7 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
             filename = str(nextseq) +'-' + str("%034x" % random.getrandbits(128))
 
     #Make sure filename matches (only if not an archive)
-    if inputtemplate.acceptarchive and (filename[-7:].lower() == '.tar.gz' or filename[-8:].lower() == '.tar.bz2' or filename[-4:].lower() == '.zip'):
+    if inputtemplate.acceptarchive and clam.common.data.archiveformat(filename):
         pass
     else:
         if inputtemplate.filename:
@@ -1992,18 +2616,31 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
         return errorresponse("Filename contains invalid symbols! Do not use /,&,|,<,>,',`,\",{,} or ;")
 
 
-    #Create the project (no effect if already exists)
-    response = Project.create(project, user)
-    if response is not None:
-        return response
+    #Create the project (no effect if already exists), a batch upload already did
+    if returntype != 'batch':
+        response = Project.create(project, user)
+        if response is not None:
+            return response
 
 
     printdebug("(Obtaining filename for uploaded file)")
     head = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
     head += "<clamupload>\n"
-    if 'file' in flask.request.files:
-        printlog("Adding client-side file " + flask.request.files['file'].filename + " to input files")
-        sourcefile = flask.request.files['file'].filename
+    if resumable is not None:
+        printlog("Adding client-side file " + (resumable.name or filename) + " to input files. Uploaded in chunks")
+        sourcefile = resumable.name or filename
+    elif upload is not None:
+        printlog("Adding client-side file " + upload.filename + " to input files")
+        sourcefile = upload.filename
+    elif 'sha256' in postdata and postdata['sha256']:
+        #Check before upload: the file is taken from the content-addressed store, if it has it, so the client need not send it
+        if not settings.BLOBSTORE:
+            return failresponse("This service has no content-addressed store, send the file itself",501)
+        digest = postdata['sha256'].lower()
+        if not clam.common.blobstore.has(settings.ROOT, digest, user): #only files the user added before, the store must not tell anything about the files of others
+            return failresponse("No file with this digest in the content-addressed store, send the file itself",404)
+        printlog("Adding file " + filename + " from the content-addressed store to input files")
+        sourcefile = postdata.get('sourcefile', filename)
     elif 'url' in postdata and postdata['url']:
         #Download from URL
         sourcefile = unquote(postdata['url'])
@@ -2086,7 +2723,7 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
                     parameters = []
                     validmeta = False
             else:
-                return withheaders(flask.make_response("No metadata found nor specified for inputsource " + inputsource.id ,500),headers={'allow_origin': settings.ALLOW_ORIGIN})
+                return failresponse("No metadata found nor specified for inputsource " + inputsource.id,500,"text/xml; charset=UTF-8")
     else:
         errors, parameters = inputtemplate.validate(postdata, user)
         validmeta = True #will be checked later
@@ -2099,286 +2736,324 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
         printdebug('(Archive test)')
         # -------- Are we an archive? If so, determine what kind
         archivetype = None
-        if 'file' in flask.request.files:
-            uploadname = sourcefile.lower()
-            archivetype = None
-            if uploadname[-4:] == '.zip':
-                archivetype = 'zip'
-            elif uploadname[-7:] == '.tar.gz':
-                archivetype = 'tar.gz'
-            elif uploadname[-4:] == '.tar':
-                archivetype = 'tar'
-            elif uploadname[-8:] == '.tar.bz2':
-                archivetype = 'tar.bz2'
+        xhrpost = False
+        if resumable is not None:
+            archivetype = clam.common.data.archiveformat(filename)
+        elif upload is not None:
+            archivetype = clam.common.data.archiveformat(sourcefile)
             xhrpost = False
         elif 'accesstoken' in postdata and 'filename' in postdata:
+            archivetype = clam.common.data.archiveformat(postdata['filename'])
             xhrpost = True
-            if postdata['filename'][-7:].lower() == '.tar.gz':
-                uploadname = sourcefile.lower()
-                archivetype = 'tar.gz'
-            elif postdata['filename'][-8:].lower() == '.tar.bz2':
-                uploadname = sourcefile.lower()
-                archivetype = 'tar.bz2'
-            elif postdata['filename'][-4:].lower() == '.tar':
-                uploadname = sourcefile.lower()
-                archivetype = 'tar'
-            elif postdata['filename'][-4:].lower() == '.zip':
-                uploadname = sourcefile.lower()
-                archivetype = 'zip'
 
         if archivetype:
-            # =============== upload archive ======================
-            #random name
-            archive = "%032x" % random.getrandbits(128) + '.' + archivetype
-
-            #Upload file from client to server
-            printdebug('(Archive transfer starting)')
-            if not xhrpost:
-                flask.request.files['file'].save(Project.path(project,user) + archive)
-            elif xhrpost:
-                with open(Project.path(project,user) + archive,'wb') as f:
-                    while True:
-                        chunk = flask.request.stream.read(16384)
-                        if chunk:
-                            f.write(chunk)
-                        else:
-                            break
-            printdebug('(Archive transfer completed)')
             # =============== Extract archive ======================
-
-            #Determine extraction command
-            if archivetype == 'zip':
-                cmd = 'unzip -u'
-            elif archivetype == 'tar':
-                cmd = 'tar -xvf'
-            elif archivetype == 'tar.gz':
-                cmd = 'tar -xvzf'
-            elif archivetype == 'tar.bz2':
-                cmd = 'tar -xvjf'
-            else:
-                raise Exception("Invalid archive format: " + archivetype) #invalid archive, shouldn't happen
-
-            #invoke extractor
-            printlog("Extracting '" + archive + "'" )
+            #the members are extracted while the archive is received, and only replace existing input files once the whole archive is accepted (so a file shared through the content-addressed store is never written into)
+            archive = True
+            maxsize = settings.ARCHIVE_MAXSIZE
+            budget = uploadbudget(user, project, resumable)
+            if budget is not None:
+                if budget <= 0:
+                    return errorresponse("You exceeded your disk quota, unable to extract archive")
+                maxsize = min(maxsize, budget) if maxsize > 0 else budget
+
+            seq = nextseq
+            def targetpath(name):
+                nonlocal seq
+                if any(c in DISALLOWED for c in name):
+                    printlog("Skipping file '" + name + "' in archive, the filename contains invalid symbols")
+                    return None
+                seq += 1
+                return Project.path(project, user) + 'input/' + clam.common.data.resolveinputfilename(name, parameters, inputtemplate, seq - 1, project)
+
+            printlog("Extracting " + archivetype + " archive '" + sourcefile + "'")
             try:
-                process = subprocess.Popen(cmd + " " + archive, cwd=Project.path(project,user), stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-            except: #pylint: disable=bare-except
-                return withheaders(flask.make_response("Unable to extract archive",500),headers={'allow_origin': settings.ALLOW_ORIGIN})
-            out, _ = process.communicate() #waits for process to end
-
-            if isinstance(out, bytes):
-                out = str(out,'utf-8')
-
-            #Read filename results
-
-            firstline = True
-            for line in out.split("\n"):
-                line = line.strip()
-                if line:
-                    printdebug('(Extraction output: ' + line+')')
-                    subfile = None
-                    if archivetype[0:3] == 'tar':
-                        subfile = line
-                    elif archivetype == 'zip' and not firstline: #firstline contains archive name itself, skip it
-                        colon = line.find(":")
-                        if colon:
-                            subfile =  line[colon + 1:].strip()
-                    if subfile and os.path.isfile(Project.path(project, user) + subfile):
-                        subfile_newname = clam.common.data.resolveinputfilename(os.path.basename(subfile), parameters, inputtemplate, nextseq+len(addedfiles), project)
-                        printdebug('(Extracted file ' + subfile + ', moving to input/' + subfile_newname+')')
-                        os.rename(Project.path(project, user) + subfile, Project.path(project, user) + 'input/' +  subfile_newname)
-                        addedfiles.append(subfile_newname)
-                firstline = False
-
-            #all done, remove archive
-            os.unlink(Project.path(project, user) + archive)
+                if resumable is not None:
+                    with open(resumable.datafile,'rb') as f:
+                        extracted = clam.common.data.extractarchive(f, archivetype, targetpath, int(maxsize * 1024 * 1024), settings.ARCHIVE_MAXFILES)
+                elif not xhrpost:
+                    extracted = clam.common.data.extractarchive(upload.stream, archivetype, targetpath, int(maxsize * 1024 * 1024), settings.ARCHIVE_MAXFILES)
+                elif archivetype == 'zip':
+                    #zip archives can not be read as a stream, the index is at the end
+                    with tempfile.TemporaryFile(dir=Project.path(project, user)) as f:
+                        shutil.copyfileobj(flask.request.stream, f, 65536)
+                        f.seek(0)
+                        extracted = clam.common.data.extractarchive(f, archivetype, targetpath, int(maxsize * 1024 * 1024), settings.ARCHIVE_MAXFILES)
+                else:
+                    extracted = clam.common.data.extractarchive(flask.request.stream, archivetype, targetpath, int(maxsize * 1024 * 1024), settings.ARCHIVE_MAXFILES)
+            except clam.common.data.UploadError as e:
+                printlog(str(e))
+                return errorresponse(e.msg)
+            if resumable is not None:
+                resumable.discard()
+            for _, path in extracted:
+                printdebug('(Extracted file ' + path + ')')
+                addedfiles.append(path[len(Project.path(project, user) + 'input/'):])
 
     if not archive:
         addedfiles = [clam.common.data.resolveinputfilename(filename, parameters, inputtemplate, nextseq, project)]
 
-    fatalerror = None
-
-    jsonoutput = {'success': False if errors else True, 'isarchive': archive}
-
-
-    output = head
-    for filename in addedfiles: #pylint: disable=too-many-nested-blocks
-        output += "<upload source=\""+sourcefile +"\" filename=\""+filename+"\" inputtemplate=\"" + inputtemplate.id + "\" templatelabel=\""+inputtemplate.label+"\" format=\""+inputtemplate.formatclass.__name__+"\">\n"
-        if not errors:
-            output += "<parameters errors=\"no\">"
-        else:
-            output += "<parameters errors=\"yes\">"
-            jsonoutput['error'] = 'There were parameter errors, file not uploaded: '
-        for parameter in parameters:
-            output += parameter.xml()
-            if parameter.error:
-                jsonoutput['error'] += parameter.error + ". "
-        output += "</parameters>"
-
-
-
-        if not errors:
-            if not archive:
-                #============================ Transfer file ========================================
-                printdebug('(Start file transfer: ' +  Project.path(project, user) + 'input/' + filename+' )')
-                if 'file' in flask.request.files:
-                    printdebug('(Receiving data by uploading file)')
-                    #Upload file from client to server
-                    flask.request.files['file'].save(Project.path(project, user) + 'input/' + filename)
-                elif 'url' in postdata and postdata['url']:
-                    url = unquote(postdata['url'])
-                    printdebug('(Receiving data from url: ' + url + " )" )
-                    #Download file from 3rd party server to CLAM server
-                    try:
-                        r = requests.get(url)
-                    except:
-                        return withheaders(flask.make_response("No remote data could be obtained from " + url,404),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
-                    if not (r.status_code >= 200 and r.status_code < 300):
-                        return withheaders(flask.make_response("No remote data could be obtained from " + url,404),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
-
-                    CHUNK = 16 * 1024
-                    f = open(Project.path(project, user) + 'input/' + filename,'wb')
-                    for chunk in r.iter_content(chunk_size=CHUNK):
-                        if chunk: # filter out keep-alive new chunks
-                            f.write(chunk)
-                            f.flush()
-                    f.close()
-                elif 'inputsource' in postdata and postdata['inputsource']:
-                    #Copy (symlink!) from preinstalled data
-                    printdebug('(Creating symlink to file ' + inputsource.path + ' <- ' + Project.path(project,user) + '/input/ ' + filename + ')')
-                    os.symlink(inputsource.path, Project.path(project, user) + 'input/' + filename)
-                elif 'contents' in postdata and postdata['contents']:
-                    printdebug('(Receiving data via from contents variable)')
-                    #grab encoding
-                    encoding = 'utf-8'
-                    for p in parameters:
-                        if p.id == 'encoding':
-                            encoding = p.value
-                    #Contents passed in POST message itself
-                    try:
-                        f = io.open(Project.path(project, user) + 'input/' + filename,'w',encoding=encoding)
-                        f.write(postdata['contents'])
-                        f.close()
-                    except UnicodeError:
-                        return errorresponse("Input file " + str(filename) + " is not in the expected encoding!")
-                elif 'accesstoken' in postdata and 'filename' in postdata:
-                    printdebug('(Receiving data directly from post body)')
-                    with open(Project.path(project,user) + 'input/' + filename,'wb') as f:
-                        while True:
-                            chunk = flask.request.stream.read(16384)
-                            if chunk:
-                                f.write(chunk)
-                            else:
-                                break
-
-                printdebug('(File transfer completed)')
-
-
-
-            #Create a file object
-            file = clam.common.data.CLAMInputFile(Project.path(project, user), filename, False) #get CLAMInputFile without metadata (chicken-egg problem, this does not read the actual file contents!
+    converter = None
+    if 'converter' in postdata and postdata['converter']:
+        for c in inputtemplate.converters:
+            if c.id == postdata['converter']:
+                converter = c
+                break
 
+    def processfile(filename):
+        """Generate the metadata for an added input file, convert it (if requested) and validate it. Returns a tuple of the XML for the upload response, the fatal error (if any), the size (in bytes) and number of files added to the project, and the record for the input manifest (if added).
+        The members of an archive are processed in a pool of threads, so this may not use the request."""
+        xml = ""
 
+        #Create a file object
+        file = clam.common.data.CLAMInputFile(Project.path(project, user), filename, False) #get CLAMInputFile without metadata (chicken-egg problem, this does not read the actual file contents!
 
-            #============== Generate metadata ==============
+        #============== Generate metadata ==============
 
-            metadataerror = None
-            if not metadata and not errors: #check if it has not already been set in another stage
-                printdebug('(Generating metadata)')
-                #for newly generated metadata
-                try:
-                    #Now we generate the actual metadata object (unsaved yet though). We pass our earlier validation results to prevent computing it again
-                    validmeta, metadata, parameters = inputtemplate.generate(file, (errors, parameters ))
-                    if validmeta:
-                        #And we tie it to the CLAMFile object
-                        file.metadata = metadata
-                        #Add inputtemplate ID to metadata
-                        metadata.inputtemplate = inputtemplate.id
-                    elif metadata is not None and 'validation_error' in metadata:
-                        metadataerror = metadata['validation_error']
-                    else:
-                        metadataerror = "Undefined error"
-                except ValueError as msg:
-                    validmeta = False
-                    metadataerror = msg
-                except KeyError as msg:
-                    validmeta = False
-                    metadataerror = msg
-            elif validmeta:
-                #for explicitly uploaded metadata
-                metadata.file = file
-                file.metadata = metadata
-                metadata.inputtemplate = inputtemplate.id
-
-            if metadata is not None and 'validation_error' in metadata:
-                printdebug('(Metadata could not be generated, ' + str(metadataerror) + ') due to validation error')
-                jsonoutput['error'] = fatalerror = "Input not accepted (validation failed): " + str(metadataerror)
-                output += "<error>" + xmlescape(fatalerror) + "</error>"
-                jsonoutput['success'] = False
-                #remove upload
-                os.unlink(Project.path(project, user) + 'input/' + filename)
-            elif metadataerror:
-                printdebug('(Metadata could not be generated, ' + str(metadataerror) + ',  this usually indicated an error in service configuration)')
-                jsonoutput['error'] = fatalerror = "Metadata could not be generated! " + str(metadataerror) + "  (this usually indicates an error in service configuration!)"
-                output += "<error>" + xmlescape(fatalerror) + "</error>"
+        filemetadata = metadata
+        filevalidmeta = validmeta
+        metadataerror = None
+        if not filemetadata: #check if it has not already been set in another stage
+            printdebug('(Generating metadata)')
+            #for newly generated metadata
+            try:
+                #Now we generate the actual metadata object (unsaved yet though). We pass our earlier validation results to prevent computing it again
+                filevalidmeta, filemetadata, _ = inputtemplate.generate(file, (errors, parameters ))
+                if filevalidmeta:
+                    #And we tie it to the CLAMFile object
+                    file.metadata = filemetadata
+                    #Add inputtemplate ID to metadata
+                    filemetadata.inputtemplate = inputtemplate.id
+                elif filemetadata is not None and 'validation_error' in filemetadata:
+                    metadataerror = filemetadata['validation_error']
+                else:
+                    metadataerror = "Undefined error"
+            except ValueError as msg:
+                filevalidmeta = False
+                metadataerror = msg
+            except KeyError as msg:
+                filevalidmeta = False
+                metadataerror = msg
+        elif filevalidmeta:
+            #for explicitly uploaded metadata, every file gets its own copy
+            filemetadata = copy.copy(metadata)
+            filemetadata.data = dict(metadata.data)
+            filemetadata.file = file
+            file.metadata = filemetadata
+            filemetadata.inputtemplate = inputtemplate.id
+
+        if filemetadata is not None and 'validation_error' in filemetadata:
+            printdebug('(Metadata could not be generated, ' + str(metadataerror) + ') due to validation error')
+            fatalerror = "Input not accepted (validation failed): " + str(metadataerror)
+            #remove upload
+            os.unlink(Project.path(project, user) + 'input/' + filename)
+            return xml + "<error>" + xmlescape(fatalerror) + "</error>", fatalerror, 0, 0, None
+        elif metadataerror:
+            printdebug('(Metadata could not be generated, ' + str(metadataerror) + ',  this usually indicated an error in service configuration)')
+            fatalerror = "Metadata could not be generated! " + str(metadataerror) + "  (this usually indicates an error in service configuration!)"
+            #remove upload
+            os.unlink(Project.path(project, user) + 'input/' + filename)
+            return xml + "<error>" + xmlescape(fatalerror) + "</error>", fatalerror, 0, 0, None
+        elif not filevalidmeta:
+            return xml, None, 0, 0, None
+
+        #=========== Convert the uploaded file (if requested) ==============
+
+        if converter: #(should always be found, error already provided earlier if not)
+            printdebug('(Invoking converter)')
+            try:
+                success = converter.convertforinput(Project.path(project, user) + 'input/' + filename, filemetadata)
+            except: #pylint: disable=bare-except
+                success = False
+            if not success:
+                fatalerror = "Unable to convert"
+                return xml + "<error>" + xmlescape(fatalerror) + "</error>", fatalerror, 0, 0, None
+
+        #====================== Validate the file itself ====================
+        if not file.validate():
+            printdebug('(Validation error)')
+            #Too bad, everything worked out but the file itself doesn't validate.
+            fatalerror = "The file did not validate, it is not in the proper expected format."
+            #remove upload
+            os.unlink(Project.path(project, user) + 'input/' + filename)
+            return xml + "<error>" + xmlescape(fatalerror) + "</error>", fatalerror, 0, 0, None
+
+        printdebug('(Validation ok)')
+        xml += "<valid>yes</valid>"
+
+        if settings.BLOBSTORE:
+            #Keep a single copy of the file in the content-addressed store, the digest computed while receiving it no longer holds after conversion
+            filedigest = clam.common.blobstore.place(settings.ROOT, Project.path(project, user) + 'input/' + filename, None if converter else digests.get(filename))
+            if filedigest is not None:
+                clam.common.blobstore.record(settings.ROOT, user, filedigest)
+
+        #Great! Everything ok, save metadata
+        metadataxml = filemetadata.xml()
+        with io.open(Project.path(project, user) + 'input/' + file.metafilename(),'w',encoding='utf-8') as f:
+            f.write(metadataxml)
+
+        #And the record of the file for its inputtemplate in the input manifest (written by assemble())
+        size, count = Project.filediskusage(Project.path(project, user) + 'input/' + filename, Project.path(project, user) + 'input/' + file.metafilename())
+        record = (filename, inputtemplate.id, nextseq, os.path.getsize(Project.path(project, user) + 'input/' + filename), hashlib.sha1(metadataxml.encode('utf-8')).hexdigest())
+        return xml, None, size, count, record
+
+    def processfiles(filenames, asyncupload=None):
+        """Process the files (see processfile()) in a pool of UPLOAD_WORKERS threads, returns the results in order. Progress is reported to the AsyncUpload, if any."""
+        def process(filename):
+            result = processfile(filename)
+            if asyncupload is not None:
+                asyncupload.progress()
+            return result
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, settings.UPLOAD_WORKERS)) as pool:
+            return list(pool.map(process, filenames))
+
+    def assemble(results, wrap=True):
+        """Assemble the upload response from the results of processing the files, returns (output, jsonoutput, fatalerror). Without wrap, the output lacks the XML declaration and clamupload element."""
+        fatalerror = None
+        jsonoutput = {'success': False if errors else True, 'isarchive': archive}
+        output = head if wrap else ""
+        totalsize = 0
+        totalcount = 0
+        records = []
+        for filename, (xml, error, size, count, record) in zip(addedfiles, results):
+            output += "<upload source=\""+sourcefile +"\" filename=\""+filename+"\" inputtemplate=\"" + inputtemplate.id + "\" templatelabel=\""+inputtemplate.label+"\" format=\""+inputtemplate.formatclass.__name__+"\">\n"
+            if not errors:
+                output += "<parameters errors=\"no\">"
+            else:
+                output += "<parameters errors=\"yes\">"
+                jsonoutput['error'] = 'There were parameter errors, file not uploaded: '
+            for parameter in parameters:
+                output += parameter.xml()
+                if parameter.error:
+                    jsonoutput['error'] += parameter.error + ". "
+            output += "</parameters>"
+            output += xml
+            if error:
+                jsonoutput['error'] = fatalerror = error
                 jsonoutput['success'] = False
-                #remove upload
-                os.unlink(Project.path(project, user) + 'input/' + filename)
-            elif validmeta:
-                #=========== Convert the uploaded file (if requested) ==============
-
-                conversionerror = False
-                if 'converter' in postdata and postdata['converter']:
-                    for c in inputtemplate.converters:
-                        if c.id == postdata['converter']:
-                            converter = c
+            output += "</upload>\n"
+            totalsize += size
+            totalcount += count
+            if record is not None:
+                records.append(record)
+        if wrap:
+            output += "</clamupload>"
+        if records:
+            #Record the added files in the input manifest
+            with clam.common.manifest.Manifest(Project.path(project, user)) as manifest:
+                manifest.addfiles(records)
+        if totalcount:
+            #Account for the added files in the project index
+            Project.adjustdiskusage(user, project, 'input', totalsize, totalcount)
+        return output, jsonoutput, fatalerror
+
+    digests = {} #SHA-256 digests of files computed while receiving them, for the content-addressed store
+    if not errors and not archive:
+        filename = addedfiles[0]
+        #============================ Transfer file ========================================
+        printdebug('(Start file transfer: ' +  Project.path(project, user) + 'input/' + filename+' )')
+        if os.path.lexists(Project.path(project, user) + 'input/' + filename):
+            os.unlink(Project.path(project, user) + 'input/' + filename) #never write into an existing file, it may be shared through the content-addressed store (or be a link to preinstalled data)
+        if resumable is not None:
+            printdebug('(Moving assembled file of resumable upload into place)')
+            os.replace(resumable.datafile, Project.path(project, user) + 'input/' + filename)
+            resumable.discard()
+        elif upload is not None:
+            printdebug('(Receiving data by uploading file)')
+            #Upload file from client to server
+            if settings.BLOBSTORE:
+                digests[filename] = clam.common.blobstore.receive(upload.stream, Project.path(project, user) + 'input/' + filename)
+            else:
+                upload.save(Project.path(project, user) + 'input/' + filename)
+        elif 'sha256' in postdata and postdata['sha256']:
+            printdebug('(Linking file from the content-addressed store)')
+            digests[filename] = postdata['sha256'].lower()
+            if not clam.common.blobstore.has(settings.ROOT, digests[filename], user) or not clam.common.blobstore.fetch(settings.ROOT, digests[filename], Project.path(project, user) + 'input/' + filename, copy=converter is not None): #a converter needs a copy of its own to modify
+                return failresponse("No file with this digest in the content-addressed store, send the file itself",404)
+        elif 'url' in postdata and postdata['url'] and fetched is not None:
+            printdebug('(Moving file fetched from url into place)')
+            os.replace(fetched, Project.path(project, user) + 'input/' + filename)
+        elif 'url' in postdata and postdata['url']:
+            url = unquote(postdata['url'])
+            printdebug('(Receiving data from url: ' + url + " )" )
+            #Download file from 3rd party server to CLAM server (or take it from the cache)
+            budget = uploadbudget(user, project)
+            if budget is not None and budget <= 0:
+                return errorresponse("You exceeded your disk quota, unable to obtain the file from " + url)
+            try:
+                getfetcher().fetch(url, Project.path(project, user) + 'input/' + filename, int(budget * 1024 * 1024) if budget is not None else 0)
+            except clam.common.fetcher.FetchError as e:
+                if os.path.exists(Project.path(project, user) + 'input/' + filename):
+                    os.unlink(Project.path(project, user) + 'input/' + filename)
+                return failresponse(e.msg,404)
+        elif 'inputsource' in postdata and postdata['inputsource']:
+            #Copy (symlink!) from preinstalled data
+            printdebug('(Creating symlink to file ' + inputsource.path + ' <- ' + Project.path(project,user) + '/input/ ' + filename + ')')
+            os.symlink(inputsource.path, Project.path(project, user) + 'input/' + filename)
+        elif 'contents' in postdata and postdata['contents']:
+            printdebug('(Receiving data via from contents variable)')
+            #grab encoding
+            encoding = 'utf-8'
+            for p in parameters:
+                if p.id == 'encoding':
+                    encoding = p.value
+            #Contents passed in POST message itself
+            try:
+                f = io.open(Project.path(project, user) + 'input/' + filename,'w',encoding=encoding)
+                f.write(postdata['contents'])
+                f.close()
+            except UnicodeError:
+                return errorresponse("Input file " + str(filename) + " is not in the expected encoding!")
+        elif 'accesstoken' in postdata and 'filename' in postdata:
+            printdebug('(Receiving data directly from post body)')
+            if settings.BLOBSTORE:
+                digests[filename] = clam.common.blobstore.receive(flask.request.stream, Project.path(project,user) + 'input/' + filename)
+            else:
+                with open(Project.path(project,user) + 'input/' + filename,'wb') as f:
+                    while True:
+                        chunk = flask.request.stream.read(16384)
+                        if chunk:
+                            f.write(chunk)
+                        else:
                             break
-                    if converter: #(should always be found, error already provided earlier if not)
-                        printdebug('(Invoking converter)')
-                        try:
-                            success = converter.convertforinput(Project.path(project, user) + 'input/' + filename, metadata)
-                        except: #pylint: disable=bare-except
-                            success = False
-                        if not success:
-                            conversionerror = True
-                            jsonoutput['error'] = fatalerror = "Unable to convert"
-                            output += "<error>" + xmlescape(fatalerror) + "</error>"
-                            jsonoutput['success'] = False
-
-                #====================== Validate the file itself ====================
-                if not conversionerror:
-                    valid = file.validate()
-
-                    if valid:
-                        printdebug('(Validation ok)')
-                        output += "<valid>yes</valid>"
-
-                        #Great! Everything ok, save metadata
-                        metadata.save(Project.path(project, user) + 'input/' + file.metafilename())
-
-                        #And create symbolic link for inputtemplates
-                        linkfilename = os.path.dirname(filename)
-                        if linkfilename: linkfilename += '/'
-                        linkfilename += '.' + os.path.basename(filename) + '.INPUTTEMPLATE' + '.' + inputtemplate.id + '.' + str(nextseq)
-                        os.symlink(Project.path(project, user) + 'input/' + filename, Project.path(project, user) + 'input/' + linkfilename)
-                    else:
-                        printdebug('(Validation error)')
-                        #Too bad, everything worked out but the file itself doesn't validate.
-                        #output += "<valid>no</valid>"
-                        jsonoutput['error'] = fatalerror = "The file did not validate, it is not in the proper expected format."
-                        jsonoutput['success'] = False
-                        output += "<error>" + xmlescape(fatalerror) + "</error>"
-                        #remove upload
-                        os.unlink(Project.path(project, user) + 'input/' + filename)
-
 
-        output += "</upload>\n"
+        printdebug('(File transfer completed)')
 
-    output += "</clamupload>"
+    if errors:
+        results = [ ("", None, 0, 0, None) for _ in addedfiles ]
+    elif archive and asyncrequested:
+        #process the files in the background, the client polls the upload status resource for the result
+        uploadid = "%032x" % random.getrandbits(128)
+        asyncupload = AsyncUpload(Project.path(project, user), uploadid, len(addedfiles))
 
+        def processinbackground():
+            try:
+                output, _, fatalerror = assemble(processfiles(addedfiles, asyncupload))
+            except Exception as e: #pylint: disable=broad-except
+                printlog("Processing of upload " + uploadid + " failed: " + repr(e))
+                asyncupload.finish(500, "text/plain", "Processing of the uploaded files failed")
+                return
+            if fatalerror:
+                printlog('Fatal Error during upload: ' + fatalerror)
+                asyncupload.finish(403, "text/xml; charset=UTF-8", output)
+            else:
+                asyncupload.finish(200, "text/xml", output)
+
+        printlog("Processing " + str(len(addedfiles)) + " uploaded files in the background (upload " + uploadid + ")")
+        threading.Thread(target=processinbackground, name="clamupload", daemon=True).start()
+        url = getrooturl() + '/' + project + '/upload/' + uploadid + '/'
+        msg = json.dumps({'id': uploadid, 'url': url, 'total': len(addedfiles), 'done': 0})
+        return withheaders(flask.make_response(msg, 202), 'application/json', {'Location': url, 'allow_origin': settings.ALLOW_ORIGIN})
+    elif len(addedfiles) > 1:
+        results = processfiles(addedfiles)
+    else:
+        results = [ processfile(filename) for filename in addedfiles ]
 
+    output, jsonoutput, fatalerror = assemble(results, returntype != 'batch')
 
-    if returntype == 'boolean':
+    if returntype == 'batch':
+        return output, fatalerror, bool(errors), len(addedfiles)
+    elif returntype == 'boolean':
         return jsonoutput['success']
     elif fatalerror:
         #fatal error return error message with 403 code
@@ -2408,6 +3083,123 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
 
 
 
+def addfiles(project, user, postdata):
+    """Add multiple input files in one request (a batch upload) and return a single CLAM Upload XML response. The files
+    are passed in multiple ``file`` fields and/or obtained from multiple ``url`` fields, the urls are fetched
+    concurrently. The other request parameters apply to all files, an optional ``manifest`` (JSON) holds a list with
+    an object for each file (the uploaded files first, then the urls) that may specify its ``filename``,
+    ``inputtemplate`` and metadata parameters, overriding those of the request. If only urls are passed, ``async=1``
+    fetches and adds them in the background, the client polls the upload status resource for the result."""
+    uploads = flask.request.files.getlist('file')
+    urls = [ unquote(url) for url in postdata.getlist('url') if url ]
+    items = [ ('file', upload) for upload in uploads ] + [ ('url', url) for url in urls ]
+    if 'manifest' in postdata and postdata['manifest']:
+        try:
+            manifest = json.loads(postdata['manifest'])
+            if not isinstance(manifest, list) or len(manifest) != len(items) or not all(isinstance(entry, dict) for entry in manifest):
+                raise ValueError
+        except ValueError:
+            return withheaders(flask.make_response("Invalid manifest, expected a JSON list with an object for each file",400),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+    else:
+        manifest = [ {} for _ in items ]
+    if 'metafile' in flask.request.files:
+        return withheaders(flask.make_response("Metadata files can not be used in a batch upload, pass the metadata in the manifest instead",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+    budget = uploadbudget(user, project)
+    if urls and budget is not None and budget <= 0:
+        return withheaders(flask.make_response("You exceeded your disk quota, unable to obtain files from urls",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+
+    inputtemplates = {}
+    for profile in settings.PROFILES:
+        for inputtemplate in profile.input:
+            inputtemplates[inputtemplate.id] = inputtemplate
+
+    def process(asyncupload=None):
+        """Fetch the urls, add all files and return the response as (code, contenttype, body)"""
+        #Fetch all urls concurrently, to temporary files in the project directory that addfile() moves into place
+        fetches = [ (url, Project.path(project, user) + ".fetch-%032x" % random.getrandbits(128)) for url in urls ]
+        if fetches:
+            printlog("Fetching " + str(len(fetches)) + " urls for input files")
+            fetched = getfetcher().fetchall(fetches, settings.URLFETCH_WORKERS, int(budget * 1024 * 1024) if budget is not None else 0, asyncupload.progress if asyncupload is not None else None)
+        else:
+            fetched = []
+        fetchresults = [ (None, None) for _ in uploads ] + list(zip([ target for _, target in fetches ], fetched))
+
+        #Determine the next sequence number of every input template in one query on the input manifest
+        with clam.common.manifest.Manifest(Project.path(project, user)) as inputmanifest:
+            nextseq = collections.defaultdict(lambda: 1, inputmanifest.nextseq())
+        present = set(nextseq) #input templates that have files already
+
+        printlog("Adding " + str(len(items)) + " files to input files in a batch")
+        output = ""
+        fatalerror = None
+        errors = False
+        for (source, item), entry, (tmpfile, fetchresult) in zip(items, manifest, fetchresults):
+            filedata = { key: value for key, value in postdata.items() if key not in ('manifest', 'url', 'async') }
+            if source == 'url':
+                filedata['url'] = item
+            filedata.update({ key: str(value) for key, value in entry.items() })
+            filename = os.path.basename(filedata.pop('filename', item.filename if source == 'file' else unquote(urlparse(item).path)) or '')
+            inputtemplate = inputtemplates.get(filedata.get('inputtemplate',''))
+            count = 0
+            if not filename:
+                error = "No filename could be derived from " + item + ", specify one in the manifest"
+                xml = "<upload filename=\"\"><error>" + xmlescape(error) + "</error></upload>\n"
+            elif inputtemplate is None:
+                error = "Specified inputtemplate (" + filedata.get('inputtemplate','') + ") not found!"
+                xml = "<upload filename=\"" + xmlescape(filename) + "\"><error>" + xmlescape(error) + "</error></upload>\n"
+            elif inputtemplate.unique and inputtemplate.id in present:
+                error = "You have already submitted a file of this type, you can only submit one. Delete it first. (Inputtemplate=" + inputtemplate.id + ", unique=True)"
+                xml = "<upload filename=\"" + xmlescape(filename) + "\" inputtemplate=\"" + inputtemplate.id + "\"><error>" + xmlescape(error) + "</error></upload>\n"
+            elif isinstance(fetchresult, clam.common.fetcher.FetchError):
+                error = fetchresult.msg
+                xml = "<upload filename=\"" + xmlescape(filename) + "\" inputtemplate=\"" + inputtemplate.id + "\"><error>" + xmlescape(error) + "</error></upload>\n"
+            else:
+                seq = 0 if inputtemplate.unique else nextseq[inputtemplate.id]
+                xml, error, parametererrors, count = addfile(project, filename, user, filedata, None, 'batch', upload=item if source == 'file' else None, inputtemplate=inputtemplate, nextseq=seq, fetched=tmpfile)
+                errors = errors or parametererrors
+            if tmpfile is not None and os.path.exists(tmpfile):
+                os.unlink(tmpfile) #not moved into place
+            if count:
+                nextseq[inputtemplate.id] = seq + count
+                if not error:
+                    present.add(inputtemplate.id)
+            output += xml
+            if error:
+                fatalerror = error
+
+        output = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<clamupload>\n" + output + "</clamupload>"
+        if fatalerror:
+            printlog('Fatal Error during batch upload: ' + fatalerror)
+            return 403, "text/xml; charset=UTF-8", output
+        elif errors:
+            printdebug('There were parameter errors during batch upload!')
+            return 403, "text/xml; charset=UTF-8", output
+        return 200, "text/xml", output
+
+    if urls and not uploads and postdata.get('async','') not in ('','0','no','false'):
+        uploadid = "%032x" % random.getrandbits(128)
+        asyncupload = AsyncUpload(Project.path(project, user), uploadid, len(urls))
+
+        @flask.copy_current_request_context
+        def processinbackground():
+            try:
+                asyncupload.finish(*process(asyncupload))
+            except Exception as e: #pylint: disable=broad-except
+                printlog("Processing of upload " + uploadid + " failed: " + repr(e))
+                asyncupload.finish(500, "text/plain", "Processing of the uploaded files failed")
+
+        printlog("Fetching " + str(len(urls)) + " urls in the background (upload " + uploadid + ")")
+        threading.Thread(target=processinbackground, name="clamfetch", daemon=True).start()
+        url = getrooturl() + '/' + project + '/upload/' + uploadid + '/'
+        msg = json.dumps({'id': uploadid, 'url': url, 'total': len(urls), 'done': 0})
+        return withheaders(flask.make_response(msg, 202), 'application/json', {'Location': url, 'allow_origin': settings.ALLOW_ORIGIN})
+
+    code, contenttype, output = process()
+    if code != 200:
+        return withheaders(flask.make_response(output,code),headers={'allow_origin': settings.ALLOW_ORIGIN})
+    return withheaders(flask.make_response(output), contenttype, {'allow_origin': settings.ALLOW_ORIGIN})
+
+
 
 def interfacedata(): #no auth
     inputtemplates_mem = []
@@ -2421,6 +3213,10 @@ def interfacedata(): #no auth
     return withheaders(flask.make_response("systemid = '"+ settings.SYSTEM_ID + "'; baseurl = '" + getrooturl() + "';\n inputtemplates = [ " + ",".join(inputtemplates) + " ];"), 'text/javascript', {'allow_origin': settings.ALLOW_ORIGIN})
 
 def foliaxsl(**kwargs):
+    try:
+        import foliatools
+    except ImportError:
+        foliatools = None
     if foliatools is not None:
         return withheaders(flask.make_response(io.open(foliatools.__path__[0] + '/folia2html.xsl','r',encoding='utf-8').read()),'text/xsl', {'allow_origin': settings.ALLOW_ORIGIN})
     else:
@@ -2657,8 +3453,8 @@ class ActionHandler:
                     printdebug("    action stdout:\n" + stdoutdata)
                     printdebug("    action stderr:\n" + stderrdata)
                 printlog("Dispatcher finished with code " + str(process.returncode) )
-                if tmpdir:
-                    shutil.rmtree(tmpdir)
+                if tmpdir and os.path.exists(tmpdir):
+                    trash(tmpdir)
                 if process.returncode in action.returncodes200:
                     if viewer:
                         output = viewer.view(io.StringIO(stdoutdata), baseurl=getrooturl())
@@ -2747,8 +3543,78 @@ class ActionHandler:
 
 
 def sufficientresources(user, project):
+    """Checks whether the project may be started now, returns a (bool, message) tuple"""
+    sufresources, resmsg = checkquota(user, project)
+    if sufresources:
+        sufresources, resmsg = availableresources(user)
+    return sufresources, resmsg
+
+def checkquota(user, project):
+    """Checks whether the service is enabled and the user and project are within their quota. These do not change by waiting, so a project failing these checks is refused rather than queued."""
     if not settings.ENABLED:
         return False, "Service is disabled for maintenance"
+    if user:
+        projects, totalsize = getprojects(user)
+        if settings.USERQUOTA > 0 and totalsize > settings.USERQUOTA:
+            return False , "You exceeded your disk quota, refusing to start the project"
+        if settings.PROJECTQUOTA > 0 and project:
+            for p in projects:
+                if p[0] == project:
+                    if p[2] > settings.PROJECTQUOTA:
+                        return False, "Your project is too large, to run. The input files exceed the maximum of "  + str(settings.PROJECTQUOTA) + " MB. Refusing to start the project."
+    return True, ""
+
+def uploadbudget(user, project, exclude=None):
+    """Returns how much (in MB) may still be added to the project before the user or project quota is exceeded, or None if there is no quota. The sizes of resumable uploads in progress count as used, except for the session passed as exclude (the one being added)."""
+    def reserved(projectpaths):
+        return sum(session.size for projectpath in projectpaths for session in clam.common.resumable.sessions(projectpath) if exclude is None or session.id != exclude.id) / 1024 / 1024
+
+    budgets = []
+    if settings.USERQUOTA > 0:
+        projectpaths = { os.path.dirname(filename) for filename in glob.glob(glob.escape(settings.ROOT + "projects/" + user) + '/*/' + clam.common.resumable.PREFIX + '*.json') }
+        budgets.append(settings.USERQUOTA - getindex().totalsize(user) - reserved(projectpaths))
+    if settings.PROJECTQUOTA > 0:
+        usage = getindex().project(user, project)
+        budgets.append(settings.PROJECTQUOTA - (usage[2] if usage is not None else 0) - reserved([Project.path(project, user)]))
+    return min(budgets) if budgets else None
+
+def availableresources(user, weight=1):
+    """Checks whether there are sufficient system resources (memory, load, disk space), enough free slots for a project of the specified weight, and the user is not running the maximum number of projects already"""
+    sufresources, resmsg = systemresources()
+    if sufresources:
+        running = runningjobs()
+        sufresources, resmsg = slotresources(weight, running)
+        if sufresources and user:
+            sufresources, resmsg = userresources(user, running)
+    return sufresources, resmsg
+
+def runningjobs():
+    """Returns the projects that are actually running, as a list of (user, project, weight) tuples. This is verified against the live process state, projects that are no longer running (but whose dispatcher did not get to unregister them) are pruned from the queue. Their journals are left alone, marking them as lost is up to the status reads."""
+    queue = getjobqueue()
+    running = []
+    for user, project, _, weight in queue.running():
+        if ProjectState(project, user).alive:
+            running.append((user, project, weight))
+        else:
+            queue.removerunning(user, project)
+    return running
+
+def slotweight(weight):
+    """A project never takes more slots than there are (it would never run otherwise)"""
+    if settings.MAXCONCURRENTPROJECTS > 0:
+        return min(weight, settings.MAXCONCURRENTPROJECTS)
+    return weight
+
+def slotresources(weight, running):
+    """Checks whether there are enough free slots (MAXCONCURRENTPROJECTS) for a project of the specified weight, given the running projects (see runningjobs())"""
+    if settings.MAXCONCURRENTPROJECTS > 0:
+        used = sum( w for _, _, w in running )
+        if used + slotweight(weight) > settings.MAXCONCURRENTPROJECTS:
+            return False, "All " + str(settings.MAXCONCURRENTPROJECTS) + " slots for running projects are in use."
+    return True, ""
+
+def systemresources():
+    """Checks whether there are sufficient system resources (memory, load, disk space) to start a project"""
     if settings.REQUIREMEMORY > 0:
         if not os.path.exists('/proc/meminfo'):
             printlog("WARNING: No /proc/meminfo available on your system! Not Linux? Skipping memory requirement check!")
@@ -2787,25 +3653,181 @@ def sufficientresources(user, project):
 
         else:
             printlog("WARNING: df " + settings.DISK + " failed. Skipping disk space check!")
-    if user:
-        projects, totalsize = getprojects(user)
-        if settings.USERQUOTA > 0 and totalsize > settings.USERQUOTA:
-            return False , "You exceeded your disk quota, refusing to start the project"
-        if settings.MAXCONCURRENTPROJECTSPERUSER > 0:
-            running = 0
-            for p in projects:
-                if p[3] == clam.common.status.RUNNING:
-                    running += 1
-            if running >= settings.MAXCONCURRENTPROJECTSPERUSER:
-                return False , "You may only run " + str(settings.MAXCONCURRENTPROJECTSPERUSER) + " project(s) simultaneously and you are already at this maximum. Refusing to start the project."
-        if settings.PROJECTQUOTA > 0 and project:
-            for p in projects:
-                if p[0] == project:
-                    if p[2] > settings.PROJECTQUOTA:
-                        return False, "Your project is too large, to run. The input files exceed the maximum of "  + str(settings.PROJECTQUOTA) + " MB. Refusing to start the project."
     return True, ""
 
+def userresources(user, running):
+    """Checks whether the user may run another project concurrently, given the running projects (see runningjobs())"""
+    if settings.MAXCONCURRENTPROJECTSPERUSER > 0:
+        if sum( 1 for u, _, _ in running if u == user ) >= settings.MAXCONCURRENTPROJECTSPERUSER:
+            return False , "You may only run " + str(settings.MAXCONCURRENTPROJECTSPERUSER) + " project(s) simultaneously and you are already at this maximum. Refusing to start the project."
+    return True, ""
+
+
+class JobScheduler:
+    """Starts the projects in the job queue as soon as there are sufficient resources and free slots, sharing the slots fairly between users. Runs as a background thread in every process of the webservice, a lock on the queue ensures only one of them schedules at any given time."""
 
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.thread = None
+
+    def ensure(self):
+        """Make sure the scheduler thread runs in this process (threads do not survive the fork of a pre-forking WSGI server)"""
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            self.pid = os.getpid()
+            self.wakeup = threading.Event()
+            self.thread = threading.Thread(target=self.run, name="clamscheduler", daemon=True)
+            self.thread.start()
+
+    def wake(self):
+        """Schedule right away rather than at the next interval"""
+        self.wakeup.set()
+
+    def run(self):
+        printdebug("Job scheduler started in process " + str(os.getpid()))
+        while True:
+            self.wakeup.wait(settings.QUEUE_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.schedule()
+            except Exception as e: #pylint: disable=broad-except
+                printlog("Job scheduler failed: " + repr(e))
+
+    def schedule(self):
+        """Start queued projects as far as resources and slots permit (but no more than QUEUE_BURST at once), returns the number of projects started.
+
+        Slots are shared fairly between users by deficit round robin: in every round, each user with queued projects
+        gains one slot worth of credit and starts their oldest project once the credit covers its weight. Users are
+        visited in order of who was served least recently. If the next project does not fit in the free slots, nothing
+        else is started either, so heavy projects can not be starved by lighter ones.
+        """
+        started = 0
+        with open(settings.ROOT + "queue.lock", 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            queue = getjobqueue()
+            pending = collections.OrderedDict() #user -> deque of (project, weight), oldest first
+            for user, project, _, weight in queue.jobs():
+                pending.setdefault(user, collections.deque()).append((project, slotweight(weight)))
+            if not pending:
+                return 0
+            shares = queue.shares()
+            for user, (deficit, _) in shares.items():
+                if deficit and user not in pending:
+                    queue.setshare(user, 0) #users without queued projects don't accumulate credit
+            deficits = { user: shares.get(user, (0,0))[0] for user in pending }
+            order = sorted(pending, key=lambda user: shares.get(user, (0,0))[1])
+            running = runningjobs()
+            blocked = False
+            while order and not blocked and started < settings.QUEUE_BURST:
+                for user in list(order):
+                    deficits[user] = min(deficits[user] + 1, max(pending[user][0][1], 1))
+                    while pending[user] and pending[user][0][1] <= deficits[user]:
+                        project, weight = pending[user][0]
+                        sufresources, resmsg = systemresources()
+                        if sufresources:
+                            sufresources, resmsg = slotresources(weight, running)
+                        if not sufresources:
+                            printdebug("Job scheduler waiting: " + resmsg)
+                            blocked = True
+                            break
+                        if not userresources(user, running)[0]:
+                            #does not hold up the projects of other users
+                            deficits[user] = 0
+                            pending[user].clear()
+                            break
+                        pending[user].popleft()
+                        if self.start(user, project, weight):
+                            running.append((user, project, weight))
+                            deficits[user] -= weight
+                            queue.setshare(user, deficits[user], time.time())
+                            started += 1
+                            if started >= settings.QUEUE_BURST:
+                                break
+                    if not pending[user]:
+                        order.remove(user)
+                        deficits[user] = 0
+                    if blocked or started >= settings.QUEUE_BURST:
+                        break
+            for user, deficit in deficits.items():
+                queue.setshare(user, deficit)
+        return started
+
+    @staticmethod
+    def start(user, project, weight):
+        """Take the project from the queue and start it, returns False if it could not be started"""
+        cmd = getjobqueue().take(user, project)
+        if cmd is None:
+            return False #aborted by the user in the meantime
+        if not os.path.isdir(Project.path(project, user)):
+            printlog("Dropping queued project '" + project + "' of user " + user + ", it no longer exists")
+            return False
+        if not Project.launch(project, user, cmd, weight):
+            printlog("Unable to launch queued project '" + project + "' of user " + user)
+            clam.common.journal.append(Project.path(project, user), clam.common.journal.FINISHED, code=1)
+            Project.updateindex(user, project, clam.common.status.DONE)
+            return False
+        return True
+
+
+class Purger:
+    """Empties the trash (see clam.common.trash) at a limited rate. Runs as a background thread in every process of the webservice, a lock ensures only one of them purges at any given time."""
+
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.thread = None
+        self.lastexpiry = 0 #time resumable uploads were last checked for expiry
+
+    def ensure(self):
+        """Make sure the purger thread runs in this process (threads do not survive the fork of a pre-forking WSGI server)"""
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            self.pid = os.getpid()
+            self.wakeup = threading.Event()
+            self.thread = threading.Thread(target=self.run, name="clampurger", daemon=True)
+            self.thread.start()
+
+    def wake(self):
+        """Purge right away rather than at the next interval"""
+        self.wakeup.set()
+
+    def run(self):
+        printdebug("Trash purger started in process " + str(os.getpid()))
+        while True:
+            try:
+                self.purge()
+            except Exception as e: #pylint: disable=broad-except
+                printlog("Trash purger failed: " + repr(e))
+            self.wakeup.wait(settings.TRASH_INTERVAL)
+            self.wakeup.clear()
+
+    def purge(self):
+        """Empty the trash, unless another process is already doing so. Returns the number of files and directories removed."""
+        with open(settings.ROOT + clam.common.trash.LOCKFILE, 'w') as lockfile:
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return 0 #it will pick up what we were woken for too
+            removed = 0
+            while True: #more may have been trashed in the meantime
+                count = clam.common.trash.purge(settings.ROOT, settings.TRASH_PURGERATE)
+                if not count:
+                    break
+                removed += count
+            if removed:
+                printdebug("Trash purger removed " + str(removed) + " files and directories")
+            if settings.BLOBSTORE:
+                #files in the content-addressed store that are no longer used by any project (also input files that were replaced, which never pass through the trash)
+                collected = clam.common.blobstore.collect(settings.ROOT)
+                if collected:
+                    printdebug("Trash purger removed " + str(collected) + " unused files from the content-addressed store")
+            if settings.RESUMABLE_TTL > 0 and time.time() - self.lastexpiry >= min(settings.RESUMABLE_TTL, 3600):
+                #abandoned resumable uploads
+                self.lastexpiry = time.time()
+                projectpaths = { os.path.dirname(filename) for filename in glob.glob(settings.ROOT + 'projects/*/*/' + clam.common.resumable.PREFIX + '*.json') }
+                expired = sum(clam.common.resumable.expire(projectpath, settings.RESUMABLE_TTL) for projectpath in projectpaths)
+                if expired:
+                    printlog("Trash purger discarded " + str(expired) + " abandoned resumable upload(s)")
+            return removed
 
 
 class CLAMService(object):
@@ -2852,6 +3874,7 @@ class CLAMService(object):
 
         if settings.OAUTH:
             if not settings.ASSUMESSL: warning("*** Oauth Authentication is enabled. THIS IS NOT SECURE WITHOUT SSL! ***")
+            if importlib.util.find_spec('requests_oauthlib') is None: warning("*** Oauth Authentication is enabled but no OAUTH2 support is available, install python-requests-oauthlib! ***")
             main_auth = clam.common.auth.OAuth2(settings.OAUTH_CLIENT_ID, settings.OAUTH_AUTH_URL, os.path.join(settings.OAUTH_CLIENT_URL, 'login'), settings.OAUTH_AUTH_FUNCTION, settings.OAUTH_USERNAME_FUNCTION, debug=printdebug,scope=settings.OAUTH_SCOPE, userinfo_url=settings.OAUTH_USERINFO_URL)
             #Allow combinations with HTTP Basic Auth
             if settings.USERS:
@@ -2936,6 +3959,7 @@ class CLAMService(object):
 
         #canonical versions
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/index/', 'index', self.auth.require_login(index), methods=['GET'], strict_slashes=False )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/index/status/', 'projectsstatus', self.auth.require_login(projectsstatus), methods=['GET','POST'], strict_slashes=False )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/porch/', 'porch', porch, methods=['GET'] , strict_slashes=False)
         printdebug("Registering info entrypoint: " + settings.INTERNALURLPREFIX + "/info/")
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/info/', 'info', info, methods=['GET'] , strict_slashes=False)
@@ -2952,6 +3976,7 @@ class CLAMService(object):
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/actions/<actionid>', 'action_delete2', self.auth.require_login(ActionHandler.DELETE, optional=True), methods=['DELETE'] )
 
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/status', 'project_status_json2', Project.status_json, methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/events', 'project_events2', Project.events, methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/upload', 'project_uploader2', uploader, methods=['POST'] ) #has it's own login mechanism
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>', 'project_get2', self.auth.require_login(Project.get), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>', 'project_start2', self.auth.require_login(Project.start), methods=['POST'] )
@@ -2966,6 +3991,7 @@ class CLAMService(object):
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/data.js', 'interfacedata', interfacedata, methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/style.css', 'styledata', styledata, methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/admin/', 'adminindex', self.auth.require_login(Admin.index), methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/admin/stats/', 'adminstats', self.auth.require_login(Admin.stats), methods=['GET'], strict_slashes=False )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/admin/download/<targetuser>/<project>/<type>/<filename>/', 'admindownloader', self.auth.require_login(Admin.downloader), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/admin/<command>/<targetuser>/<project>/', 'adminhandler', self.auth.require_login(Admin.handler), methods=['GET'] )
         #Authentication for handler is handled deeper in the ActionHandler, depending on whether allowanonymous is set
@@ -2989,12 +4015,33 @@ class CLAMService(object):
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/input/<path:filename>', 'project_addinputfile', self.auth.require_login(Project.addinputfile), methods=['POST'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/input/', 'project_addinputfile2', self.auth.require_login(Project.addinputfile_nofile), methods=['POST','GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/status/', 'project_status_json', Project.status_json, methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/events/', 'project_events', Project.events, methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/upload/', 'project_uploader', uploader, methods=['POST'] ) #has it's own login mechanism
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/upload/<uploadid>/', 'project_uploadstatus', self.auth.require_login(Project.uploadstatus), methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/resumable/', 'project_newresumable', self.auth.require_login(Project.newresumable), methods=['POST'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/resumable/<uploadid>/', 'project_resumable', self.auth.require_login(Project.resumable), methods=['GET','PUT','POST','DELETE'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/', 'project_get', self.auth.require_login(Project.get), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/', 'project_start', self.auth.require_login(Project.start), methods=['POST'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/', 'project_new', self.auth.require_login(Project.new), methods=['PUT'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/', 'project_delete', self.auth.require_login(Project.delete), methods=['DELETE'] )
 
+        if settings.LAUNCHER and not settings.REMOTEHOST and clam.common.launcher.shutdown(settings.ROOT + clam.common.launcher.LAUNCHERSOCKET):
+            printlog("Stopped dispatcher launcher from a previous run, a new one will be started on demand")
+
+        global PURGER #pylint: disable=global-statement
+        PURGER = Purger()
+        PURGER.ensure()
+        self.service.before_request(PURGER.ensure)
+
+        if settings.WORKERS:
+            workers = getjobqueue().workers()
+            printlog("Projects are run by worker agents, " + str(len(workers)) + " worker(s) registered, " + str(len(getjobqueue())) + " project(s) queued")
+        elif settings.QUEUE:
+            global JOBSCHEDULER #pylint: disable=global-statement
+            printlog("Job queue enabled, " + str(len(getjobqueue())) + " project(s) queued")
+            JOBSCHEDULER = JobScheduler()
+            JOBSCHEDULER.ensure()
+            self.service.before_request(JOBSCHEDULER.ensure)
 
         self.mode = mode
         if self.mode != 'wsgi' and (settings.OAUTH or settings.PREAUTHHEADER or settings.BASICAUTH):
@@ -3086,6 +4133,58 @@ def set_defaults():
         settings.USERQUOTA = 0
     if 'PROJECTQUOTA' not in settingkeys:
         settings.PROJECTQUOTA = 0 #unlimited
+    if 'ARCHIVE_MAXSIZE' not in settingkeys: #maximum total size (in MB, uncompressed) of the files in an uploaded archive, 0 = unlimited (the quota still applies)
+        settings.ARCHIVE_MAXSIZE = 0
+    if 'ARCHIVE_MAXFILES' not in settingkeys: #maximum number of files in an uploaded archive, 0 = unlimited
+        settings.ARCHIVE_MAXFILES = 10000
+    if 'UPLOAD_WORKERS' not in settingkeys: #number of threads that generate metadata for and validate the files of an uploaded archive
+        settings.UPLOAD_WORKERS = 4
+    if 'RESUMABLE_TTL' not in settingkeys: #seconds without receiving data after which an unfinished resumable upload is discarded (0 = never)
+        settings.RESUMABLE_TTL = 86400
+    if 'UPLOAD_TIMEOUT' not in settingkeys: #seconds without progress after which an upload processed in the background is considered failed, and after which the result of such an upload is removed if it was not collected
+        settings.UPLOAD_TIMEOUT = 3600
+    if 'BLOBSTORE' not in settingkeys: #keep a single copy of identical input files in a content-addressed store under ROOT, hard linked into the projects
+        settings.BLOBSTORE = False
+    if 'URLFETCH_TIMEOUT' not in settingkeys: #timeout (seconds) when connecting to or waiting for a remote server when an input file is obtained from a url
+        settings.URLFETCH_TIMEOUT = 60
+    if 'URLFETCH_MAXDURATION' not in settingkeys: #maximum time (seconds) obtaining an input file from a url may take as a whole, 0 = unlimited
+        settings.URLFETCH_MAXDURATION = 3600
+    if 'URLFETCH_WORKERS' not in settingkeys: #number of urls fetched concurrently when several are added in one request
+        settings.URLFETCH_WORKERS = 4
+    if 'URLCACHE' not in settingkeys: #keep files obtained from urls in a cache under ROOT, they are only transferred again if the remote server reports they changed
+        settings.URLCACHE = True
+    if 'URLCACHE_MAXSIZE' not in settingkeys: #maximum size (in MB) of the url cache, the least recently used files are removed beyond it, 0 = unlimited
+        settings.URLCACHE_MAXSIZE = 1024
+    if 'SENDFILE' not in settingkeys: #let the web server in front of CLAM send input and output files: 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache with mod_xsendfile, lighttpd), None to send them through the WSGI server
+        settings.SENDFILE = None
+    if 'SENDFILE_PREFIX' not in settingkeys: #internal location under which the web server serves ROOT, for x-accel-redirect
+        settings.SENDFILE_PREFIX = '/clamroot/'
+    if 'QUEUE' not in settingkeys: #queue projects that can not be started due to insufficient resources, rather than refusing them (503)
+        settings.QUEUE = False
+    if 'QUEUE_INTERVAL' not in settingkeys: #interval (seconds) at which the scheduler checks whether queued projects can be started
+        settings.QUEUE_INTERVAL = 2
+    if 'QUEUE_BURST' not in settingkeys: #maximum number of queued projects started per interval (the load average lags behind, so don't start too many at once)
+        settings.QUEUE_BURST = 1
+    if 'QUEUE_MAXLENGTH' not in settingkeys: #maximum number of projects in the queue, further projects are refused (0 = unlimited)
+        settings.QUEUE_MAXLENGTH = 0
+    if 'WORKERS' not in settingkeys: #projects are not started by the webservice but queued for worker agents (clamworker) to run, on this or other hosts sharing ROOT
+        settings.WORKERS = False
+    if 'WORKER_TIMEOUT' not in settingkeys: #seconds without a heartbeat after which a worker agent, and the projects it runs, are considered lost
+        settings.WORKER_TIMEOUT = 60
+    if 'LOST_GRACEPERIOD' not in settingkeys: #seconds the journal of a project whose process is gone must be left untouched before the project is marked as failed (the dispatcher normally finishes it up itself)
+        settings.LOST_GRACEPERIOD = 10
+    if 'TRASH_PURGERATE' not in settingkeys: #maximum number of files and directories per second the background purger removes from the trash (0 = unlimited)
+        settings.TRASH_PURGERATE = 2000
+    if 'TRASH_INTERVAL' not in settingkeys: #seconds between checks of the trash for things left by other processes
+        settings.TRASH_INTERVAL = 60
+    if 'LAUNCHER' not in settingkeys: #start dispatchers from a pre-forked launcher process rather than through the shell (not used with REMOTEHOST)
+        settings.LAUNCHER = False
+    if 'EVENTS_INTERVAL' not in settingkeys: #interval (seconds) at which the events stream checks for status changes
+        settings.EVENTS_INTERVAL = 1
+    if 'EVENTS_HEARTBEAT' not in settingkeys: #interval (seconds) at which a heartbeat is sent over an otherwise idle events stream
+        settings.EVENTS_HEARTBEAT = 15
+    if 'EVENTS_MAXDURATION' not in settingkeys: #maximum duration (seconds) of an events stream, it occupies a worker (thread) of the WSGI server all that time, the client reconnects afterwards. 0 = unlimited
+        settings.EVENTS_MAXDURATION = 300
     if 'PROFILES' not in settingkeys:
         settings.PROFILES = []
     if 'INPUTSOURCES' not in settingkeys:
@@ -3109,6 +4208,8 @@ def set_defaults():
             settings.MINDISKSPACE = 0
     if 'MAXCONCURRENTPROJECTSPERUSER' not in settingkeys:
         settings.MAXCONCURRENTPROJECTSPERUSER = 0 #unlimited
+    if 'MAXCONCURRENTPROJECTS' not in settingkeys: #number of slots for running projects on this host, a project takes as many slots as the weight of its profile
+        settings.MAXCONCURRENTPROJECTS = 0 #unlimited
     if 'DISK' not in settingkeys:
         settings.DISK = None
     if 'STYLE' not in settingkeys:
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- CLAM Worker --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Worker agent that runs projects on a compute node. When the webservice is configured with ``WORKERS = True`` it
+does not start projects itself but puts them all in the job queue (in ``ROOT``, which has to be on a filesystem shared
+by the webservice and all compute nodes). One or more agents, on one or more hosts, claim projects from the queue as
+long as they have free slots and run them with the dispatcher, just like the webservice would. Every agent checks in
+with a heartbeat; projects of agents that stopped checking in are marked as lost."""
+
+import sys
+import os
+import time
+import signal
+import socket
+import argparse
+import importlib
+import subprocess
+
+import clam.common.status
+import clam.common.journal
+import clam.common.jobqueue
+import clam.common.projectindex
+
+VERSION = '3.3.0'
+
+#seconds without a heartbeat after which a worker is considered lost (overridden by WORKER_TIMEOUT in the settings)
+TIMEOUT = 60
+
+class Worker:
+    """Worker agent, claims projects from the job queue in ``ROOT`` as long as it has free slots and runs them"""
+
+    def __init__(self, settingsmodule, name=None, capacity=1, interval=2, settings=None):
+        self.settingsmodule = settingsmodule
+        self.settings = settings if settings is not None else importlib.import_module(settingsmodule)
+        self.root = self.settings.ROOT
+        self.host = socket.gethostname()
+        self.name = name if name else self.host + ":" + str(os.getpid())
+        self.capacity = capacity #number of slots
+        self.interval = interval #seconds between checks of the queue
+        self.timeout = getattr(self.settings, 'WORKER_TIMEOUT', TIMEOUT)
+        self.maxperuser = getattr(self.settings, 'MAXCONCURRENTPROJECTSPERUSER', 0)
+        self.maxtotal = getattr(self.settings, 'MAXCONCURRENTPROJECTS', 0) #slots over all workers together
+        self.maxloadavg = getattr(self.settings, 'MAXLOADAVG', 0)
+        self.queue = clam.common.jobqueue.JobQueue(self.root, wal=False)
+        self.index = clam.common.projectindex.ProjectIndex(self.root, wal=False)
+        self.processes = {} #(user, project) -> (process, weight)
+        self.draining = False
+
+    def log(self, msg):
+        print("[CLAM Worker " + self.name + "] " + msg, file=sys.stderr)
+        sys.stderr.flush()
+
+    def path(self, user, project):
+        return os.path.join(self.root, "projects", user, project) + "/"
+
+    def used(self):
+        """Number of slots in use"""
+        return sum(weight for _, weight in self.processes.values())
+
+    def step(self):
+        """Do one round of work: reap finished dispatchers, check in, mark projects of lost workers, and claim projects as long as there are free slots. Returns the number of projects started."""
+        self.reap()
+        self.queue.heartbeat(self.name, self.host, os.getpid(), self.capacity, self.used())
+        self.reaplost()
+        started = 0
+        while not self.draining:
+            used = self.used()
+            if used >= self.capacity:
+                break
+            if self.maxloadavg > 0 and os.getloadavg()[0] > self.maxloadavg:
+                break
+            #a project that takes more slots than the worker has can only run on an idle worker
+            job = self.queue.claim(self.name, self.capacity - used if used else None, self.maxperuser, self.maxtotal)
+            if job is None:
+                break
+            if self.start(*job):
+                started += 1
+        return started
+
+    def start(self, user, project, cmd, weight):
+        """Start the dispatcher for a claimed project, returns False if it could not be started"""
+        projectpath = self.path(user, project)
+        if not os.path.isdir(projectpath):
+            self.log("Dropping project '" + project + "' of user " + user + ", it no longer exists")
+            self.queue.removerunning(user, project)
+            return False
+        try:
+            with open(projectpath + "output/error.log", 'wb') as stderr:
+                process = subprocess.Popen([sys.executable, "-m", "clam.clamdispatcher", self.settingsmodule, projectpath, cmd], cwd=projectpath, stdin=subprocess.DEVNULL, stderr=stderr, start_new_session=True)
+        except (OSError, ValueError) as e:
+            self.log("Unable to start project '" + project + "' of user " + user + ": " + str(e))
+            clam.common.journal.append(projectpath, clam.common.journal.FINISHED, code=1)
+            self.queue.removerunning(user, project)
+            self.index.update(user, project, clam.common.status.DONE, clam.common.projectindex.timestamp(projectpath))
+            return False
+        self.log("Started project '" + project + "' of user " + user + " (pid " + str(process.pid) + ", " + str(weight) + " slot(s))")
+        clam.common.journal.append(projectpath, clam.common.journal.STARTED, pid=process.pid, worker=self.name)
+        self.queue.addrunning(user, project, process.pid, weight, self.name)
+        self.index.update(user, project, clam.common.status.RUNNING, clam.common.projectindex.timestamp(projectpath))
+        self.processes[(user, project)] = (process, weight)
+        return True
+
+    def reap(self):
+        """Forget about dispatchers that finished (they update the journal, the index and the queue themselves)"""
+        for key, (process, _) in list(self.processes.items()):
+            if process.poll() is not None:
+                self.log("Project '" + key[1] + "' of user " + key[0] + " finished with exit code " + str(process.returncode))
+                del self.processes[key]
+
+    def reaplost(self):
+        """Mark the projects of workers that stopped checking in as lost (finished with an error), and unregister those workers"""
+        now = time.time()
+        for name, _, _, _, _, heartbeat in self.queue.workers():
+            if name != self.name and now - heartbeat > self.timeout:
+                self.log("Worker " + name + " has not checked in for " + str(round(now - heartbeat)) + "s, marking its projects as lost")
+                for user, project, _, _ in self.queue.claimed(name):
+                    projectpath = self.path(user, project)
+                    if os.path.isdir(projectpath):
+                        state = clam.common.journal.read(projectpath)
+                        if state is not None and not state.done:
+                            clam.common.journal.append(projectpath, clam.common.journal.FINISHED, code=1, lost=True)
+                        self.index.update(user, project, clam.common.status.DONE, clam.common.projectindex.timestamp(projectpath))
+                    self.queue.removerunning(user, project)
+                self.queue.removeworker(name)
+
+    def drain(self, signum=None, frame=None): #pylint: disable=unused-argument
+        """Stop claiming new projects, the worker exits once the running projects are done. A second signal makes it exit right away (running projects will then be marked as lost)."""
+        if self.draining:
+            self.log("Exiting")
+            self.queue.removeworker(self.name)
+            sys.exit(1)
+        self.log("Draining: no longer claiming projects, waiting for " + str(len(self.processes)) + " running project(s)")
+        self.draining = True
+
+    def run(self):
+        self.log("Started (CLAM v" + str(VERSION) + ", " + str(self.capacity) + " slot(s), root " + self.root + ")")
+        signal.signal(signal.SIGTERM, self.drain)
+        signal.signal(signal.SIGINT, self.drain)
+        try:
+            while True:
+                self.step()
+                if self.draining and not self.processes:
+                    break
+                time.sleep(self.interval)
+        finally:
+            self.queue.removeworker(self.name)
+        self.log("Done")
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLAM worker agent: runs projects of a CLAM webservice (configured with WORKERS = True) on this host, claiming them from the shared job queue", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n','--name', type=str,help="Name of the worker, must be unique (defaults to host:pid)", action='store',required=False)
+    parser.add_argument('-s','--slots', type=float,help="Number of slots, i.e. how many projects (of weight 1) may run simultaneously", action='store',default=1)
+    parser.add_argument('-i','--interval', type=float,help="Interval (in seconds) at which the queue is checked", action='store',default=2)
+    parser.add_argument('-c','--config', type=str,help="Path to external YAML configuration file to import", action='store',required=False)
+    parser.add_argument('-v','--version',help="Version", action='version',version="CLAM version " + str(VERSION))
+    parser.add_argument('settingsmodule', type=str, help='The webservice service configuration to be imported (for instance: clam.config.textstats), the same as the webservice uses.')
+    args = parser.parse_args()
+    if args.config:
+        os.environ['CONFIGFILE'] = args.config #passed through the environment
+    return Worker(args.settingsmodule, args.name, args.slots, args.interval).run()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,11 +22,6 @@ import flask
 import clam.common.oauth
 from clam.common.digestauth import pwhash
 
-try:
-    from requests_oauthlib import OAuth2Session
-except ImportError:
-    print( "WARNING: No OAUTH2 support available in your version of Python! Install python-requests-oauthlib if you plan on using OAUTH2 for authentication!", file=sys.stderr)
-
 
 class NoAuth(object):
     def require_login(self, f, optional=False):
@@ -417,7 +412,7 @@ class OAuth2(HTTPAuth):
         kwargslogin = {'redirect_uri': self.redirect_url}
         if self.scope:
             kwargslogin['scope'] = self.scope
-        oauthsession = OAuth2Session(self.client_id, **kwargslogin)
+        oauthsession = clam.common.oauth.session(self.client_id, **kwargslogin)
         if self.userinfo_url: oauthsession.USERINFO_URL = self.userinfo_url
         auth_url, _state = self.auth_function(oauthsession, self.auth_url)
         return 'Bearer auth_server="{0}"'.format(auth_url) #following https://stackoverflow.com/questions/50921816/standard-http-header-to-indicate-location-of-openid-connect-server , realm is OPTIONAL so I skip it here
@@ -472,7 +467,7 @@ class OAuth2(HTTPAuth):
                         kwargslogin = {'redirect_uri': self.redirect_url}
                         if self.scope:
                             kwargslogin['scope'] = self.scope
-                        oauthsession = OAuth2Session(self.client_id, **kwargslogin)
+                        oauthsession = clam.common.oauth.session(self.client_id, **kwargslogin)
                         if self.userinfo_url: oauthsession.USERINFO_URL = self.userinfo_url
                         auth_url, state = self.auth_function(oauthsession, self.auth_url) #pylint: disable=unused-variable
                         kwargs['credentials'] = {'user': 'anonymous','401response': flask.redirect(auth_url)}
@@ -485,7 +480,7 @@ class OAuth2(HTTPAuth):
                     if self.scope:
                         kwargs['scope'] = self.scope
                     self.printdebug("OAuth2 details, client=" + self.client_id + ": " + repr(kwargs))
-                    oauthsession = OAuth2Session(self.client_id, **kwargs)
+                    oauthsession = clam.common.oauth.session(self.client_id, **kwargs)
                     if self.userinfo_url: oauthsession.USERINFO_URL = self.userinfo_url
                     auth_url, state = self.auth_function(oauthsession, self.auth_url) #pylint: disable=unused-variable
 
@@ -499,7 +494,7 @@ class OAuth2(HTTPAuth):
                         response.set_cookie(key, value, max_age=600)
                     return response
                 else:
-                    oauthsession = OAuth2Session(self.client_id, token={'access_token': oauth_access_token, 'token_type': 'bearer'})
+                    oauthsession = clam.common.oauth.session(self.client_id, token={'access_token': oauth_access_token, 'token_type': 'bearer'})
                     if self.userinfo_url: oauthsession.USERINFO_URL = self.userinfo_url
                     try:
                         username = self.username_function(oauthsession)
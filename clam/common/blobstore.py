@@ -0,0 +1,154 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Content-addressed store --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Content-addressed store of input files, shared by all projects. Every file is stored once under ``ROOT/blobs/``,
+named by its SHA-256 digest, and placed in the projects that use it as a hard link. The files are made read-only as
+they are shared. The link count of a file is its reference count: once no project links to it anymore (its projects
+were deleted and the trash was purged), ``collect()`` removes it from the store. For every user, the digests of the
+files they added are recorded under ``ROOT/blobusers/``, so that a user can only take files from the store that they
+added themselves before."""
+
+import os
+import stat
+import shutil
+import hashlib
+
+BLOBDIR = "blobs"
+USERDIR = "blobusers" #digests of the files added by each user
+BUFSIZE = 65536
+
+def valid(digest):
+    """Is this a valid (lowercase hexadecimal) SHA-256 digest?"""
+    return len(digest) == 64 and all(c in '0123456789abcdef' for c in digest)
+
+def path(root, digest):
+    """Returns the path of a file in the store"""
+    return os.path.join(root, BLOBDIR, digest[:2], digest)
+
+def userpath(root, user, digest):
+    """Returns the path of the record that the user added a file with this digest"""
+    return os.path.join(root, USERDIR, user, digest)
+
+def has(root, digest, user=None):
+    """Is a file with this digest in the store? If a user is passed, only files that this user added count."""
+    if not valid(digest) or not os.path.exists(path(root, digest)):
+        return False
+    return user is None or os.path.exists(userpath(root, user, digest))
+
+def record(root, user, filedigest):
+    """Record that the user added a file with this digest to the store"""
+    filename = userpath(root, user, filedigest)
+    if not os.path.exists(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        open(filename, 'wb').close()
+
+def digest(filename):
+    """Compute the SHA-256 digest of a file"""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(BUFSIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def receive(stream, filename):
+    """Write the stream to the file, computing its SHA-256 digest along the way. Returns the digest."""
+    h = hashlib.sha256()
+    with open(filename, 'wb') as f:
+        while True:
+            chunk = stream.read(BUFSIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+            f.write(chunk)
+    return h.hexdigest()
+
+def place(root, filename, filedigest=None):
+    """Deduplicate a file: add it to the store, or if the store already has it, replace it by a link to the stored
+    file. The digest is computed if not passed. Returns the digest, or None if the file could not be linked (e.g. when
+    it is on another filesystem than the store) and was left as it is."""
+    if os.path.islink(filename):
+        return None
+    if filedigest is None:
+        filedigest = digest(filename)
+    blob = path(root, filedigest)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    while True:
+        try:
+            os.link(filename, blob) #new in the store
+            os.chmod(blob, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            return filedigest
+        except FileExistsError:
+            pass
+        except OSError:
+            return None
+        try:
+            if os.path.samestat(os.stat(filename), os.stat(blob)):
+                return filedigest #already linked
+            os.link(blob, filename + '.blob')
+        except FileNotFoundError:
+            continue #collected in the meantime, store it anew
+        except OSError:
+            return None #e.g. too many links, keep the copy
+        os.replace(filename + '.blob', filename)
+        return filedigest
+
+def fetch(root, filedigest, filename, copy=False):
+    """Place a file from the store in a project, as a link (or as a copy that may be modified). Returns False if the store does not have it."""
+    while True:
+        blob = path(root, filedigest)
+        try:
+            if copy:
+                shutil.copyfile(blob, filename)
+                return True
+            os.link(blob, filename)
+            return True
+        except FileNotFoundError:
+            return False
+        except FileExistsError:
+            os.unlink(filename)
+        except OSError:
+            copy = True #e.g. too many links
+
+def collect(root):
+    """Remove the files that no project links to anymore. Returns the number of files removed."""
+    removed = 0
+    try:
+        shards = list(os.scandir(os.path.join(root, BLOBDIR)))
+    except FileNotFoundError:
+        return 0
+    for shard in shards:
+        if not shard.is_dir(follow_symlinks=False):
+            continue
+        for entry in os.scandir(shard.path):
+            try:
+                if entry.stat(follow_symlinks=False).st_nlink <= 1:
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    try:
+        users = list(os.scandir(os.path.join(root, USERDIR)))
+    except FileNotFoundError:
+        users = []
+    for userdir in users:
+        if not userdir.is_dir(follow_symlinks=False):
+            continue
+        for entry in os.scandir(userdir.path):
+            if not os.path.exists(path(root, entry.name)):
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+    return removed
@@ -18,6 +18,11 @@
 
 import os.path
 import sys
+import json
+import time
+import hashlib
+import threading
+import concurrent.futures
 import requests
 import certifi
 from requests_toolbelt import MultipartEncoder #pylint: disable=import-error
@@ -28,6 +33,13 @@ import clam.common.status
 import clam.common.parameters
 import clam.common.formats
 import clam.common.data
+import clam.common.resumable
+
+RESUMABLE_THRESHOLD = 64 * 1024 * 1024 #files of at least this size (in bytes) are uploaded in chunks by addinputfile(), if the server supports it
+RESUMABLE_CHUNKSIZE = 8 * 1024 * 1024
+RESUMABLE_PARALLEL = 4 #number of chunks uploaded simultaneously
+RESUMABLE_RETRIES = 5 #number of times an upload of a chunk is resumed before giving up
+DEDUP_THRESHOLD = 1024 * 1024 #for files of at least this size (in bytes), addinputfile() first checks whether the server already has them
 
 
 #for debug of requests:
@@ -80,6 +92,7 @@ class CLAMClient:
             self.password = None
             self.initauth()
         self.loadmetadata = loadmetadata
+        self.blobstore = None #does the server have a content-addressed store? (None if not known yet)
 
 
     def initauth(self):
@@ -212,6 +225,15 @@ class CLAMClient:
         """Get index of projects. Returns a ``CLAMData`` instance. Use CLAMData.projects for the index of projects."""
         return self.request('index/')
 
+    def projectsstatus(self, projects=None, running=False):
+        """Get the status of many projects in a single request. Takes a list of project IDs (defaults to all projects), set ``running=True`` to only report running projects. Returns a list of dictionaries with the keys ``project``, ``statuscode``, ``message``, ``completion``, ``exitstatus`` and ``size`` (or ``error`` if a project was not found)."""
+        data = {}
+        if projects:
+            data['projects'] = ",".join(projects)
+        if running:
+            data['running'] = '1'
+        return json.loads(self.request('index/status/', 'POST', data, parse=False))
+
     def porch(self):
         """Get the porch page, basically a stripped-down response that works without authentication."""
         return self.request('porch/')
@@ -355,7 +377,7 @@ class CLAMClient:
         if inputtemplate.filename:
             filename = inputtemplate.filename
         elif inputtemplate.extension:
-            if filename.lower()[-4:] == '.zip' or filename.lower()[-7:] == '.tar.gz' or filename.lower()[-8:] == '.tar.bz2':
+            if clam.common.data.archiveformat(filename):
                 #pass archives as-is
                 return filename
 
@@ -401,6 +423,19 @@ class CLAMClient:
             * ``metadata`` - A metadata object.
             * ``metafile`` - A metadata file (filename)
 
+        Keyword arguments for resumable uploads:
+            * ``resumable`` - Upload the file in chunks that are resent automatically if the connection drops (boolean).
+              By default this is done for files of at least ``RESUMABLE_THRESHOLD`` bytes, if the server supports it. Set
+              to the ID of an earlier resumable upload to only send what it is still missing.
+            * ``chunksize`` - The size of the chunks in bytes (default: ``RESUMABLE_CHUNKSIZE``)
+            * ``parallel`` - The number of chunks to upload simultaneously (default: ``RESUMABLE_PARALLEL``)
+            * ``retries`` - The number of times to resume a chunk before giving up (default: ``RESUMABLE_RETRIES``)
+
+        Keyword arguments for deduplication:
+            * ``dedup`` - First check whether the server already has a file with the same contents (by its SHA-256
+              digest), and only send the file if it does not (boolean). By default this is done for files of at least
+              ``DEDUP_THRESHOLD`` bytes, if the server has a content-addressed store.
+
         Any other keyword arguments will be passed as metadata and matched with the input template's parameters.
 
         Example::
@@ -425,6 +460,12 @@ class CLAMClient:
             else:
                 filename = self.getinputfilename(inputtemplate, os.path.basename(sourcefile.name) )
 
+        resumable = kwargs.pop('resumable', None)
+        chunksize = kwargs.pop('chunksize', RESUMABLE_CHUNKSIZE)
+        parallel = kwargs.pop('parallel', RESUMABLE_PARALLEL)
+        retries = kwargs.pop('retries', RESUMABLE_RETRIES)
+        dedup = kwargs.pop('dedup', None)
+
         data = {"file": (filename,sourcefile,inputtemplate.formatclass.mimetype), 'inputtemplate': inputtemplate.id}
         for key, value in kwargs.items():
             if key == 'filename':
@@ -437,23 +478,143 @@ class CLAMClient:
             else:
                 data[key] = value
 
+        try:
+            size = os.fstat(sourcefile.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            size = None #not a file on disk
+        if resumable is None:
+            resumable = size is not None and size >= RESUMABLE_THRESHOLD
+        if dedup is None:
+            dedup = size is not None and size >= DEDUP_THRESHOLD
+
+        r = None
+        if dedup and self.blobstore is not False:
+            r = self._dedupupload(project, sourcefile, filename, data)
+        if r is None and resumable:
+            r = self._resumableupload(project, sourcefile, filename, data, resumable, chunksize, parallel, retries)
+        if r is None:
+            requestparams = self.initrequest(data)
+            if 'auth'in requestparams:
+                #TODO: streaming support doesn't work with authentication unfortunately, disabling streaming for now:
+                del data['file']
+                requestparams['data'] = data
+                requestparams['files'] = [('file', (filename,sourcefile, inputtemplate.formatclass.mimetype))]
+                if 'metafile' in kwargs:
+                    del data['metafile']
+                    requestparams['files'].append(('metafile',('.'+ filename + '.METADATA', open(kwargs['metafile'],'rb'), 'text/xml')))
+            else:
+                #streaming support
+                encodeddata = MultipartEncoder(fields=requestparams['data']) #from requests-toolbelt, necessary for streaming support
+                requestparams['data'] = encodeddata
+                requestparams['headers']['Content-Type'] = encodeddata.content_type
+            r = requests.post(self.url + project + '/input/' + filename,**requestparams)
+        sourcefile.close()
+
+        if r.status_code == 400:
+            raise clam.common.data.BadRequest()
+        elif r.status_code == 401:
+            raise clam.common.data.AuthRequired()
+        elif r.status_code == 403:
+            if r.text[0] == '<':
+                #XML response
+                return self._parseupload(r.text)
+            else:
+                raise clam.common.data.PermissionDenied(r.text)
+        elif r.status_code == 404:
+            raise clam.common.data.NotFound(r.text)
+        elif r.status_code == 500:
+            raise clam.common.data.ServerError(r.text)
+        elif r.status_code == 405:
+            raise clam.common.data.ServerError("Server returned 405: Method not allowed for POST on " + self.url + project + '/input/' + filename)
+        elif r.status_code == 408:
+            raise clam.common.data.TimeOut()
+        elif not (r.status_code >= 200 and r.status_code <= 299):
+            raise Exception("An error occured, return code " + str(r.status_code))
+
+        return self._parseupload(r.text)
+
+
+
+    def addinputfiles(self, project, inputtemplate, sourcefiles, **kwargs):
+        """Add/upload multiple input files to the CLAM service in a single request.
+
+        project - the ID of the project you want to add the files to.
+        inputtemplate - The input template you want to use for the files (InputTemplate instance or ID), may be None if it is specified for each file
+        sourcefiles - A list of files to add, each either a filename or a ``(filename, options)`` tuple, where options
+            is a dictionary that can hold an ``inputtemplate``, a ``filename`` for on the server and metadata
+            parameters just for that file.
+
+        Keyword arguments:
+            * ``metadata`` - A metadata object, for all files.
+
+        Any other keyword arguments will be passed as metadata for all files and matched with the input templates' parameters.
+
+        Example::
+
+            client.addinputfiles("myproject", "someinputtemplate", ["/path/to/file1", ("/path/to/file2", {"parameter1": "blah"})], parameterX=3.5)
+
+        """
+        projectdata = None
+        def getinputtemplate(inputtemplate):
+            nonlocal projectdata
+            if isinstance(inputtemplate, str): #pylint: disable=undefined-variable
+                if projectdata is None:
+                    projectdata = self.get(project) #causes an extra query to server
+                return projectdata.inputtemplate(inputtemplate)
+            elif not isinstance(inputtemplate, clam.common.data.InputTemplate):
+                raise Exception("inputtemplate must be instance of InputTemplate. Get from CLAMData.inputtemplate(id)")
+            return inputtemplate
+
+        if inputtemplate is not None:
+            inputtemplate = getinputtemplate(inputtemplate)
+
+        data = {}
+        if inputtemplate is not None:
+            data['inputtemplate'] = inputtemplate.id
+        for key, value in kwargs.items():
+            if key == 'metadata':
+                assert isinstance(value, clam.common.data.CLAMMetaData)
+                data['metadata'] =  value.xml()
+            else:
+                data[key] = value
+
+        files = []
+        manifest = []
+        for sourcefile in sourcefiles:
+            if isinstance(sourcefile, tuple):
+                sourcefile, options = sourcefile
+                options = dict(options)
+            else:
+                options = {}
+            if 'inputtemplate' in options:
+                fileinputtemplate = getinputtemplate(options['inputtemplate'])
+                options['inputtemplate'] = fileinputtemplate.id
+            elif inputtemplate is not None:
+                fileinputtemplate = inputtemplate
+            else:
+                raise Exception("No inputtemplate specified for " + str(sourcefile))
+            if 'metadata' in options:
+                assert isinstance(options['metadata'], clam.common.data.CLAMMetaData)
+                options['metadata'] = options['metadata'].xml()
+            options['filename'] = self.getinputfilename(fileinputtemplate, options.get('filename', os.path.basename(sourcefile)))
+            files.append(('file', (options['filename'], open(sourcefile,'rb'), fileinputtemplate.formatclass.mimetype)))
+            manifest.append(options)
+        data['manifest'] = json.dumps(manifest)
 
         requestparams = self.initrequest(data)
-        if 'auth'in requestparams:
-            #TODO: streaming support doesn't work with authentication unfortunately, disabling streaming for now:
-            del data['file']
-            requestparams['data'] = data
-            requestparams['files'] = [('file', (filename,sourcefile, inputtemplate.formatclass.mimetype))]
-            if 'metafile' in kwargs:
-                del data['metafile']
-                requestparams['files'].append(('metafile',('.'+ filename + '.METADATA', open(kwargs['metafile'],'rb'), 'text/xml')))
+        if 'auth' in requestparams:
+            #streaming support doesn't work with authentication (see addinputfile())
+            requestparams['files'] = files
         else:
             #streaming support
-            encodeddata = MultipartEncoder(fields=requestparams['data']) #from requests-toolbelt, necessary for streaming support
+            encodeddata = MultipartEncoder(fields=list(data.items()) + files) #from requests-toolbelt, necessary for streaming support
             requestparams['data'] = encodeddata
             requestparams['headers']['Content-Type'] = encodeddata.content_type
-        r = requests.post(self.url + project + '/input/' + filename,**requestparams)
-        sourcefile.close()
+        try:
+            r = requests.post(self.url + project + '/input/',**requestparams)
+        finally:
+            for _, (_, f, _) in files:
+                f.close()
 
         if r.status_code == 400:
             raise clam.common.data.BadRequest()
@@ -469,8 +630,6 @@ class CLAMClient:
             raise clam.common.data.NotFound(r.text)
         elif r.status_code == 500:
             raise clam.common.data.ServerError(r.text)
-        elif r.status_code == 405:
-            raise clam.common.data.ServerError("Server returned 405: Method not allowed for POST on " + self.url + project + '/input/' + filename)
         elif r.status_code == 408:
             raise clam.common.data.TimeOut()
         elif not (r.status_code >= 200 and r.status_code <= 299):
@@ -478,6 +637,119 @@ class CLAMClient:
 
         return self._parseupload(r.text)
 
+    def _dedupupload(self, project, sourcefile, filename, data):
+        """Add a file from the content-addressed store of the server without sending it, if the server already has a
+        file with the same SHA-256 digest. For internal use, see ``addinputfile()``. Returns the response of the server
+        to adding the file, or None if the file has to be sent after all."""
+        digest = hashlib.sha256()
+        sourcefile.seek(0)
+        while True:
+            chunk = sourcefile.read(65536)
+            if not chunk:
+                break
+            digest.update(chunk)
+        sourcefile.seek(0)
+
+        data = dict(data)
+        del data['file']
+        data['sha256'] = digest.hexdigest()
+        metafile = data.pop('metafile', None)
+        requestparams = self.initrequest(data)
+        if metafile is not None:
+            requestparams['files'] = [('metafile',('.'+ filename + '.METADATA', metafile, 'text/xml'))]
+        r = requests.post(self.url + project + '/input/' + filename, **requestparams)
+        if metafile is not None:
+            metafile.seek(0) #for when the file is sent after all
+        if r.status_code == 501:
+            self.blobstore = False #the server has no content-addressed store, don't ask again
+            return None
+        elif r.status_code == 404 or (r.status_code == 403 and r.text[:1] != '<'):
+            return None #not in the store (or an older server that does not know the parameter)
+        self.blobstore = True
+        return r
+
+    def _resumableupload(self, project, sourcefile, filename, data, uploadid, chunksize, parallel, retries):
+        """Upload a file in chunks to a resumable upload session, and add it to the input files once the server has it
+        all. For internal use, see ``addinputfile()``. Returns the response of the server to adding the file, or None
+        if the server does not support resumable uploads."""
+
+        def check(r):
+            if r.status_code == 400:
+                raise clam.common.data.BadRequest()
+            elif r.status_code == 401:
+                raise clam.common.data.AuthRequired()
+            elif r.status_code == 403:
+                raise clam.common.data.PermissionDenied(r.text)
+            elif r.status_code == 404:
+                raise clam.common.data.NotFound(r.text)
+            elif r.status_code >= 500:
+                raise clam.common.data.ServerError(r.text)
+            elif not (r.status_code >= 200 and r.status_code <= 299):
+                raise Exception("An error occured, return code " + str(r.status_code))
+
+        size = os.fstat(sourcefile.fileno()).st_size
+        if isinstance(uploadid, str):
+            #resume an earlier upload
+            r = requests.get(self.url + project + '/resumable/' + uploadid + '/', **self.initrequest())
+        else:
+            r = requests.post(self.url + project + '/resumable/', **self.initrequest({'size': size, 'filename': filename}))
+            if r.status_code in (404, 405):
+                return None #not supported by the server
+        check(r)
+        session = r.json()
+        if session['size'] != size:
+            raise Exception("The size of the file does not match that of the upload " + session['id'])
+        url = session['url']
+
+        lock = threading.Lock()
+        def read(begin, end):
+            with lock:
+                sourcefile.seek(begin)
+                return sourcefile.read(end - begin)
+
+        def send(begin, end):
+            attempt = 0
+            while True:
+                requestparams = self.initrequest(read(begin, end))
+                requestparams['headers']['Content-Range'] = "bytes %d-%d/%d" % (begin, end - 1, size)
+                try:
+                    r = requests.put(url, **requestparams)
+                    if r.status_code == 200:
+                        return
+                    elif r.status_code < 500:
+                        check(r)
+                    error = clam.common.data.ServerError(r.text)
+                except requests.RequestException as e:
+                    error = e
+                attempt += 1
+                if attempt > retries:
+                    raise error
+                time.sleep(min(2 ** attempt, 30))
+                #ask the server how much it got, and only send the remainder
+                try:
+                    gaps = clam.common.resumable.missing(requests.get(url, **self.initrequest()).json()['received'], size, begin, end)
+                except (requests.RequestException, ValueError, KeyError):
+                    continue
+                if not gaps:
+                    return
+                begin = gaps[0][0]
+
+        chunks = []
+        for begin, end in clam.common.resumable.missing(session['received'], size):
+            for offset in range(begin, end, chunksize):
+                chunks.append((offset, min(offset + chunksize, end)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+            for _ in pool.map(lambda chunk: send(*chunk), chunks):
+                pass
+
+        #all there, add the file
+        data = dict(data)
+        del data['file']
+        metafile = data.pop('metafile', None)
+        requestparams = self.initrequest(data)
+        if metafile is not None:
+            requestparams['files'] = [('metafile',('.'+ filename + '.METADATA', metafile, 'text/xml'))]
+        return requests.post(url, **requestparams)
 
 
     def addinput(self, project, inputtemplate, contents, **kwargs):
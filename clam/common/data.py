@@ -18,13 +18,11 @@
 
 
 import sys
-import requests
 import os.path
 import io
 import json
 import time
 import re
-import yaml
 import itertools
 import random
 import shutil
@@ -37,6 +35,7 @@ import clam.common.parameters
 import clam.common.status
 import clam.common.util
 import clam.common.viewers
+from clam.common.util import escape, shellsafe, escapeshelloperators, unescapeshelloperators, DISALLOWINSHELLSAFE #pylint: disable=unused-import #moved to clam.common.util, kept here for backward compatibility
 
 VERSION = '3.3.0'
 
@@ -46,8 +45,6 @@ WRAPPERDIR = os.path.abspath(os.path.dirname(__file__) + '/../wrappers/')
 
 #clam.common.formats is deliberately imported _at the end_
 
-DISALLOWINSHELLSAFE = ('|','&',';','!','<','>','{','}','`','\n','\r','\t')
-
 CUSTOM_FORMATS = []  #will be injected
 CUSTOM_VIEWERS = []  #will be injected
 ROOT = "./" #will be injected
@@ -244,6 +241,7 @@ class CLAMFile:
                 requestparams = self.client.initrequest()
             else:
                 requestparams = {}
+            import requests #imported on demand, only needed for remote files
             response = requests.get(self.projectpath + self.basedir + '/' + self.filename + '/metadata', **requestparams)
             if response.status_code != 200:
                 extramsg = ""
@@ -271,11 +269,13 @@ class CLAMFile:
             if not os.path.exists(fullpath):
                 raise FileNotFoundError("No such file or directory: " + fullpath )
             if self.metadata and 'encoding' in self.metadata:
-                for line in io.open(fullpath, 'r', encoding=self.metadata['encoding']).readlines():
-                    yield line
+                with io.open(fullpath, 'r', encoding=self.metadata['encoding']) as f:
+                    for line in f:
+                        yield line
             else:
-                for line in io.open(fullpath, 'rb').readlines():
-                    yield line
+                with io.open(fullpath, 'rb') as f:
+                    for line in f:
+                        yield line
         else:
             fullpath = self.projectpath + self.basedir + '/' + self.filename
             if self.client:
@@ -283,6 +283,7 @@ class CLAMFile:
             else:
                 requestparams = {}
             requestparams['stream'] = True
+            import requests #imported on demand, only needed for remote files
             response = requests.get(self.projectpath + self.basedir + '/' + self.filename, **requestparams)
             if self.metadata and 'encoding' in self.metadata:
                 for line in response.iter_lines():
@@ -309,10 +310,11 @@ class CLAMFile:
             if os.path.exists(metafile):
                 os.unlink(metafile)
 
-            #also remove any .*.INPUTTEMPLATE.* links that pointed to this file: simply remove all dead links
-            for linkf,realf in clam.common.util.globsymlinks(self.projectpath + self.basedir + '/.*.INPUTTEMPLATE.*'):
-                if not os.path.exists(realf):
-                    os.unlink(linkf)
+            #also remove the file from the input manifest
+            if self.basedir == 'input':
+                import clam.common.manifest #pylint: disable=import-outside-toplevel
+                with clam.common.manifest.Manifest(self.projectpath) as manifest:
+                    manifest.remove(self.filename)
 
             return True
         else:
@@ -320,6 +322,7 @@ class CLAMFile:
                 requestparams = self.client.initrequest()
             else:
                 requestparams = {}
+            import requests #imported on demand, only needed for remote files
             requests.delete( self.projectpath + self.basedir + '/' + self.filename, **requestparams)
             return True
 
@@ -360,6 +363,7 @@ class CLAMFile:
             requestparams = {}
             if self.client:
                 requestparams = self.client.initrequest()
+            import requests #imported on demand, only needed for remote files
             response = requests.put( self.projectpath + self.basedir + '/' + self.filename, **requestparams)
             response.raise_for_status()
             return response.json()
@@ -496,7 +500,7 @@ class CLAMData:
 
         * ``baseurl``         - The base URL to the service (string)
         * ``projecturl``      - The full URL to the selected project, if any  (string)
-        * ``status``          - Can be: ``clam.common.status.READY`` (0),``clam.common.status.RUNNING`` (1), or ``clam.common.status.DONE`` (2)
+        * ``status``          - Can be: ``clam.common.status.READY`` (0),``clam.common.status.RUNNING`` (1), ``clam.common.status.DONE`` (2), or ``clam.common.status.QUEUED`` (3)
         * ``statusmessage``   - The latest status message (string)
         * ``completion``      - An integer between 0 and 100 indicating
                           the percentage towards completion.
@@ -544,13 +548,16 @@ class CLAMData:
         #: String containing the full URL to the project, if a project was indeed selected
         self.projecturl = ''
 
-        #: The current status of the service, returns clam.common.status.READY (1), clam.common.status.RUNNING (2), or clam.common.status.DONE (3)
+        #: The current status of the service, returns clam.common.status.READY (0), clam.common.status.RUNNING (1), clam.common.status.DONE (2), or clam.common.status.QUEUED (3)
         self.status = clam.common.status.READY
 
         #: The current status of the service in a human readable message
         self.statusmessage = ""
         self.completion = 0
 
+        #: Resource usage of the last run (dictionary), only available when the project is done
+        self.stats = None
+
         #: This contains a list of (parametergroup, [parameters]) tuples.
         self.parameters = []
 
@@ -657,6 +664,16 @@ class CLAMData:
                     self.errors = ((node.attrib['errors'] == 'yes') or (node.attrib['errors'] == '1'))
                 if 'errormsg' in node.attrib:
                     self.errormsg = node.attrib['errormsg']
+            elif node.tag == 'stats':
+                self.stats = {}
+                for key, value in node.attrib.items():
+                    try:
+                        self.stats[key] = int(value)
+                    except ValueError:
+                        try:
+                            self.stats[key] = float(value)
+                        except ValueError:
+                            self.stats[key] = value
             elif node.tag == 'parameters':
                 for parametergroupnode in node:
                     if parametergroupnode.tag == 'parametergroup':
@@ -874,12 +891,21 @@ def profiler(profiles, projectpath,parameters,serviceid,servicename,serviceurl,p
 
 
 class Profile:
-    def __init__(self, *args):
-        """Create a Profile. Arguments can be of class InputTemplate, OutputTemplate or ParameterCondition"""
+    def __init__(self, *args, **kwargs):
+        """Create a Profile. Arguments can be of class InputTemplate, OutputTemplate or ParameterCondition.
+
+        Keyword arguments:
+
+        * ``weight`` - The number of slots (see ``MAXCONCURRENTPROJECTS``) a project matching this profile takes when it runs, for resource-intensive profiles (default: 1)
+        """
 
         self.input = []
         self.output = []
 
+        self.weight = kwargs.get('weight', 1)
+        if self.weight <= 0:
+            raise ValueError("Profile weight must be positive")
+
         haveerrorlog = False
 
         for arg in args:
@@ -1683,19 +1709,10 @@ class InputTemplate:
         return self.generate(metadata,user)
 
     def matchingfiles(self, projectpath):
-        """Checks if the input conditions are satisfied, i.e the required input files are present. We use the symbolic links .*.INPUTTEMPLATE.id.seqnr to determine this. Returns a list of matching results (seqnr, filename, inputtemplate)."""
-        results = []
-
-        if projectpath[-1] == '/':
-            inputpath = projectpath + 'input/'
-        else:
-            inputpath = projectpath + '/input/'
-
-        for linkf,realf in clam.common.util.globsymlinks(inputpath + '/.*.INPUTTEMPLATE.' + self.id + '.*'):
-            seqnr = int(linkf.split('.')[-1])
-            results.append( (seqnr, realf[len(inputpath):], self) )
-        results = sorted(results)
-        #print("MATCHINGFILES: ", results,file=sys.stderr) #REMOVE DEBUG
+        """Checks if the input conditions are satisfied, i.e the required input files are present. We use the input manifest of the project to determine this. Returns a list of matching results (seqnr, filename, inputtemplate)."""
+        import clam.common.manifest #pylint: disable=import-outside-toplevel
+        with clam.common.manifest.Manifest(projectpath) as manifest:
+            results = [ (seqnr, filename, self) for seqnr, filename, _ in manifest.files(self.id) ]
         if self.unique and len(results) != 1:
             return []
         return results
@@ -2757,76 +2774,6 @@ def getformats(profiles):
     return formats
 
 
-def escape(s, quote):
-    s2 = ""
-    for i, c in enumerate(s):
-        if c == quote:
-            escapes = 0
-            j = i - 1
-            while j > 0:
-                if s[j] == "\\":
-                    escapes += 1
-                else:
-                    break
-                j -= 1
-            if escapes % 2 == 0: #even number of escapes, we need another one
-                s2 += "\\"
-        s2 += c
-    return s2
-
-def shellsafe(s, quote='', doescape=True):
-    """Returns the value string, wrapped in the specified quotes (if not empty), but checks and raises an Exception if the string is at risk of causing code injection"""
-    if len(s) > 1024:
-        raise ValueError("Variable value rejected for security reasons: too long")
-    if quote:
-        if quote in s:
-            if doescape:
-                s = escape(s,quote)
-            else:
-                raise ValueError("Variable value rejected for security reasons: " + s)
-        return quote + s + quote
-    else:
-        for c in s:
-            if c in DISALLOWINSHELLSAFE:
-                raise ValueError("Variable value rejected for security reasons: " + s)
-        return s
-
-def escapeshelloperators(s):
-    inquote = False
-    indblquote = False
-    o = ""
-    for c in s:
-        if c == "'" and not indblquote:
-            inquote = not inquote
-            o += c
-        elif c == '"' and not inquote:
-            indblquote = not indblquote
-            o += c
-        elif not inquote and not indblquote:
-            if c == '|':
-                o += '%PIPE%'
-            elif c == '>':
-                o +=  '%OUT%'
-            elif c == '<':
-                o += '%IN%'
-            elif c == '&':
-                o += '%AMP%'
-            elif c == '!':
-                o += '%EXCL%'
-            else:
-                o += c
-        else:
-            o += c
-    return o
-
-def unescapeshelloperators(s):
-    s = s.replace('%PIPE%','|')
-    s = s.replace('%OUT%','>')
-    s = s.replace('%AMP%','&')
-    s = s.replace('%EXCL%','!')
-    s = s.replace('%IN%','<')
-    return s
-
 def loadconfig(callername, required=True):
     """This function loads an external configuration file. It is called directly by the service configuration script and complements the configuration specified there. The function in turn automatically searches for an appropriate configuration file (in several paths). Host and system specific configuration files are prioritised over more generic ones.
 
@@ -2932,6 +2879,7 @@ def resolveconfigvariables(value, settingsmodule):
 def loadconfigfile(configfile, settingsmodule):
     """This function loads an external configuration file. It is usually not invoked directly but through ``loadconfig()`` which handles searching for the right configuration file in the right paths, with fallbacks."""
 
+    import yaml #imported on demand, only needed for external configuration files
     clam.common.util.printlog("Loading configuration file " + configfile)
     with io.open(configfile,'r', encoding='utf-8') as f:
         data = yaml.safe_load(f.read())
@@ -2976,6 +2924,99 @@ class AbstractConverter:
             raise Exception("Convertor " + self.__class__.__name__ + " can not convert input files to " + outputfile.metadata.__class__.__name__ + "!")
         return [] #Return converted contents (must be an iterable) or raise an exception on error
 
+#archive formats that can be uploaded and extracted, by extension (longest first)
+ARCHIVEFORMATS = (('.tar.gz','tar.gz'), ('.tar.bz2','tar.bz2'), ('.tar.xz','tar.xz'), ('.tar.zst','tar.zst'), ('.tgz','tar.gz'), ('.tar','tar'), ('.zip','zip'))
+
+def archiveformat(filename):
+    """Returns the archive format of the file based on its extension (see ARCHIVEFORMATS), or None if it is not an archive that can be extracted"""
+    filename = filename.lower()
+    for extension, fmt in ARCHIVEFORMATS:
+        if filename.endswith(extension):
+            return fmt
+    return None
+
+def archivemembers(fileobj, fmt):
+    """Generator over the regular files in an archive, yields (name, size, file object) tuples in archive order. The archive is read as a stream where the format permits (tar), a zip archive has to be seekable."""
+    if fmt == 'zip':
+        import zipfile #pylint: disable=import-outside-toplevel
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as f:
+                        yield info.filename, info.file_size, f
+        return
+    import tarfile #pylint: disable=import-outside-toplevel
+    if fmt == 'tar.zst' and 'zst' not in tarfile.TarFile.OPEN_METH: #natively supported as of Python 3.14
+        try:
+            import zstandard #pylint: disable=import-outside-toplevel
+        except ImportError:
+            raise UploadError("Extracting .tar.zst archives requires the zstandard module, which is not installed")
+        fileobj = zstandard.ZstdDecompressor().stream_reader(fileobj)
+        fmt = 'tar'
+    with tarfile.open(fileobj=fileobj, mode='r|' + (fmt[4:] if fmt != 'tar' else '')) as archive:
+        for member in archive:
+            if member.isfile(): #links, directories and special files are skipped
+                yield member.name, member.size, archive.extractfile(member)
+
+def sizelabel(size):
+    """Returns a human readable label for a size in bytes"""
+    if size < 1024:
+        return str(size) + " bytes"
+    if size < 1024 * 1024:
+        return str(round(size / 1024, 1)) + " KB"
+    return str(round(size / 1024 / 1024, 1)) + " MB"
+
+def extractarchive(fileobj, fmt, targetpath, maxsize=0, maxfiles=0):
+    """Extract the regular files of an archive, streaming each to a temporary name next to its final location. ``targetpath`` is a function that gets the (base) name of a member and returns the path to write it to (or None to skip it).
+    Hidden files are skipped. Raises UploadError if the archive is invalid or exceeds ``maxsize`` bytes (uncompressed) or ``maxfiles`` files (0 = unlimited); extraction then stops
+    right away and the temporary files are removed again, files that existed already are left untouched. Only once the whole archive is accepted are the files moved to their final
+    locations (replacing any existing ones). Returns a list of (name, path) tuples for the extracted files."""
+    import tarfile, zipfile #pylint: disable=import-outside-toplevel,multiple-imports
+    extracted = []
+    pending = {} #path -> temporary path
+    totalsize = 0
+    try:
+        for name, size, f in archivemembers(fileobj, fmt):
+            name = os.path.basename(name.replace('\\','/'))
+            if not name or name[0] == '.':
+                continue
+            if maxfiles and len(extracted) >= maxfiles:
+                raise UploadError("Archive contains too many files, the maximum is " + str(maxfiles))
+            if maxsize and totalsize + size > maxsize:
+                raise UploadError("Archive is too large, it exceeds the maximum of " + sizelabel(maxsize))
+            path = targetpath(name)
+            if path is None:
+                continue
+            if path in pending: #a later member with the same name wins
+                os.unlink(pending[path])
+                extracted = [ (n, p) for n, p in extracted if p != path ]
+            tmppath = os.path.join(os.path.dirname(path), ".%s.%08x.extract" % (os.path.basename(path), random.getrandbits(32)))
+            pending[path] = tmppath
+            extracted.append((name, path))
+            with open(tmppath, 'xb') as out:
+                while True:
+                    chunk = f.read(65536)
+                    if not chunk:
+                        break
+                    totalsize += len(chunk)
+                    if maxsize and totalsize > maxsize: #the size in the header may lie
+                        raise UploadError("Archive is too large, it exceeds the maximum of " + sizelabel(maxsize))
+                    out.write(chunk)
+    except (tarfile.TarError, zipfile.BadZipFile, zipfile.LargeZipFile, EOFError, OSError, RuntimeError, NotImplementedError) as e:
+        error = UploadError("Unable to extract archive: " + str(e))
+    except UploadError as e:
+        error = e
+    else:
+        for path, tmppath in pending.items():
+            os.replace(tmppath, path)
+        return extracted
+    for tmppath in pending.values():
+        try:
+            os.unlink(tmppath)
+        except FileNotFoundError:
+            pass
+    raise error
+
 def buildarchive(project, path, fmt):
     """Build a download archive, returns the full file path"""
 
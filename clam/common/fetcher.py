@@ -0,0 +1,215 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- URL fetcher --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Fetching of input files from URLs. All fetches of a process share a single pool of connections, several URLs can be
+fetched concurrently, and fetched files are kept in a cache keyed by URL. A cached file is revalidated with the remote
+server (through its ETag or Last-Modified date) every time it is requested, and only transferred again if it changed."""
+
+import os
+import json
+import time
+import random
+import shutil
+import hashlib
+import threading
+import concurrent.futures
+import requests
+import requests.adapters
+
+CACHEDIR = "urlcache" #in ROOT
+BUFSIZE = 65536
+
+class FetchError(Exception):
+    """Raised when a URL could not be fetched"""
+    def __init__(self, msg):
+        self.msg = msg
+        super().__init__(msg)
+
+
+class Budget:
+    """The number of bytes that several fetches may write together, shared by the threads that run them. Once a fetch would exceed it, it is exhausted and all further fetches fail."""
+
+    def __init__(self, size):
+        self.remaining = size
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    def take(self, size):
+        """Take size bytes from the budget, returns False (and marks the budget as exhausted) if there is not enough left"""
+        with self.lock:
+            if self.exhausted or size > self.remaining:
+                self.exhausted = True
+                return False
+            self.remaining -= size
+            return True
+
+    def release(self, size):
+        """Return bytes taken by a fetch that failed"""
+        with self.lock:
+            self.remaining += size
+
+
+class Fetcher:
+    """Fetches URLs to files. A single instance can be shared by all threads of a process. Pass a cache directory to enable the cache, its size (in bytes) is bounded by maxcachesize (0 = unlimited).
+    The timeout (seconds) applies to connecting and to every read, maxduration (seconds, 0 = unlimited) to a fetch as a whole."""
+
+    def __init__(self, cachedir=None, timeout=60, maxcachesize=0, poolsize=10, maxduration=0):
+        self.cachedir = cachedir
+        self.timeout = timeout
+        self.maxduration = maxduration
+        self.maxcachesize = maxcachesize
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=poolsize, pool_maxsize=poolsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if cachedir:
+            os.makedirs(cachedir, exist_ok=True)
+
+    def cachefile(self, url):
+        """Returns the path of the cached file for the URL (whether it exists or not), its validators are in a .json file next to it"""
+        return os.path.join(self.cachedir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def lookup(self, url):
+        """Returns the validators of the cached file for the URL, as a dictionary, or None if it is not cached"""
+        if not self.cachedir:
+            return None
+        try:
+            with open(self.cachefile(url) + '.json','r',encoding='utf-8') as f:
+                validators = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if validators.get('url') != url:
+            return None
+        return validators
+
+    def fetch(self, url, target, maxsize=0, budget=None):
+        """Fetch the URL to the target file, maxsize (bytes, 0 = unlimited) bounds the size of the file, a Budget the size of all files fetched with it together. Returns True if the file came from the cache, False if it was transferred. Raises FetchError on failure."""
+        if budget is not None and budget.exhausted:
+            raise FetchError("Unable to fetch " + url + ", the files fetched together exceed the available disk space")
+        validators = self.lookup(url)
+        if validators is not None:
+            cached = self.transfer(url, target, maxsize, validators, budget)
+            if cached is not None:
+                return cached
+            #the cached file was pruned or replaced since it was looked up, fetch it anew
+        return self.transfer(url, target, maxsize, None, budget)
+
+    def transfer(self, url, target, maxsize=0, validators=None, budget=None):
+        """Fetch the URL to the target file, asking the server whether the cached file with the given validators is still current. Returns True if the file came from the cache, False if it was transferred, None if the server said the cached file is current but it is no longer there."""
+        headers = {}
+        if validators is not None:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('lastmodified'):
+                headers['If-Modified-Since'] = validators['lastmodified']
+        begintime = time.time()
+        taken = 0 #bytes taken from the budget
+        try:
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+                if r.status_code == 304 and validators is not None:
+                    return self.copycached(url, target, maxsize, validators, budget)
+                if not (r.status_code >= 200 and r.status_code < 300):
+                    raise FetchError("No remote data could be obtained from " + url)
+                size = 0
+                with open(target,'wb') as f:
+                    for chunk in r.iter_content(chunk_size=BUFSIZE):
+                        size += len(chunk)
+                        if maxsize and size > maxsize:
+                            raise FetchError("The file at " + url + " is too large")
+                        if budget is not None:
+                            if not budget.take(len(chunk)):
+                                raise FetchError("Unable to fetch " + url + ", the files fetched together exceed the available disk space")
+                            taken += len(chunk)
+                        if self.maxduration and time.time() - begintime > self.maxduration:
+                            raise FetchError("Fetching " + url + " took longer than " + str(self.maxduration) + " seconds")
+                        f.write(chunk)
+                validators = {'url': url, 'etag': r.headers.get('ETag'), 'lastmodified': r.headers.get('Last-Modified')}
+                cacheable = r.status_code == 200 and 'no-store' not in r.headers.get('Cache-Control','')
+        except (FetchError, requests.RequestException) as e:
+            if taken:
+                budget.release(taken)
+            if isinstance(e, FetchError):
+                raise
+            raise FetchError("No remote data could be obtained from " + url + ": " + str(e))
+        if self.cachedir and cacheable and (validators['etag'] or validators['lastmodified']):
+            self.store(url, target, validators)
+        return False
+
+    def copycached(self, url, target, maxsize, validators, budget=None):
+        """Copy the cached file for the URL to the target, provided it is still the file the validators belong to. Returns True, or None if it is gone."""
+        cachefile = self.cachefile(url)
+        try:
+            with open(cachefile,'rb') as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != validators.get('inode'):
+                    return None #replaced by another version in the meantime
+                if maxsize and st.st_size > maxsize:
+                    raise FetchError("The file at " + url + " is too large")
+                if budget is not None and not budget.take(st.st_size):
+                    raise FetchError("Unable to fetch " + url + ", the files fetched together exceed the available disk space")
+                with open(target,'wb') as out:
+                    shutil.copyfileobj(f, out, BUFSIZE)
+            os.utime(cachefile) #for the eviction of the least recently used files
+        except FileNotFoundError:
+            return None
+        return True
+
+    def store(self, url, filename, validators):
+        """Add a copy of the file fetched from the URL to the cache. The content is moved into place first, the validators (which name the file they belong to) next."""
+        cachefile = self.cachefile(url)
+        tmp = cachefile + ".%08x.tmp" % random.getrandbits(32) #concurrent fetches of the same URL each write their own
+        shutil.copyfile(filename, tmp)
+        validators = dict(validators, inode=os.stat(tmp).st_ino)
+        os.replace(tmp, cachefile)
+        with open(tmp + '.json','w',encoding='utf-8') as f:
+            json.dump(validators, f)
+        os.replace(tmp + '.json', cachefile + '.json')
+        if self.maxcachesize:
+            self.prune()
+
+    def prune(self):
+        """Remove the least recently used files from the cache until it is within its maximum size"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cachedir):
+            if '.' in entry.name:
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.maxcachesize:
+                break
+            for filename in (path + '.json', path):
+                try:
+                    os.unlink(filename)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    def fetchall(self, fetches, workers=4, maxsize=0, callback=None):
+        """Fetch several (url, target) pairs concurrently, maxsize (bytes, 0 = unlimited) bounds the size of all files together. Returns a list with, for each in order, whether it came from the cache or the FetchError it failed with. The callback, if any, is called after each fetch."""
+        budget = Budget(maxsize) if maxsize else None
+        def fetch(item):
+            url, target = item
+            try:
+                result = self.fetch(url, target, maxsize, budget)
+            except FetchError as e:
+                result = e
+            if callback is not None:
+                callback()
+            return result
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return list(pool.map(fetch, fetches))
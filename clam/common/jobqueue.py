@@ -0,0 +1,203 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Job queue --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology, Radboud University Nijmegen
+#       & KNAW Humanities Cluster
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Durable queue of projects waiting for system resources to become available, backed by SQLite. Projects are submitted
+by the webservice when they can not be started right away, and launched by the scheduler once resources free up. The
+queue survives restarts of the webservice.
+
+Alongside the queue, the database keeps the projects that are running (with the number of slots they occupy), the
+deficit counters of the fair-share scheduler for each user, and the worker agents (see ``clamworker``) that claim
+projects from the queue when the webservice does not run them itself."""
+
+import os
+import sqlite3
+import time
+import threading
+import datetime
+import clam.common.projectindex
+
+QUEUEFILE = "queue.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    project TEXT NOT NULL,
+    time TEXT NOT NULL,
+    cmd TEXT NOT NULL,
+    weight REAL NOT NULL DEFAULT 1,
+    UNIQUE (user, project)
+);
+CREATE TABLE IF NOT EXISTS running (
+    user TEXT NOT NULL,
+    project TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    weight REAL NOT NULL DEFAULT 1,
+    time TEXT NOT NULL,
+    worker TEXT,
+    PRIMARY KEY (user, project)
+);
+CREATE TABLE IF NOT EXISTS shares (
+    user TEXT PRIMARY KEY,
+    deficit REAL NOT NULL DEFAULT 0,
+    served REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    capacity REAL NOT NULL,
+    used REAL NOT NULL DEFAULT 0,
+    heartbeat REAL NOT NULL
+);
+"""
+
+
+class JobQueue:
+    """Queue of projects in order of submission, stored in a single SQLite database (in WAL mode by default, see clam.common.projectindex.JOURNALMODES) in the CLAM root directory. Can be shared by multiple webservice processes, a job can only be taken from the queue once (see ``take()``)."""
+
+    def __init__(self, root, timeout=30, wal=True):
+        self.filename = os.path.join(root, QUEUEFILE)
+        self.timeout = timeout
+        self.wal = wal #see clam.common.projectindex.JOURNALMODES
+        self.local = threading.local()
+
+    def connection(self):
+        """Returns a connection for the current thread and process (connections can not be shared over threads or carried over a fork)"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+            if self.wal is not None:
+                connection.execute("PRAGMA journal_mode=" + clam.common.projectindex.JOURNALMODES[self.wal])
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            if 'worker' not in [ column[1] for column in connection.execute("PRAGMA table_info(running)") ]:
+                connection.execute("ALTER TABLE running ADD COLUMN worker TEXT") #database from before there were workers
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def push(self, user, project, cmd, weight=1):
+        """Add a project to the end of the queue, with the command that launches it and the number of slots it takes. Returns the position in the queue (1 being the next in line). A project that is already queued keeps its position."""
+        self.connection().execute("INSERT OR IGNORE INTO queue (user, project, time, cmd, weight) VALUES (?, ?, ?, ?, ?)",
+                                  (user, project, now(), cmd, weight))
+        return self.position(user, project)
+
+    def position(self, user, project):
+        """Returns the position of the project in the queue (1 being the next in line), or None if it is not queued"""
+        row = self.connection().execute("SELECT (SELECT COUNT(*) FROM queue WHERE id <= q.id) FROM queue AS q WHERE user=? AND project=?", (user, project)).fetchone()
+        if row is not None:
+            return row[0]
+        return None
+
+    def remove(self, user, project):
+        """Remove a project from the queue, returns True if it was queued (and has not been taken by the scheduler in the meantime)"""
+        return self.connection().execute("DELETE FROM queue WHERE user=? AND project=?", (user, project)).rowcount > 0
+
+    def take(self, user, project):
+        """Take the project from the queue in order to launch it. Returns the command, or None if another process (or a user aborting it) got to it first."""
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT cmd FROM queue WHERE user=? AND project=?", (user, project)).fetchone()
+            if row is not None:
+                connection.execute("DELETE FROM queue WHERE user=? AND project=?", (user, project))
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        return row[0] if row is not None else None
+
+    def jobs(self, limit=None):
+        """Returns the queued projects in order, as a list of (user, project, time, weight) tuples"""
+        if limit is None:
+            return list(self.connection().execute("SELECT user, project, time, weight FROM queue ORDER BY id"))
+        return list(self.connection().execute("SELECT user, project, time, weight FROM queue ORDER BY id LIMIT ?", (limit,)))
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
+    def addrunning(self, user, project, pid, weight=1, worker=None):
+        """Register a project that was started, with the pid of its dispatcher, the number of slots it takes and the worker agent running it (if any)"""
+        self.connection().execute("INSERT OR REPLACE INTO running (user, project, pid, weight, time, worker) VALUES (?, ?, ?, ?, ?, ?)", (user, project, pid, weight, now(), worker))
+
+    def removerunning(self, user, project):
+        """Unregister a project that is no longer running"""
+        self.connection().execute("DELETE FROM running WHERE user=? AND project=?", (user, project))
+
+    def running(self):
+        """Returns the projects that are registered as running, as a list of (user, project, pid, weight) tuples. The registration may be stale if a process was lost, verify against the actual process state."""
+        return list(self.connection().execute("SELECT user, project, pid, weight FROM running ORDER BY time"))
+
+    def claimed(self, worker):
+        """Returns the projects registered as running on the worker agent, as a list of (user, project, pid, weight) tuples"""
+        return list(self.connection().execute("SELECT user, project, pid, weight FROM running WHERE worker=? ORDER BY time", (worker,)))
+
+    def claim(self, worker, maxweight=None, maxperuser=0, maxtotal=0):
+        """Take the next project from the queue on behalf of a worker agent and register it as running there, all in one
+        transaction so every project is claimed by one worker only. Only projects that take at most ``maxweight`` slots
+        (None for any) qualify, and not of users that already run ``maxperuser`` projects (0 for unlimited). The projects
+        running on all workers together take at most ``maxtotal`` slots (0 for unlimited, a project never counts for more
+        than all of them). The oldest project of the user that was served least recently goes first. Returns a (user,
+        project, cmd, weight) tuple, or None if there is nothing to claim."""
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT q.user, q.project, q.cmd, q.weight FROM queue AS q LEFT JOIN shares AS s ON s.user=q.user "
+                                     "WHERE (? IS NULL OR q.weight <= ?) AND (? <= 0 OR (SELECT COUNT(*) FROM running AS r WHERE r.user=q.user) < ?) "
+                                     "AND (? <= 0 OR (SELECT COALESCE(SUM(MIN(r.weight, ?)), 0) FROM running AS r) + MIN(q.weight, ?) <= ?) "
+                                     "ORDER BY COALESCE(s.served, 0), q.id LIMIT 1", (maxweight, maxweight, maxperuser, maxperuser, maxtotal, maxtotal, maxtotal, maxtotal)).fetchone()
+            if row is not None:
+                user, project, _, weight = row
+                connection.execute("DELETE FROM queue WHERE user=? AND project=?", (user, project))
+                connection.execute("INSERT OR REPLACE INTO running (user, project, pid, weight, time, worker) VALUES (?, ?, 0, ?, ?, ?)", (user, project, weight, now(), worker))
+                connection.execute("INSERT INTO shares (user, served) VALUES (?, ?) ON CONFLICT (user) DO UPDATE SET served=?", (user, time.time(), time.time()))
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        return tuple(row) if row is not None else None
+
+    def heartbeat(self, worker, host, pid, capacity, used):
+        """Register a worker agent as alive, with the number of slots it has and the number of slots in use"""
+        self.connection().execute("INSERT OR REPLACE INTO workers (name, host, pid, capacity, used, heartbeat) VALUES (?, ?, ?, ?, ?, ?)", (worker, host, pid, capacity, used, time.time()))
+
+    def workers(self):
+        """Returns the worker agents, as a list of (name, host, pid, capacity, used, heartbeat) tuples, heartbeat being the (unix) time it last checked in"""
+        return list(self.connection().execute("SELECT name, host, pid, capacity, used, heartbeat FROM workers ORDER BY name"))
+
+    def worker(self, worker):
+        """Returns the (unix) time the worker agent last checked in, or None if it is unknown"""
+        row = self.connection().execute("SELECT heartbeat FROM workers WHERE name=?", (worker,)).fetchone()
+        if row is not None:
+            return row[0]
+        return None
+
+    def removeworker(self, worker):
+        """Unregister a worker agent"""
+        self.connection().execute("DELETE FROM workers WHERE name=?", (worker,))
+
+    def shares(self):
+        """Returns the state of the fair-share scheduler: a dictionary mapping users to (deficit, served) tuples, served being the (unix) time a project of the user was last started"""
+        return { user: (deficit, served) for user, deficit, served in self.connection().execute("SELECT user, deficit, served FROM shares") }
+
+    def setshare(self, user, deficit=None, served=None):
+        """Set the deficit counter of the user and/or the (unix) time a project of the user was last started, values set to None are left untouched"""
+        self.connection().execute("INSERT INTO shares (user, deficit, served) VALUES (?, COALESCE(?, 0), COALESCE(?, 0)) ON CONFLICT (user) DO UPDATE SET deficit=COALESCE(?, deficit), served=COALESCE(?, served)",
+                                  (user, deficit, served, deficit, served))
+
+
+def now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,212 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Project journal --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology, Radboud University Nijmegen
+#       & KNAW Humanities Cluster
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Append-only journal of the run state of a project (JSON lines), shared by the webservice and the dispatcher. It replaces the .pid, .done, .abort and .aborted sentinel files."""
+
+import os
+import json
+import time
+import select
+import signal
+import datetime
+
+JOURNALFILE = ".journal"
+
+#journal events
+QUEUED = "queued" #the project was added to the job queue
+DEQUEUED = "dequeued" #the project was removed from the job queue without being started
+STARTED = "started" #the dispatcher was launched (pid of the dispatcher, and the worker agent that launched it, if any)
+PID = "pid" #the actual process was launched (pid of the process, and of the dispatcher supervising it)
+ABORT = "abort" #an abort was requested (and deletion of the project once aborted, if delete is set)
+ABORTED = "aborted" #the process was aborted
+FINISHED = "finished" #the process finished (exit code)
+RESET = "reset" #the project was reset to accept new input
+
+#inotify (Linux) flags, see inotify(7)
+IN_MODIFY = 0x2
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+
+#signal that makes the dispatcher read the journal right away (rather than at its next periodic check), sent after appending an abort request
+ABORTSIGNAL = signal.SIGUSR1
+
+def append(projectpath, event, **data):
+    """Append an event to the journal of the project. Each event is written with a single append so concurrent writers do not interleave."""
+    data['event'] = event
+    now = time.time()
+    data['time'] = datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+    data['timestamp'] = round(now, 3)
+    line = (json.dumps(data) + "\n").encode('utf-8')
+    fd = os.open(os.path.join(projectpath, JOURNALFILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+class JournalState:
+    """The current run state of a project, as folded from its journal"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.queued = None #time the project was queued (if it had to wait for resources)
+        self.queuedtimestamp = None #idem, as unix timestamp
+        self.started = None #time the run started
+        self.startedtimestamp = None #idem, as unix timestamp
+        self.pid = 0
+        self.worker = None #name of the worker agent running the project, if not run by the webservice itself
+        self.dispatcher = 0 #pid of the dispatcher, which can be signalled to abort
+        self.abortrequested = False
+        self.deleterequested = False
+        self.aborted = False
+        self.finished = None #time the run finished
+        self.exitstatus = None
+        self.peakmem = None #peak resident memory (kB) of the process tree, if sampled
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    def fold(self, data):
+        """Apply an event to the state"""
+        event = data.get('event')
+        if event == QUEUED:
+            self.clear()
+            self.queued = data['time']
+            self.queuedtimestamp = data.get('timestamp')
+        elif event == DEQUEUED:
+            self.clear()
+        elif event == STARTED:
+            queuedtimestamp = self.queuedtimestamp if self.queued else None
+            #an abort requested whilst the project was being taken from the queue applies to this run
+            abortrequested, deleterequested = (self.abortrequested, self.deleterequested) if self.queued else (False, False)
+            self.clear()
+            self.queuedtimestamp = queuedtimestamp #kept for computing the time spent waiting
+            self.abortrequested = abortrequested
+            self.deleterequested = deleterequested
+            self.started = data['time']
+            self.startedtimestamp = data.get('timestamp')
+            self.pid = data.get('pid', 0)
+            self.worker = data.get('worker')
+        elif event == PID:
+            self.pid = data['pid']
+            self.dispatcher = data.get('dispatcher', 0)
+        elif event == ABORT:
+            self.abortrequested = True
+            self.deleterequested = self.deleterequested or data.get('delete', False)
+        elif event == ABORTED:
+            self.aborted = True
+        elif event == FINISHED:
+            self.finished = data['time']
+            self.exitstatus = data.get('code', 1)
+            self.peakmem = data.get('peakmem')
+        elif event == RESET:
+            self.clear()
+
+
+class Journal:
+    """Reader for the journal of a project. Subsequent reads only parse the events appended since the previous read."""
+
+    def __init__(self, projectpath):
+        self.filename = os.path.join(projectpath, JOURNALFILE)
+        self.offset = 0
+        self.state = JournalState()
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def read(self):
+        """Read any new events and return the current state"""
+        try:
+            with open(self.filename, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return self.state
+        end = data.rfind(b"\n") + 1 #an incomplete last line (still being written) is left for the next read
+        for line in data[:end].split(b"\n"):
+            if line.strip():
+                try:
+                    self.state.fold(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    pass #corrupt line (e.g. after a crash), skip it
+        self.offset += end
+        return self.state
+
+    def wait(self, condition, timeout=None):
+        """Wait until the state satisfies the condition (a function taking the state), only newly appended events are parsed on every check. Returns the state, or None on timeout.
+        Blocks until the journal changes where inotify is available (Linux), polls it with a growing interval otherwise."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        watch = Watch(os.path.dirname(self.filename)) #set up before the first read, so no change goes unnoticed
+        interval = 0.05
+        try:
+            while True:
+                state = self.read()
+                if condition(state):
+                    return state
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                if watch.fd is not None:
+                    watch.wait(remaining)
+                else:
+                    time.sleep(min(interval, remaining) if remaining is not None else interval)
+                    interval = min(interval * 2, 1.0)
+        finally:
+            watch.close()
+
+
+class Watch:
+    """Blocks until a file in a directory is created, written or moved into it, through inotify. Where inotify is not available (other platforms than Linux), ``fd`` is None."""
+
+    def __init__(self, directory):
+        self.fd = None
+        try:
+            import ctypes #pylint: disable=import-outside-toplevel
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_MODIFY | IN_MOVED_TO | IN_CREATE) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def wait(self, timeout=None):
+        """Wait at most timeout seconds (None for no limit) for a change, returns False on timeout"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return bool(ready)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def read(projectpath):
+    """Returns the current state of the project according to its journal, or None if it has no journal"""
+    journal = Journal(projectpath)
+    if not journal.exists():
+        return None
+    return journal.read()
@@ -0,0 +1,85 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Dispatcher launcher --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology, Radboud University Nijmegen
+#       & KNAW Humanities Cluster
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Client side of the dispatcher launcher: a long-lived fork server (``clamdispatcher --serve``) that has the dispatcher
+and the service settings imported already, and forks a dispatcher for every project it is asked to start. This avoids
+starting a shell and a fresh Python interpreter (and its imports) for every project.
+
+Requests and replies are single lines of JSON over a Unix socket."""
+
+import json
+import socket
+import struct
+
+LAUNCHERSOCKET = "launcher.sock"
+
+#seconds without requests after which the launcher exits, it is started again on demand
+IDLETIMEOUT = 3600
+
+
+class LauncherError(Exception):
+    pass
+
+
+def request(socketpath, data, timeout=10):
+    """Send a request to the launcher and return its reply (a dictionary). Raises OSError if the launcher is not reachable and LauncherError if it failed to handle the request."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(socketpath)
+        s.sendall((json.dumps(data) + "\n").encode('utf-8'))
+        reply = readline(s)
+    if not reply:
+        raise LauncherError("No reply from launcher")
+    reply = json.loads(reply.decode('utf-8'))
+    if 'error' in reply:
+        raise LauncherError(reply['error'])
+    return reply
+
+def readline(s, maxlength=1024*1024):
+    """Read a single line from a socket (without the newline)"""
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = s.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > maxlength:
+            raise LauncherError("Request too long")
+    return data.rstrip(b"\n")
+
+def launch(socketpath, args, stderr, cwd):
+    """Have the launcher start a dispatcher with the specified arguments (as passed to clamdispatcher on the command line), with its standard error output written to the stderr file. Returns the pid of the dispatcher."""
+    return request(socketpath, {'action': 'launch', 'args': args, 'stderr': stderr, 'cwd': cwd})['pid']
+
+def ping(socketpath, settingsmodule=None):
+    """Returns True if a launcher (for the specified settings module, if set) is listening on the socket"""
+    try:
+        reply = request(socketpath, {'action': 'ping'}, timeout=2)
+    except (OSError, ValueError, LauncherError):
+        return False
+    return settingsmodule is None or reply.get('settingsmodule') == settingsmodule
+
+def shutdown(socketpath):
+    """Ask the launcher to exit (dispatchers it started keep running), returns False if there was no launcher"""
+    try:
+        request(socketpath, {'action': 'shutdown'}, timeout=2)
+    except (OSError, ValueError, LauncherError):
+        return False
+    return True
+
+def peeruid(s):
+    """Returns the uid of the process on the other end of a Unix socket"""
+    _, uid, _ = struct.unpack('3i', s.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))) #struct ucred: pid, uid, gid
+    return uid
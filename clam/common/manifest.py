@@ -0,0 +1,147 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Input manifest --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Manifest of the input files of a project, backed by SQLite: which input template each file was added for, with its
+sequence number, size and a digest of its metadata. Shared by the webservice and the profiles matching the input.
+
+Older projects recorded this in hidden symbolic links in the input directory (``.[filename].INPUTTEMPLATE.[id].[seq]``),
+finding them took a glob over the input directory for every query. These links are imported into the manifest the
+first time the manifest of such a project is opened. They are left in place (the project directory may not be writable
+then) but no longer read, the version recorded in the manifest marks the import as done.
+"""
+
+import os
+import sqlite3
+
+MANIFESTFILE = ".manifest.db" #in the project directory
+LINKMARKER = ".INPUTTEMPLATE."
+VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inputfiles (
+    filename TEXT NOT NULL,
+    inputtemplate TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    metadigest TEXT,
+    PRIMARY KEY (filename, inputtemplate)
+);
+CREATE INDEX IF NOT EXISTS inputfiles_inputtemplate ON inputfiles (inputtemplate, seq);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class Manifest:
+    """The input manifest of a project. An instance may only be used by the thread that created it, use it as a context manager (or call ``close()``) when done."""
+
+    def __init__(self, projectpath):
+        self.projectpath = projectpath
+        self.inputpath = os.path.join(projectpath, 'input') + '/'
+        self.filename = os.path.join(projectpath, MANIFESTFILE)
+        self.connection = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+        self.initialise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def version(self):
+        """Returns the version of the manifest, None if it was not created (completely) yet"""
+        try:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        except sqlite3.OperationalError: #no schema yet
+            return None
+        return int(row[0]) if row is not None else None
+
+    def initialise(self):
+        """Create the manifest if it was not created yet, importing the symbolic links of an older project. Safe if several processes do so at the same time."""
+        if self.version() is not None:
+            return
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    self.connection.execute(statement)
+            if self.version() is None: #not created by another process in the meantime
+                for filename, inputtemplate, seq in self.importlinks():
+                    path = self.inputpath + filename
+                    size = os.path.getsize(path) if os.path.exists(path) else 0
+                    self.connection.execute("INSERT OR REPLACE INTO inputfiles (filename, inputtemplate, seq, size) VALUES (?, ?, ?, ?)", (filename, inputtemplate, seq, size))
+                self.connection.execute("INSERT INTO meta (key, value) VALUES ('version', ?)", (str(VERSION),))
+            self.connection.execute("COMMIT")
+        except:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def importlinks(self):
+        """Find the input template links of an older project, yields (filename, inputtemplate, seq) tuples. Dead links are skipped, no links are removed."""
+        if not os.path.isdir(self.inputpath):
+            return
+        for dirpath, _, filenames in os.walk(self.inputpath):
+            for linkname in filenames:
+                if linkname[0] != '.' or LINKMARKER not in linkname:
+                    continue
+                linkf = os.path.join(dirpath, linkname)
+                if not os.path.islink(linkf):
+                    continue
+                realf = os.path.join(dirpath, os.readlink(linkf))
+                inputtemplate, seq = linkname.rsplit(LINKMARKER, 1)[1].rsplit('.', 1)
+                if os.path.exists(realf):
+                    yield os.path.relpath(realf, self.inputpath), inputtemplate, int(seq)
+
+    def add(self, filename, inputtemplate, seq, size=0, metadigest=None):
+        """Record an input file (filename relative to the input directory) for an input template"""
+        self.connection.execute("INSERT OR REPLACE INTO inputfiles (filename, inputtemplate, seq, size, metadigest) VALUES (?, ?, ?, ?, ?)", (filename, inputtemplate, seq, size, metadigest))
+
+    def addfiles(self, records):
+        """Record several input files at once, in a single transaction. The records are tuples of the arguments to add()"""
+        self.connection.execute("BEGIN")
+        try:
+            self.connection.executemany("INSERT OR REPLACE INTO inputfiles (filename, inputtemplate, seq, size, metadigest) VALUES (?, ?, ?, ?, ?)", records)
+            self.connection.execute("COMMIT")
+        except:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def remove(self, filename):
+        """Remove an input file, or all files in it if it is a directory, returns the number of entries removed"""
+        filename = filename.strip('/')
+        return self.connection.execute("DELETE FROM inputfiles WHERE filename = ? OR substr(filename, 1, ?) = ?", (filename, len(filename) + 1, filename + '/')).rowcount
+
+    def clear(self):
+        """Remove all input files"""
+        self.connection.execute("DELETE FROM inputfiles")
+
+    def files(self, inputtemplate=None):
+        """Returns (seq, filename, inputtemplate) tuples of the input files (for the specified input template), ordered by sequence number"""
+        if inputtemplate is None:
+            return self.connection.execute("SELECT seq, filename, inputtemplate FROM inputfiles ORDER BY seq, filename").fetchall()
+        return self.connection.execute("SELECT seq, filename, inputtemplate FROM inputfiles WHERE inputtemplate = ? ORDER BY seq, filename", (inputtemplate,)).fetchall()
+
+    def get(self, filename):
+        """Returns a dictionary with the inputtemplate, seq, size and metadigest of an input file (for the first input template it was added for), or None if it is not in the manifest"""
+        row = self.connection.execute("SELECT inputtemplate, seq, size, metadigest FROM inputfiles WHERE filename = ? ORDER BY seq", (filename,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('inputtemplate', 'seq', 'size', 'metadigest'), row))
+
+    def nextseq(self):
+        """Returns a dictionary mapping the input templates that have files to their next free sequence number"""
+        return { inputtemplate: maxseq + 1 for inputtemplate, maxseq in self.connection.execute("SELECT inputtemplate, MAX(seq) FROM inputfiles GROUP BY inputtemplate") }
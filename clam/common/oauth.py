@@ -9,11 +9,18 @@
 import sys
 import json
 import base64
-from requests_oauthlib import OAuth2Session
 
 class OAuthError(Exception):
     pass
 
+def session(*args, **kwargs):
+    """Returns a new OAuth2Session, requests_oauthlib is only imported once OAuth2 is actually used"""
+    try:
+        from requests_oauthlib import OAuth2Session
+    except ImportError:
+        raise ImportError("No OAUTH2 support available in your version of Python! Install python-requests-oauthlib if you plan on using OAUTH2 for authentication!")
+    return OAuth2Session(*args, **kwargs)
+
 def DEFAULT_AUTH_FUNCTION(oauthsession, authurl):
     """Default auth function, returns auth_url, state tuple"""
     return oauthsession.authorization_url(authurl)
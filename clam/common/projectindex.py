@@ -0,0 +1,240 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Project index --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology, Radboud University Nijmegen
+#       & KNAW Humanities Cluster
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Transactional index of all projects of all users, backed by SQLite. Shared by the webservice and the dispatcher.
+
+Disk usage is kept as running counters (in MB and number of files), separately for the input/ and output/ directories of
+each project, so it never has to be recomputed by walking the project tree. Use ``reconcile()`` for a full recount.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import datetime
+
+from clam.common.util import computediskusage
+
+INDEXFILE = "index.db"
+
+SECTIONS = ('input','output')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    user TEXT NOT NULL,
+    project TEXT NOT NULL,
+    time TEXT NOT NULL,
+    status INTEGER NOT NULL DEFAULT 0,
+    inputsize REAL NOT NULL DEFAULT 0.0,
+    inputfiles INTEGER NOT NULL DEFAULT 0,
+    outputsize REAL NOT NULL DEFAULT 0.0,
+    outputfiles INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user, project)
+);
+CREATE TABLE IF NOT EXISTS users (
+    user TEXT PRIMARY KEY,
+    indexed TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    project TEXT NOT NULL,
+    begintime TEXT,
+    endtime TEXT,
+    walltime REAL,
+    queuewait REAL,
+    exitstatus INTEGER,
+    aborted INTEGER,
+    usertime REAL,
+    systemtime REAL,
+    maxrss INTEGER,
+    peakmem INTEGER,
+    inblock INTEGER,
+    oublock INTEGER,
+    nvcsw INTEGER,
+    nivcsw INTEGER
+);
+"""
+
+#resource usage fields of a job (as in the jobs table and the .stats file of a project)
+JOBFIELDS = ('begintime', 'endtime', 'walltime', 'queuewait', 'exitstatus', 'aborted', 'usertime', 'systemtime', 'maxrss', 'peakmem', 'inblock', 'oublock', 'nvcsw', 'nivcsw')
+
+
+def timestamp(path=None):
+    """Returns the timestamp used in the index, either for the modification time of the specified path or the current time"""
+    if path:
+        d = datetime.datetime.fromtimestamp(os.stat(path).st_mtime)
+    else:
+        d = datetime.datetime.now()
+    return d.strftime("%Y-%m-%d %H:%M:%S")
+
+
+#SQLite journal mode to use: WAL (True) needs shared memory and thus only works if all processes accessing the database
+#run on the same host, the classic rollback journal (False) also works for worker agents on other hosts (provided the
+#shared filesystem supports locking). None leaves the database in the mode it is in.
+JOURNALMODES = {True: "WAL", False: "DELETE"}
+
+
+class ProjectIndex:
+    """Index of projects per user, stored in a single SQLite database (in WAL mode by default, see JOURNALMODES) in the CLAM root directory. Every change is a single-row transaction so concurrent workers and dispatchers never have to rewrite (or rebuild) the whole index."""
+
+    def __init__(self, root, timeout=30, wal=True):
+        self.filename = os.path.join(root, INDEXFILE)
+        self.timeout = timeout
+        self.wal = wal #see JOURNALMODES
+        self.local = threading.local()
+
+    def connection(self):
+        """Returns a connection for the current thread and process (connections can not be shared over threads or carried over a fork)"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+            if self.wal is not None:
+                connection.execute("PRAGMA journal_mode=" + JOURNALMODES[self.wal])
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def update(self, user, project, status=None, time=None):
+        """Add the project to the index or update its status and time. Status is left untouched if set to None."""
+        if time is None:
+            time = timestamp()
+        self.connection().execute("INSERT INTO projects (user, project, time, status) VALUES (?, ?, ?, ?) "
+                                  "ON CONFLICT (user, project) DO UPDATE SET time=excluded.time, status=COALESCE(?, status)",
+                                  (user, project, time, status if status is not None else 0, status))
+
+    def adjust(self, user, project, section, size, files):
+        """Increment (or decrement, for negative values) the disk usage counters for the input or output section of the project. Size is in MB."""
+        if section not in SECTIONS:
+            raise ValueError("Invalid section: " + section)
+        self.connection().execute("INSERT INTO projects (user, project, time, " + section + "size, " + section + "files) VALUES (?, ?, ?, MAX(?,0.0), MAX(?,0)) "
+                                  "ON CONFLICT (user, project) DO UPDATE SET " + section + "size=MAX(" + section + "size+?,0.0), " + section + "files=MAX(" + section + "files+?,0)",
+                                  (user, project, timestamp(), size, files, size, files))
+
+    def setusage(self, user, project, section, size, files, status=None):
+        """Set the disk usage counters for the input or output section of the project to an absolute value (size in MB), optionally sets status as well"""
+        if section not in SECTIONS:
+            raise ValueError("Invalid section: " + section)
+        self.connection().execute("INSERT INTO projects (user, project, time, status, " + section + "size, " + section + "files) VALUES (?, ?, ?, ?, ?, ?) "
+                                  "ON CONFLICT (user, project) DO UPDATE SET status=COALESCE(?, status), " + section + "size=excluded." + section + "size, " + section + "files=excluded." + section + "files",
+                                  (user, project, timestamp(), status if status is not None else 0, size, files, status))
+
+    def reconcile(self, user, project, projectpath, status=None):
+        """Full recount of the disk usage of the project by walking its input and output directories. This is expensive on large projects and only needed if the counters are suspected to have drifted. Returns the total size (MB) and number of files."""
+        totalsize = 0.0
+        totalfiles = 0
+        for section in SECTIONS:
+            size, files = computediskusage(os.path.join(projectpath, section))
+            self.setusage(user, project, section, size, files, status)
+            totalsize += size
+            totalfiles += files
+        return totalsize, totalfiles
+
+    def remove(self, user, project):
+        """Remove a project from the index"""
+        self.connection().execute("DELETE FROM projects WHERE user=? AND project=?", (user, project))
+
+    def projects(self, user):
+        """Returns a list of (project, time, size, status) tuples for the specified user, size is in MB"""
+        return [ (project, time, round(size,2), status) for project, time, size, status in self.connection().execute("SELECT project, time, inputsize+outputsize, status FROM projects WHERE user=? ORDER BY project", (user,)) ]
+
+    def project(self, user, project):
+        """Returns a (project, time, size, status) tuple for the specified project, or None if it is not in the index"""
+        row = self.connection().execute("SELECT project, time, inputsize+outputsize, status FROM projects WHERE user=? AND project=?", (user, project)).fetchone()
+        if row is not None:
+            return (row[0], row[1], round(row[2],2), row[3])
+        return None
+
+    def usage(self, user, project):
+        """Returns a dictionary with the disk usage counters of the project (sizes in MB), or None if it is not in the index"""
+        row = self.connection().execute("SELECT inputsize, inputfiles, outputsize, outputfiles FROM projects WHERE user=? AND project=?", (user, project)).fetchone()
+        if row is not None:
+            return dict(zip(('inputsize','inputfiles','outputsize','outputfiles'), row))
+        return None
+
+    def totalsize(self, user):
+        """Returns the total size of all projects of the user, in MB"""
+        return self.connection().execute("SELECT COALESCE(SUM(inputsize+outputsize),0.0) FROM projects WHERE user=?", (user,)).fetchone()[0]
+
+    def addjob(self, user, project, stats):
+        """Add a finished job to the job history, stats is a dictionary with (a subset of) the keys in JOBFIELDS"""
+        fields = [ field for field in JOBFIELDS if field in stats ]
+        self.connection().execute("INSERT INTO jobs (user, project, " + ", ".join(fields) + ") VALUES (?, ?" + ", ?" * len(fields) + ")",
+                                  [user, project] + [ stats[field] for field in fields ])
+
+    def jobs(self, user=None, limit=100):
+        """Returns the most recent jobs (optionally only for the specified user) as a list of dictionaries"""
+        if user is None:
+            cursor = self.connection().execute("SELECT user, project, " + ", ".join(JOBFIELDS) + " FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        else:
+            cursor = self.connection().execute("SELECT user, project, " + ", ".join(JOBFIELDS) + " FROM jobs WHERE user=? ORDER BY id DESC LIMIT ?", (user, limit))
+        return [ dict(zip(('user','project') + JOBFIELDS, row)) for row in cursor ]
+
+    def jobsummary(self):
+        """Returns aggregated resource usage over the job history, per user and in total (key None), as a dictionary of dictionaries"""
+        aggregates = "COUNT(*), SUM(aborted), SUM(exitstatus != 0), AVG(walltime), MAX(walltime), AVG(queuewait), MAX(queuewait), AVG(usertime+systemtime), SUM(usertime+systemtime), AVG(MAX(COALESCE(maxrss,0),COALESCE(peakmem,0))), MAX(MAX(COALESCE(maxrss,0),COALESCE(peakmem,0)))"
+        keys = ('jobs', 'aborted', 'failed', 'avgwalltime', 'maxwalltime', 'avgqueuewait', 'maxqueuewait', 'avgcputime', 'totalcputime', 'avgmaxrss', 'maxrss')
+        connection = self.connection()
+        summary = { None: dict(zip(keys, connection.execute("SELECT " + aggregates + " FROM jobs").fetchone())) }
+        for row in connection.execute("SELECT user, " + aggregates + " FROM jobs GROUP BY user"):
+            summary[row[0]] = dict(zip(keys, row[1:]))
+        return summary
+
+    def indexed(self, user):
+        """Has the index for this user been built already?"""
+        return self.connection().execute("SELECT 1 FROM users WHERE user=?", (user,)).fetchone() is not None
+
+    def setindexed(self, user):
+        """Mark the index for this user as complete"""
+        self.connection().execute("INSERT OR REPLACE INTO users (user, indexed) VALUES (?, ?)", (user, timestamp()))
+
+    def migrate(self, user, userdir):
+        """One-time migration from the legacy per-user ``.index`` JSON file. Returns True if the user's index was imported, False if there was nothing (valid) to import."""
+        legacyfile = os.path.join(userdir, '.index')
+        if not os.path.exists(legacyfile):
+            return False
+        try:
+            with open(legacyfile,'r',encoding='utf-8') as f:
+                data = json.load(f)
+            projects = [ tuple(projectdata) for projectdata in data['projects'] ]
+        except FileNotFoundError:
+            #another process beat us to it
+            return self.indexed(user)
+        except (ValueError, KeyError, TypeError):
+            #corrupt legacy index, nothing to salvage, caller will rebuild
+            renamelegacy(legacyfile, '.invalid')
+            return False
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for project, time, size, status in projects:
+                #the legacy index only has a total size, account it as input until the next reconciliation
+                connection.execute("INSERT OR REPLACE INTO projects (user, project, time, status, inputsize) VALUES (?, ?, ?, ?, ?)", (user, project, time, status, size))
+            connection.execute("INSERT OR REPLACE INTO users (user, indexed) VALUES (?, ?)", (user, timestamp()))
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        renamelegacy(legacyfile, '.migrated')
+        return True
+
+
+def renamelegacy(legacyfile, suffix):
+    try:
+        os.rename(legacyfile, legacyfile + suffix)
+    except FileNotFoundError:
+        pass #already done by a concurrent process
@@ -0,0 +1,187 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Resumable uploads --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Resumable uploads. A large input file can be sent in byte ranges (chunks), in any order and in parallel, to an
+upload session in the project directory. The session keeps track of which ranges it received, so after a dropped
+connection a client only needs to send what is missing. Once complete, the assembled file is added to the project
+like any other upload."""
+
+import os
+import time
+import json
+import fcntl
+import random
+
+PREFIX = ".resumable-" #data file in the project directory, the state is in a .json file next to it
+
+def merge(ranges):
+    """Merge a list of (begin, end) ranges (end exclusive) into a sorted list of disjoint ranges"""
+    merged = []
+    for begin, end in sorted(ranges):
+        if merged and begin <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([begin, end])
+    return merged
+
+def missing(received, size, begin=0, end=None):
+    """Returns the ranges within begin and end (the whole file by default) that are not covered by the received ranges"""
+    if end is None:
+        end = size
+    gaps = []
+    for rbegin, rend in merge(received):
+        if rend <= begin:
+            continue
+        if rbegin >= end:
+            break
+        if rbegin > begin:
+            gaps.append([begin, rbegin])
+        begin = max(begin, rend)
+    if begin < end:
+        gaps.append([begin, end])
+    return gaps
+
+def sessions(directory):
+    """Returns the sessions in a directory"""
+    found = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return found
+    for name in names:
+        if name.startswith(PREFIX) and name.endswith('.json'):
+            session = Session.load(directory, name[len(PREFIX):-5])
+            if session is not None:
+                found.append(session)
+    return found
+
+def expire(directory, ttl):
+    """Discard the sessions in a directory that did not receive anything for ttl seconds, returns the number of sessions discarded"""
+    expired = 0
+    for session in sessions(directory):
+        try:
+            if session.idle() > ttl:
+                session.discard()
+                expired += 1
+        except (FileNotFoundError, ValueError):
+            continue #discarded in the meantime
+    return expired
+
+
+class Session:
+    """An upload session in a directory. Use ``Session.create()`` to start a new one and ``Session.load()`` to get an existing one."""
+
+    def __init__(self, directory, uploadid):
+        self.id = uploadid
+        self.datafile = os.path.join(directory, PREFIX + uploadid)
+        self.statefile = self.datafile + '.json'
+        state = self.state()
+        self.name = state['name']
+        self.size = state['size']
+
+    @staticmethod
+    def create(directory, size, name):
+        """Start a new session for a file of the given size (in bytes)"""
+        if size < 0:
+            raise ValueError("Invalid size")
+        uploadid = "%032x" % random.getrandbits(128)
+        datafile = os.path.join(directory, PREFIX + uploadid)
+        with open(datafile,'wb') as f:
+            f.truncate(size) #sparse, the ranges are filled in as they come
+        with open(datafile + '.json.tmp','w',encoding='utf-8') as f:
+            json.dump({'name': name, 'size': size, 'received': [], 'created': time.time()}, f)
+        os.replace(datafile + '.json.tmp', datafile + '.json')
+        return Session(directory, uploadid)
+
+    @staticmethod
+    def load(directory, uploadid):
+        """Returns the session with the given ID, or None if it does not exist"""
+        if not uploadid or not all(c in '0123456789abcdef' for c in uploadid):
+            return None
+        try:
+            return Session(directory, uploadid)
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def state(self):
+        """Returns the state of the session as a dictionary with the ``name``, ``size``, ``received`` ranges, the time it was ``created`` and the time it last received data (``updated``, if it did)"""
+        with open(self.statefile,'r',encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            return json.load(f)
+
+    def received(self):
+        """Returns the ranges received so far"""
+        return self.state()['received']
+
+    def offset(self):
+        """Returns the number of bytes received from the beginning onward, without gaps"""
+        received = self.received()
+        if received and received[0][0] == 0:
+            return received[0][1]
+        return 0
+
+    def idle(self):
+        """Returns the number of seconds since the session was created or last received data"""
+        state = self.state()
+        return time.time() - state.get('updated', state['created'])
+
+    def complete(self):
+        """Has the entire file been received?"""
+        return not missing(self.received(), self.size)
+
+    def write(self, begin, stream, length, bufsize=65536):
+        """Write length bytes read from the stream at the given offset. If the stream ends or breaks early, whatever was
+        received is kept and recorded. Returns the number of bytes written."""
+        if begin < 0 or length < 0 or begin + length > self.size:
+            raise ValueError("Range exceeds the size of the upload")
+        written = 0
+        with open(self.datafile,'r+b') as f:
+            f.seek(begin)
+            while written < length:
+                try:
+                    chunk = stream.read(min(bufsize, length - written))
+                except Exception: #pylint: disable=broad-except
+                    break #connection dropped, keep what we got
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+            f.flush()
+            os.fsync(f.fileno()) #only record what is actually on disk
+        if written:
+            with open(self.statefile,'r+',encoding='utf-8') as f:
+                fcntl.flock(f, fcntl.LOCK_EX) #chunks may be written concurrently by several processes
+                state = json.load(f)
+                state['received'] = merge(state['received'] + [[begin, begin + written]])
+                state['updated'] = time.time()
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+        return written
+
+    def discard(self):
+        """Remove the session (and its data file, if it is still there)"""
+        for filename in (self.datafile, self.statefile):
+            try:
+                os.unlink(filename)
+            except FileNotFoundError:
+                pass
+
+    def json(self, url=None):
+        """Returns a JSON-serialisable description of the session"""
+        received = self.received()
+        d = {'id': self.id, 'filename': self.name, 'size': self.size, 'received': received,
+             'offset': received[0][1] if received and received[0][0] == 0 else 0,
+             'complete': not missing(received, self.size)}
+        if url:
+            d['url'] = url
+        return d
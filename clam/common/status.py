@@ -1,10 +1,23 @@
 import io
+import os
+import re
 import time
 import sys
+import datetime
+import threading
+import collections
 
 READY = 0
 RUNNING = 1
 DONE = 2
+QUEUED = 3 #waiting in the job queue for resources to become available
+
+DATEMATCH = re.compile(r'^[\d\.\-\s:]*$')
+
+#maximum number of status log entries kept (older entries are dropped)
+MAXLOGLENGTH = 1000
+#maximum number of status files for which a reader is cached
+MAXREADERS = 256
 
 
 def write(statusfile, statusmessage, completion = 0, timestamp = False, encoding = 'utf-8'):
@@ -17,3 +30,104 @@ def write(statusfile, statusmessage, completion = 0, timestamp = False, encoding
         f.write(str(completion) + "%\t" + str(timestamp) + "\t" + statusmessage + "\n")
         f.close()
 
+
+def parseline(line):
+    """Parse a line from a status file, returns a (message, timestamp, completion) tuple. The message is returned unstripped (or empty), completion is 0 if not specified"""
+    message = ""
+    completion = 0
+    timestamp = ""
+    for field in line.split("\t"):
+        if field:
+            if field[-1] == '%' and field[:-1].isdigit():
+                completion = int(field[:-1])
+            elif DATEMATCH.match(field):
+                if field.isdigit():
+                    try:
+                        d = datetime.datetime.fromtimestamp(float(field))
+                        timestamp = d.strftime("%d/%b/%Y %H:%M:%S")
+                    except ValueError:
+                        pass
+            else:
+                message += " " + field
+    return message, timestamp, completion
+
+
+class StatusReader:
+    """Incremental reader for a status file. Only the lines appended since the previous read are parsed, the parsed log is kept in a bounded buffer. A file that was truncated or replaced is read again from the start."""
+
+    def __init__(self, statusfile, maxlength=MAXLOGLENGTH):
+        self.statusfile = statusfile
+        self.maxlength = maxlength
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.log = collections.deque(maxlen=self.maxlength if self.maxlength > 0 else None)
+        self.totalcompletion = 0
+        self.prevmsg = None
+        self.offset = 0 #offset up to which the file has been parsed (always just after a newline)
+        self.head = b"" #first bytes of the file, to detect files that were replaced
+        self.inode = None #inode of the file that was parsed
+        self.key = None #(inode, size, mtime) at the last read
+        self.result = ([], 0)
+
+    def read(self):
+        """Returns the status log (newest entry first, each entry a (message, timestamp, completion) tuple) and the total completion"""
+        with self.lock:
+            try:
+                st = os.stat(self.statusfile)
+            except FileNotFoundError:
+                self.reset()
+                return [], 0
+            key = (st.st_ino, st.st_size, st.st_mtime_ns)
+            if key == self.key:
+                return self.result
+            if self.inode != st.st_ino or st.st_size < self.offset:
+                self.reset()
+                self.inode = st.st_ino
+            with open(self.statusfile, 'rb') as f:
+                if self.offset:
+                    if f.read(len(self.head)) != self.head:
+                        #file was replaced by another one, start over
+                        self.reset()
+                        self.inode = st.st_ino
+                    else:
+                        f.seek(self.offset)
+                data = f.read()
+            if not self.offset:
+                self.head = data[:64]
+            end = data.rfind(b"\n") + 1 #an incomplete last line is left for the next read
+            if end:
+                for line in data[:end].decode('utf-8', errors='replace').split("\n"):
+                    line = line.strip()
+                    if line:
+                        message, timestamp, completion = parseline(line)
+                        if completion > 0:
+                            self.totalcompletion = completion
+                        if message and (message != self.prevmsg):
+                            self.log.append( (message.strip(), timestamp, completion) )
+                            self.prevmsg = message
+                self.offset += end
+            self.key = key #an incomplete last line is parsed once it is completed (the file then changes)
+            self.result = (list(reversed(self.log)), self.totalcompletion)
+            return self.result
+
+
+READERS = collections.OrderedDict()
+READERSLOCK = threading.Lock()
+
+def reader(statusfile, maxlength=MAXLOGLENGTH):
+    """Returns a (cached) StatusReader for the specified status file, the least recently used readers are discarded"""
+    with READERSLOCK:
+        if statusfile in READERS and READERS[statusfile].maxlength == maxlength:
+            READERS.move_to_end(statusfile)
+        else:
+            READERS[statusfile] = StatusReader(statusfile, maxlength)
+            READERS.move_to_end(statusfile)
+            while len(READERS) > MAXREADERS:
+                READERS.popitem(last=False)
+        return READERS[statusfile]
+
+def readlog(statusfile, maxlength=MAXLOGLENGTH):
+    """Reads a status file incrementally, returns the status log (newest entry first) and the total completion"""
+    return reader(statusfile, maxlength).read()
@@ -0,0 +1,121 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Trash --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Deferred deletion of projects and directories. Rather than deleting a (possibly huge) directory whilst a request
+waits, it is renamed into the trash directory in ``ROOT``, which is instant, and a background purger removes it from
+there later at a limited rate, so it does not starve the disk for everybody else."""
+
+import os
+import time
+import shutil
+import random
+
+TRASHDIR = "trash"
+LOCKFILE = "trash.lock" #in ROOT, held by whoever is purging
+
+def move(root, path):
+    """Move the file or directory into the trash, returns the path in the trash. Falls back to deleting it right away
+    if it can not be renamed (when it is on another filesystem than ``ROOT``), None is returned then."""
+    trashdir = os.path.join(root, TRASHDIR)
+    os.makedirs(trashdir, exist_ok=True)
+    #unique name that also sorts by the time it was trashed
+    target = os.path.join(trashdir, "%.6f-%08x-%s" % (time.time(), random.getrandbits(32), os.path.basename(path.rstrip('/'))))
+    try:
+        os.rename(path, target)
+    except FileNotFoundError:
+        raise #nothing to delete
+    except OSError:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.unlink(path)
+        return None
+    return target
+
+def entries(root):
+    """Returns the paths of everything in the trash, oldest first"""
+    try:
+        return sorted(entry.path for entry in os.scandir(os.path.join(root, TRASHDIR)))
+    except FileNotFoundError:
+        return []
+
+def remove(path, throttle=None):
+    """Remove the file or directory, walking the tree with os.scandir. The throttle function, if any, is called after
+    every removal. Entries that can not be removed are skipped. Returns the number of entries removed."""
+    if not os.path.isdir(path) or os.path.islink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return 0
+        if throttle is not None:
+            throttle()
+        return 1
+    removed = 0
+    failed = set()
+    stack = [path]
+    while stack:
+        #depth-first, a directory is revisited (and removed) once all its subdirectories are gone
+        current = stack[-1]
+        subdirs = []
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in failed:
+                            subdirs.append(entry.path)
+                        continue
+                    try:
+                        os.unlink(entry.path)
+                        removed += 1
+                    except FileNotFoundError:
+                        continue
+                    except OSError:
+                        continue #left for the final rmdir to fail on
+                    if throttle is not None:
+                        throttle()
+        except FileNotFoundError:
+            stack.pop()
+            continue
+        except OSError:
+            failed.add(stack.pop())
+            continue
+        if subdirs:
+            stack.extend(subdirs)
+            continue
+        stack.pop()
+        try:
+            os.rmdir(current)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError:
+            failed.add(current)
+        if throttle is not None:
+            throttle()
+    return removed
+
+def purge(root, rate=0):
+    """Empty the trash, removing at most ``rate`` entries (files or directories) per second (0 = unlimited). Returns the number of entries removed."""
+    begintime = time.time()
+    removed = 0
+
+    def throttle():
+        nonlocal removed
+        removed += 1
+        if rate > 0:
+            ahead = removed / rate - (time.time() - begintime)
+            if ahead > 0.01: #sleep in slices rather than after every single entry
+                time.sleep(ahead)
+
+    for path in entries(root):
+        remove(path, throttle)
+    return removed
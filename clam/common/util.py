@@ -179,3 +179,76 @@ def parse_accept_header(request) -> list[str]:
             ordered.sort(key=lambda x: -1 * x[1])
             return [ x[0] for x in ordered ]
     return []
+
+
+DISALLOWINSHELLSAFE = ('|','&',';','!','<','>','{','}','`','\n','\r','\t')
+
+def escape(s, quote):
+    s2 = ""
+    for i, c in enumerate(s):
+        if c == quote:
+            escapes = 0
+            j = i - 1
+            while j > 0:
+                if s[j] == "\\":
+                    escapes += 1
+                else:
+                    break
+                j -= 1
+            if escapes % 2 == 0: #even number of escapes, we need another one
+                s2 += "\\"
+        s2 += c
+    return s2
+
+def shellsafe(s, quote='', doescape=True):
+    """Returns the value string, wrapped in the specified quotes (if not empty), but checks and raises an Exception if the string is at risk of causing code injection"""
+    if len(s) > 1024:
+        raise ValueError("Variable value rejected for security reasons: too long")
+    if quote:
+        if quote in s:
+            if doescape:
+                s = escape(s,quote)
+            else:
+                raise ValueError("Variable value rejected for security reasons: " + s)
+        return quote + s + quote
+    else:
+        for c in s:
+            if c in DISALLOWINSHELLSAFE:
+                raise ValueError("Variable value rejected for security reasons: " + s)
+        return s
+
+def escapeshelloperators(s):
+    inquote = False
+    indblquote = False
+    o = ""
+    for c in s:
+        if c == "'" and not indblquote:
+            inquote = not inquote
+            o += c
+        elif c == '"' and not inquote:
+            indblquote = not indblquote
+            o += c
+        elif not inquote and not indblquote:
+            if c == '|':
+                o += '%PIPE%'
+            elif c == '>':
+                o +=  '%OUT%'
+            elif c == '<':
+                o += '%IN%'
+            elif c == '&':
+                o += '%AMP%'
+            elif c == '!':
+                o += '%EXCL%'
+            else:
+                o += c
+        else:
+            o += c
+    return o
+
+def unescapeshelloperators(s):
+    s = s.replace('%PIPE%','|')
+    s = s.replace('%OUT%','>')
+    s = s.replace('%AMP%','&')
+    s = s.replace('%EXCL%','!')
+    s = s.replace('%IN%','<')
+    return s
@@ -17,18 +17,11 @@ import csv
 import sys
 import os.path
 import random
-import requests
 from lxml import etree
 from io import StringIO,  BytesIO
 
-try:
-    import foliatools
-except ImportError:
-    foliatools = None
-try:
-    import flask
-except ImportError:
-    pass
+#flask, requests and foliatools are imported on demand in the views, so the viewer definitions can be loaded (by the data
+#module and the service configuration) without pulling them in
 
 from clam.common.util import withheaders
 
@@ -80,6 +73,8 @@ class ForwardViewer(AbstractViewer):
         super(ForwardViewer,self).__init__(**kwargs)
 
     def view(self, file, **kwargs):
+        import flask
+        import requests
         #these are additional variables that will be replaced if present in the url, in addition to $BACKLINK
         replacevars = {
             'MIMETYPE': self.mimetype,
@@ -134,6 +129,7 @@ class SimpleTableViewer(AbstractViewer):
             yield line
 
     def view(self,file,**kwargs):
+        import flask
         return flask.render_template('crudetableviewer.html',file=file,tableviewer=self, wordwrap=self.wordwrap, customcss=self.customcss)
 
 
@@ -170,7 +166,9 @@ class FoLiAViewer(AbstractViewer):
     name = "FoLiA Viewer"
 
     def view(self, file, **kwargs):
-        if foliatools is None:
+        try:
+            import foliatools
+        except ImportError:
             raise Exception("FoliA-Tools are not installed,  these are required for FoLiA visualisation! pip install FoLiA-tools")
         xslfile = foliatools.__path__[0] + "/folia2html.xsl"
         xslt_doc = etree.parse(xslfile)
@@ -228,6 +226,8 @@ class FLATViewer(AbstractViewer):
         super(FLATViewer,self).__init__(**kwargs)
 
     def view(self, file, **kwargs):
+        import flask
+        import requests
         #filename will contain a random component to prevent clashes
         if hasattr(file, "filename"):
             filename = os.path.basename(file.filename).replace('.folia.xml','').replace('.xml','') +  str("%034x" % random.getrandbits(128)) + '.folia.xml'
@@ -259,6 +259,7 @@ class ShareViewer(AbstractViewer):
         super(ShareViewer,self).__init__(**kwargs)
 
     def view(self, file, **kwargs):
+        import flask
         fileid = file.store(keep=self.persistent)
         return flask.render_template('share.html',fileid=fileid, filename=file.filename, persistent=self.persistent, baseurl=kwargs['baseurl'])
 
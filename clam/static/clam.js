@@ -137,7 +137,7 @@ function renderfileparameters(id, target, enableconverters, parametersxmloverrid
                 $(target).prepend(s);
             }
             if (inputtemplate.acceptarchive) {
-                $(target).prepend("For easy mass upload, this input template also accepts <strong>archives</strong> (<tt>zip, tar.gz, tar.bz2</tt>) containing multiple files of exactly this specific type.<br />");
+                $(target).prepend("For easy mass upload, this input template also accepts <strong>archives</strong> (<tt>zip, tar, tar.gz, tar.bz2, tar.xz, tar.zst</tt>) containing multiple files of exactly this specific type.<br />");
             }
         } else {
             $(target).html("<strong>Error: Selected input template is invalid!</strong>");
@@ -201,7 +201,7 @@ function pollstatus() {
         dataType: 'json',
         data: {accesstoken: accesstoken, user: user},
         success: function(response){
-                if (response.statuscode !== 1) {
+                if (response.statuscode !== 1 && response.statuscode !== 3) { /* neither running nor queued */
                     window.location.href = baseurl + '/' + project + '/'; /* refresh */
                 } else {
                     if (response.completion > 0) {
@@ -224,6 +224,47 @@ function pollstatus() {
     });
 }
 
+function watchstatus() {
+    /* Receive status updates as Server-Sent Events if supported, poll otherwise */
+    if (typeof(EventSource) === "undefined") {
+        setTimeout(pollstatus,2000);
+        return;
+    }
+    var source = new EventSource(baseurl + '/' + project + "/events/?accesstoken=" + encodeURIComponent(accesstoken) + "&user=" + encodeURIComponent(user), { withCredentials: true });
+    source.addEventListener('status', function(e) {
+        var data = JSON.parse(e.data);
+        $('#statusmessage').text(data.statusmsg); /* e.g. position in the queue, or the project was started */
+        if (data.completion > 0) {
+            progress = data.completion;
+            $('#progress .progress-bar').css("style", "width: " + progress + "%" );
+        }
+    });
+    var firstlog = true;
+    source.addEventListener('log', function(e) {
+        var entries = JSON.parse(e.data);
+        if (firstlog) {
+            /* the first event carries the entire log */
+            $('#statuslogtable').empty();
+            firstlog = false;
+        }
+        for (var i = 0; i < entries.length; i++) {
+            var row = $('<tr><td class="time"></td><td class="message"></td></tr>');
+            row.find('.time').text(entries[i][1]);
+            row.find('.message').text(entries[i][0]);
+            $('#statuslogtable').prepend(row);
+        }
+    });
+    source.addEventListener('done', function(e) { //eslint-disable-line no-unused-vars
+        source.close();
+        window.location.href = baseurl + '/' + project + '/'; /* refresh */
+    });
+    source.onerror = function() {
+        if (source.readyState === EventSource.CLOSED) {
+            /* stream not available, fall back to polling */
+            setTimeout(pollstatus,2000);
+        }
+    };
+}
 
 function processuploadresponse(response, paramdiv) {
       //Processes CLAM Upload XML
@@ -486,7 +527,7 @@ function initclam() { //eslint-disable-line no-unused-vars, complexity
        });
       if (stage === 1) {
             $('#progress .progress-bar').css( "style", "width: " + progress + "%" );
-            setTimeout(pollstatus,2000);
+            watchstatus();
        }
     }
 
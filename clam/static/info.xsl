@@ -117,11 +117,12 @@
 			</li>
 			<li><strong>Poll the project status with a regular interval and check its status until it is flagged as finished</strong> - Issue (with a regular interval) a <tt>HTTP GET</tt> on <tt><xsl:value-of select="@baseurl"/>/<em>{yourprojectname}</em>/</tt> .
 			<ul>
-			<li>Will respond with <tt>HTTP 200 OK</tt> if successful, and returns the CLAM XML for the project's current state. The state of the project is stored in the CLAM XML response, in <tt>/CLAM/status/@code/</tt> (XPath), this code takes on one of three values:
+			<li>Will respond with <tt>HTTP 200 OK</tt> if successful, and returns the CLAM XML for the project's current state. The state of the project is stored in the CLAM XML response, in <tt>/CLAM/status/@code/</tt> (XPath), this code takes on one of the following values:
 			<ul>
 				<li>0 - The project is in an accepting state, accepting file uploads and waiting to be started</li>
 				<li>1 - The project is in execution</li>
 				<li>2 - The project has finished</li>
+				<li>3 - The project is queued, waiting for resources to become available (only if the service has a job queue)</li>
 			</ul>
 			</li>
 			<li>Will respond with <tt>HTTP 401 Unauthorized</tt> if incorrect or no user credentials  or authorization token were passed. They have to be passed using <xsl:call-template name="authtype" /></li>
@@ -102,7 +102,7 @@
 <xsl:template name="head">
   <head>
     <meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
-    <xsl:if test="status/@code = 1 and (contains(/clam/@interfaceoptions,'secureonly') or contains(/clam/@interfaceoptions,'simplepolling'))" >
+    <xsl:if test="(status/@code = 1 or status/@code = 3) and (contains(/clam/@interfaceoptions,'secureonly') or contains(/clam/@interfaceoptions,'simplepolling'))" >
       <meta http-equiv="refresh" content="2" />
     </xsl:if>
     <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no" />
@@ -136,7 +136,7 @@
     <script type="text/javascript" src="{/clam/@baseurl}/static/clam.js" />
 
     <script type="text/javascript">
-        <xsl:if test="status/@code = 1">
+        <xsl:if test="status/@code = 1 or status/@code = 3">
                 stage = 1;
                 progress = 0;
         </xsl:if>
@@ -257,7 +257,7 @@
         <div id="statusmessage" class="alert alert-success"><xsl:value-of select="@message"/></div>
 
       </xsl:when>
-      <xsl:when test="@code = 1">
+      <xsl:when test="@code = 1 or @code = 3">
         <div id="actions">
         	<input id="abortbutton" class="btn btn-danger" type="button" value="Abort execution" />
         </div>
@@ -709,7 +709,7 @@
                         <li class="nav-item disabled"><a class="nav-link disabled" href="#" tabindex="-1" aria-disabled="true">3.&#160;<span class="oi oi-timer"></span>&#160;Runtime</a></li>
                         <li class="nav-item disabled"><a class="nav-link disabled" href="#" tabindex="-1" aria-disabled="true">4.&#160;<span class="oi oi-cloud-download"></span>&#160;Results</a></li>
                     </xsl:when>
-                    <xsl:when test="@project and status/@code = 1">
+                    <xsl:when test="@project and (status/@code = 1 or status/@code = 3)">
                         <li class="nav-item disabled"><a class="nav-link disabled" href="#" tabindex="-1" aria-disabled="true">2.&#160;<span class="oi oi-cloud-upload"></span>&#160;Staging</a></li>
                         <li class="nav-item active"><a class="nav-link" href="#" tabindex="-1" aria-disabled="false">3.&#160;<span class="oi oi-timer"></span>&#160;Runtime</a></li>
                         <li class="nav-item disabled"><a class="nav-link disabled" href="#" tabindex="-1" aria-disabled="true">4.&#160;<span class="oi oi-cloud-download"></span>&#160;Results</a></li>
@@ -865,6 +865,11 @@
                                        <span class="done">done</span>
                                    </xsl:when>
                                </xsl:choose>
+                               <xsl:choose>
+                                   <xsl:when test="@status = 3">
+                                       <span class="queued">queued</span>
+                                   </xsl:when>
+                               </xsl:choose>
                             </td>
                            <td><xsl:value-of select="@size" /> MB</td>
                            <td><xsl:value-of select="@time" /></td>
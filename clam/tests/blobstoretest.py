@@ -0,0 +1,111 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Content-addressed store tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import io
+import shutil
+import hashlib
+import tempfile
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.blobstore
+
+class BlobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.data = b"The same reference corpus, over and over again.\n" * 1000
+        for project in ('p1', 'p2'):
+            os.makedirs(os.path.join(self.root, 'projects', project, 'input'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def inputfile(self, project, filename='corpus.txt'):
+        return os.path.join(self.root, 'projects', project, 'input', filename)
+
+    def test1_receive(self):
+        """Blob store - The digest is computed while receiving a stream"""
+        digest = clam.common.blobstore.receive(io.BytesIO(self.data), self.inputfile('p1'))
+        self.assertEqual(digest, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(clam.common.blobstore.digest(self.inputfile('p1')), digest)
+        with open(self.inputfile('p1'),'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertTrue(clam.common.blobstore.valid(digest))
+        self.assertFalse(clam.common.blobstore.valid(digest.upper()))
+        self.assertFalse(clam.common.blobstore.valid("../../etc/passwd"))
+
+    def test2_place(self):
+        """Blob store - Identical files in different projects share a single copy"""
+        digest = clam.common.blobstore.receive(io.BytesIO(self.data), self.inputfile('p1'))
+        self.assertFalse(clam.common.blobstore.has(self.root, digest))
+        self.assertEqual(clam.common.blobstore.place(self.root, self.inputfile('p1'), digest), digest)
+        self.assertTrue(clam.common.blobstore.has(self.root, digest))
+        clam.common.blobstore.receive(io.BytesIO(self.data), self.inputfile('p2'))
+        self.assertEqual(clam.common.blobstore.place(self.root, self.inputfile('p2')), digest)
+        self.assertTrue(os.path.samefile(self.inputfile('p1'), self.inputfile('p2')))
+        self.assertEqual(os.stat(clam.common.blobstore.path(self.root, digest)).st_nlink, 3)
+        #placing it again changes nothing
+        self.assertEqual(clam.common.blobstore.place(self.root, self.inputfile('p2'), digest), digest)
+        self.assertEqual(os.stat(clam.common.blobstore.path(self.root, digest)).st_nlink, 3)
+        with open(self.inputfile('p2'),'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test3_fetch(self):
+        """Blob store - Files are placed in projects from the store by link, or by copy if they are to be modified"""
+        clam.common.blobstore.receive(io.BytesIO(self.data), self.inputfile('p1'))
+        digest = clam.common.blobstore.place(self.root, self.inputfile('p1'))
+        self.assertTrue(clam.common.blobstore.fetch(self.root, digest, self.inputfile('p2')))
+        self.assertTrue(os.path.samefile(self.inputfile('p1'), self.inputfile('p2')))
+        self.assertTrue(clam.common.blobstore.fetch(self.root, digest, self.inputfile('p2', 'copy.txt'), copy=True))
+        self.assertFalse(os.path.samefile(self.inputfile('p1'), self.inputfile('p2', 'copy.txt')))
+        with open(self.inputfile('p2', 'copy.txt'),'ab') as f:
+            f.write(b"modified")
+        self.assertEqual(clam.common.blobstore.digest(self.inputfile('p1')), digest)
+        self.assertFalse(clam.common.blobstore.fetch(self.root, "0" * 64, self.inputfile('p2', 'missing.txt')))
+        self.assertFalse(os.path.exists(self.inputfile('p2', 'missing.txt')))
+
+    def test4_collect(self):
+        """Blob store - Files are removed from the store once no project links to them"""
+        clam.common.blobstore.receive(io.BytesIO(self.data), self.inputfile('p1'))
+        digest = clam.common.blobstore.place(self.root, self.inputfile('p1'))
+        clam.common.blobstore.fetch(self.root, digest, self.inputfile('p2'))
+        other = clam.common.blobstore.receive(io.BytesIO(b"something else"), self.inputfile('p2', 'other.txt'))
+        clam.common.blobstore.place(self.root, self.inputfile('p2', 'other.txt'), other)
+        shutil.rmtree(os.path.join(self.root, 'projects', 'p1'))
+        self.assertEqual(clam.common.blobstore.collect(self.root), 0)
+        os.unlink(self.inputfile('p2', 'other.txt'))
+        self.assertEqual(clam.common.blobstore.collect(self.root), 1)
+        self.assertTrue(clam.common.blobstore.has(self.root, digest))
+        self.assertFalse(clam.common.blobstore.has(self.root, other))
+        shutil.rmtree(os.path.join(self.root, 'projects', 'p2'))
+        self.assertEqual(clam.common.blobstore.collect(self.root), 1)
+        self.assertFalse(clam.common.blobstore.has(self.root, digest))
+
+    def test5_users(self):
+        """Blob store - A user only finds the files in the store that they added themselves"""
+        clam.common.blobstore.receive(io.BytesIO(self.data), self.inputfile('p1'))
+        digest = clam.common.blobstore.place(self.root, self.inputfile('p1'))
+        clam.common.blobstore.record(self.root, 'alice', digest)
+        self.assertTrue(clam.common.blobstore.has(self.root, digest, 'alice'))
+        self.assertFalse(clam.common.blobstore.has(self.root, digest, 'bob'))
+        self.assertTrue(clam.common.blobstore.has(self.root, digest))
+        shutil.rmtree(os.path.join(self.root, 'projects', 'p1'))
+        self.assertEqual(clam.common.blobstore.collect(self.root), 1)
+        self.assertFalse(os.path.exists(clam.common.blobstore.userpath(self.root, 'alice', digest))) #the record goes with the file
+
+if __name__ == '__main__':
+    unittest.main()
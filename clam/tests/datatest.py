@@ -15,7 +15,12 @@
 import unittest
 import sys
 import os
+import io
 import json
+import shutil
+import tarfile
+import zipfile
+import tempfile
 
 #We may need to do some path magic in order to find the clam.* imports
 sys.path.append(sys.path[0] + '/../../')
@@ -222,6 +227,85 @@ class ParametersInFilename(unittest.TestCase):
         self.assertEqual(filename,'test.utf-8.fr.txt')
 
 
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.targetdir = tempfile.mkdtemp()
+        self.files = [('a.txt', b'alpha'), ('sub/b.txt', b'beta' * 100), ('.hidden', b'x'), ('c d\'e.txt', b'gamma')]
+
+    def tearDown(self):
+        shutil.rmtree(self.targetdir)
+
+    def tar(self, mode):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode=mode) as archive:
+            for name, data in self.files:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+            info = tarfile.TarInfo('link.txt')
+            info.type = tarfile.SYMTYPE
+            info.linkname = '/etc/passwd'
+            archive.addfile(info)
+        buffer.seek(0)
+        return buffer
+
+    def zip(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('sub/', b'')
+            for name, data in self.files:
+                archive.writestr(name, data)
+        buffer.seek(0)
+        return buffer
+
+    def targetpath(self, name):
+        return os.path.join(self.targetdir, 'in-' + name)
+
+    def test1_format(self):
+        """Archive - Determine the format by extension"""
+        self.assertEqual(clam.common.data.archiveformat('test.TAR.GZ'), 'tar.gz')
+        self.assertEqual(clam.common.data.archiveformat('test.tgz'), 'tar.gz')
+        self.assertEqual(clam.common.data.archiveformat('test.tar.xz'), 'tar.xz')
+        self.assertEqual(clam.common.data.archiveformat('test.tar.zst'), 'tar.zst')
+        self.assertEqual(clam.common.data.archiveformat('test.zip'), 'zip')
+        self.assertIsNone(clam.common.data.archiveformat('test.txt'))
+
+    def test2_extract(self):
+        """Archive - Extract zip and tar archives, skipping hidden files, directories and links"""
+        for fmt, fileobj in (('zip', self.zip()), ('tar', self.tar('w')), ('tar.gz', self.tar('w:gz')), ('tar.bz2', self.tar('w:bz2')), ('tar.xz', self.tar('w:xz'))):
+            extracted = clam.common.data.extractarchive(fileobj, fmt, self.targetpath)
+            self.assertEqual([ name for name, _ in extracted ], ['a.txt', 'b.txt', "c d'e.txt"], fmt)
+            with open(self.targetpath('b.txt'), 'rb') as f:
+                self.assertEqual(f.read(), b'beta' * 100)
+            self.assertEqual(sorted(os.listdir(self.targetdir)), ['in-a.txt', 'in-b.txt', "in-c d'e.txt"])
+            for _, path in extracted:
+                os.unlink(path)
+
+    def test3_limits(self):
+        """Archive - Archives exceeding the limits are refused as a whole"""
+        with self.assertRaises(clam.common.data.UploadError):
+            clam.common.data.extractarchive(self.tar('w:gz'), 'tar.gz', self.targetpath, maxsize=100)
+        with self.assertRaises(clam.common.data.UploadError):
+            clam.common.data.extractarchive(self.zip(), 'zip', self.targetpath, maxfiles=2)
+        with self.assertRaises(clam.common.data.UploadError):
+            clam.common.data.extractarchive(io.BytesIO(b'not an archive'), 'tar.gz', self.targetpath)
+        self.assertEqual(os.listdir(self.targetdir), [])
+
+    def test4_existing(self):
+        """Archive - Existing files are only replaced once the whole archive is accepted"""
+        with open(self.targetpath('a.txt'), 'wb') as f:
+            f.write(b'old')
+        with self.assertRaises(clam.common.data.UploadError) as cm:
+            clam.common.data.extractarchive(self.tar('w'), 'tar', self.targetpath, maxsize=200)
+        self.assertIn("200 bytes", cm.exception.msg)
+        self.assertEqual(os.listdir(self.targetdir), ['in-a.txt'])
+        with open(self.targetpath('a.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        clam.common.data.extractarchive(self.tar('w'), 'tar', self.targetpath)
+        with open(self.targetpath('a.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'alpha')
+
+
 class ExternalConfigTest(unittest.TestCase):
 
     def test1_substenvvars(self):
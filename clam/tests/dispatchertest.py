@@ -0,0 +1,113 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Dispatcher tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import time
+import signal
+import threading
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.clamdispatcher
+import clam.common.journal
+
+def spawn(code):
+    """Start a Python child process running the specified code, returns its pid"""
+    return os.spawnv(os.P_NOWAIT, sys.executable, [sys.executable, '-c', code])
+
+def waitfor(watcher, timeout=10):
+    """Wait for the child of the watcher to exit, returns its (pid, status, rusage)"""
+    end = time.time() + timeout
+    while time.time() < end:
+        result = watcher.wait(end - time.time())
+        if result[0] != 0:
+            return result
+    raise AssertionError("Child did not exit in time")
+
+class ChildWatcherTest(unittest.TestCase):
+    def test1_exitstatus(self):
+        """Dispatcher - Child watcher reports the exit status of the child"""
+        pid = spawn("import sys; sys.exit(3)")
+        watcher = clam.clamdispatcher.ChildWatcher(pid)
+        try:
+            returnedpid, status, rusage = waitfor(watcher)
+        finally:
+            watcher.close()
+        self.assertEqual(returnedpid, pid)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 3)
+        self.assertTrue(rusage is not None)
+
+    def test2_sigchld(self):
+        """Dispatcher - Child watcher reports the exit status of the child without pidfd (SIGCHLD)"""
+        pidfd_open = getattr(os, 'pidfd_open', None)
+        def unavailable(pid):
+            raise OSError("pidfd not available")
+        os.pidfd_open = unavailable
+        try:
+            pid = spawn("import time, sys; time.sleep(0.2); sys.exit(5)")
+            watcher = clam.clamdispatcher.ChildWatcher(pid)
+        finally:
+            if pidfd_open is None:
+                del os.pidfd_open
+            else:
+                os.pidfd_open = pidfd_open
+        try:
+            self.assertEqual(watcher.pidfd, None)
+            begin = time.time()
+            returnedpid, status, _ = waitfor(watcher)
+        finally:
+            watcher.close()
+        self.assertEqual(returnedpid, pid)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 5)
+        self.assertLess(time.time() - begin, 5) #woken by the signal, not by the timeout
+
+    def test3_abortsignal(self):
+        """Dispatcher - Child watcher is woken by an abort signal"""
+        pid = spawn("import time; time.sleep(30)")
+        watcher = clam.clamdispatcher.ChildWatcher(pid, (clam.common.journal.ABORTSIGNAL,))
+        try:
+            timer = threading.Timer(0.2, os.kill, (os.getpid(), clam.common.journal.ABORTSIGNAL))
+            timer.start()
+            begin = time.time()
+            returnedpid, _, _ = watcher.wait(20)
+            self.assertLess(time.time() - begin, 10)
+            self.assertEqual(returnedpid, 0) #child still running
+            self.assertEqual(watcher.signalled, {clam.common.journal.ABORTSIGNAL})
+        finally:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            watcher.close()
+
+    def test4_graceperiod(self):
+        """Dispatcher - A second abort signal does not cut the grace period of a terminating process short"""
+        pid = spawn("import signal, time, sys\ndef term(signum, frame):\n    time.sleep(1)\n    sys.exit(4)\nsignal.signal(signal.SIGTERM, term)\ntime.sleep(30)")
+        watcher = clam.clamdispatcher.ChildWatcher(pid, (clam.common.journal.ABORTSIGNAL,))
+        try:
+            time.sleep(1) #give the child time to install its handler
+            timer = threading.Timer(0.3, os.kill, (os.getpid(), clam.common.journal.ABORTSIGNAL))
+            timer.start()
+            begin = time.time()
+            rusage = clam.clamdispatcher.terminate(pid, watcher, 20)
+            timer.join()
+        finally:
+            watcher.close()
+        self.assertTrue(rusage is not None)
+        self.assertGreaterEqual(time.time() - begin, 0.9) #the child got to finish its handler
+        self.assertLess(time.time() - begin, 10)
+        self.assertEqual(watcher.signalled, {clam.common.journal.ABORTSIGNAL})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- URL fetcher tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import shutil
+import hashlib
+import tempfile
+import time
+import threading
+import http.server
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.fetcher
+
+RESOURCES = {}
+TRANSFERS = []
+SLOW = set() #resources that are sent slowly, in chunks
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves the RESOURCES with an ETag, answering 304 if the client has the current version"""
+    def do_GET(self):
+        if self.path not in RESOURCES:
+            self.send_error(404)
+            return
+        data = RESOURCES[self.path]
+        etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        TRANSFERS.append(self.path)
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.path in SLOW:
+            for i in range(0, len(data), 65536):
+                self.wfile.write(data[i:i+65536])
+                self.wfile.flush()
+                time.sleep(0.1)
+        else:
+            self.wfile.write(data)
+
+    def log_message(self, *args): #pylint: disable=arguments-differ
+        pass
+
+class FetcherTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.url = 'http://127.0.0.1:' + str(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fetcher = clam.common.fetcher.Fetcher(os.path.join(self.directory, 'cache'), timeout=10)
+        RESOURCES.clear()
+        del TRANSFERS[:]
+        for i in range(4):
+            RESOURCES['/r' + str(i)] = ("resource " + str(i) + "\n").encode('utf-8') * 1000
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def target(self, name):
+        return os.path.join(self.directory, name)
+
+    def test1_revalidate(self):
+        """URL fetcher - A cached file is only transferred again if it changed"""
+        self.assertFalse(self.fetcher.fetch(self.url + '/r0', self.target('a')))
+        self.assertTrue(self.fetcher.fetch(self.url + '/r0', self.target('b')))
+        with open(self.target('b'),'rb') as f:
+            self.assertEqual(f.read(), RESOURCES['/r0'])
+        self.assertEqual(TRANSFERS, ['/r0'])
+        RESOURCES['/r0'] = b"changed\n"
+        self.assertFalse(self.fetcher.fetch(self.url + '/r0', self.target('c')))
+        with open(self.target('c'),'rb') as f:
+            self.assertEqual(f.read(), b"changed\n")
+        self.assertEqual(TRANSFERS, ['/r0', '/r0'])
+
+    def test2_fetchall(self):
+        """URL fetcher - Several URLs are fetched concurrently, failures are reported per URL"""
+        fetches = [ (self.url + '/r' + str(i), self.target('f' + str(i))) for i in range(4) ] + [ (self.url + '/missing', self.target('missing')) ]
+        results = self.fetcher.fetchall(fetches, workers=3)
+        self.assertEqual(results[:4], [False] * 4)
+        self.assertTrue(isinstance(results[4], clam.common.fetcher.FetchError))
+        for i in range(4):
+            with open(self.target('f' + str(i)),'rb') as f:
+                self.assertEqual(f.read(), RESOURCES['/r' + str(i)])
+        self.assertEqual(self.fetcher.fetchall(fetches[:4]), [True] * 4)
+
+    def test3_limits(self):
+        """URL fetcher - Files exceeding the maximum size are refused, the cache is kept within its maximum size"""
+        self.assertRaises(clam.common.fetcher.FetchError, self.fetcher.fetch, self.url + '/r0', self.target('a'), 100)
+        fetcher = clam.common.fetcher.Fetcher(os.path.join(self.directory, 'smallcache'), timeout=10, maxcachesize=25000)
+        for i in range(4):
+            fetcher.fetch(self.url + '/r' + str(i), self.target('f' + str(i)))
+        self.assertEqual(fetcher.lookup(self.url + '/r0'), None)
+        self.assertNotEqual(fetcher.lookup(self.url + '/r3'), None)
+        self.assertTrue(sum(os.path.getsize(os.path.join(self.directory, 'smallcache', f)) for f in os.listdir(os.path.join(self.directory, 'smallcache')) if '.' not in f) <= 25000)
+
+    def test4_cacheraces(self):
+        """URL fetcher - A cached file that was pruned or replaced after its lookup is fetched anew"""
+        self.assertFalse(self.fetcher.fetch(self.url + '/r0', self.target('a')))
+        validators = self.fetcher.lookup(self.url + '/r0')
+        os.unlink(self.fetcher.cachefile(self.url + '/r0'))
+        self.assertIsNone(self.fetcher.transfer(self.url + '/r0', self.target('b'), 0, validators)) #the server says the cached file is current
+        self.assertFalse(self.fetcher.fetch(self.url + '/r0', self.target('b')))
+        with open(self.target('b'),'rb') as f:
+            self.assertEqual(f.read(), RESOURCES['/r0'])
+        shutil.copyfile(self.target('b'), self.target('c'))
+        os.replace(self.target('c'), self.fetcher.cachefile(self.url + '/r0')) #content of another fetch, the validators do not belong to it
+        self.assertFalse(self.fetcher.fetch(self.url + '/r0', self.target('d')))
+        self.assertEqual(TRANSFERS, ['/r0'] * 3)
+
+    def test5_maxduration(self):
+        """URL fetcher - A fetch that takes too long as a whole is given up"""
+        fetcher = clam.common.fetcher.Fetcher(None, timeout=10, maxduration=0.2)
+        RESOURCES['/slow'] = b"x" * 65536 * 4
+        SLOW.add('/slow')
+        try:
+            self.assertRaises(clam.common.fetcher.FetchError, fetcher.fetch, self.url + '/slow', self.target('a'))
+        finally:
+            SLOW.clear()
+
+    def test6_budget(self):
+        """URL fetcher - The maximum size bounds all concurrent fetches together, also those answered from the cache"""
+        fetches = [ (self.url + '/r' + str(i), self.target('f' + str(i))) for i in range(4) ] #11000 bytes each
+        for workers in (1, 4, 4):
+            results = self.fetcher.fetchall(fetches, workers=workers, maxsize=25000)
+            succeeded = [ target for (_, target), result in zip(fetches, results) if not isinstance(result, clam.common.fetcher.FetchError) ]
+            self.assertLessEqual(len(succeeded), 2)
+            self.assertLessEqual(sum(os.path.getsize(target) for target in succeeded), 25000)
+            if workers == 1:
+                self.assertEqual(len(succeeded), 2)
+                self.assertEqual(results[:2], [False, False]) #the remaining fetches fail once the budget ran out
+                self.assertTrue(all(isinstance(result, clam.common.fetcher.FetchError) for result in results[2:]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Import time tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import subprocess
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+#Budgets (in seconds) for the cumulative import time of a module in a fresh interpreter. They are generous so they hold on
+#slow machines too, the exact sets of modules that may not be imported are the stricter check.
+DISPATCHER_BUDGET = 0.25
+DATA_BUDGET = 0.5
+SERVICE_BUDGET = 2.0
+
+def importtime(module):
+    """Import the module in a fresh interpreter with ``python -X importtime``, returns a dictionary mapping all modules that got imported to their cumulative import time (in seconds)"""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    modules = {}
+    for line in process.stderr.decode('utf-8').split("\n"):
+        if line.startswith('import time:') and '|' in line:
+            fields = line[len('import time:'):].split('|')
+            try:
+                modules[fields[2].strip()] = int(fields[1]) / 1000000
+            except ValueError:
+                continue #header
+    return modules
+
+class ImportTimeTest(unittest.TestCase):
+    def test1_dispatcher(self):
+        """Import time - Dispatcher does not load the data module or any heavy dependencies"""
+        modules = importtime('clam.clamdispatcher')
+        for heavy in ('clam.common.data', 'lxml', 'requests', 'flask', 'yaml'):
+            self.assertNotIn(heavy, modules)
+        self.assertLess(modules['clam.clamdispatcher'], DISPATCHER_BUDGET)
+
+    def test2_data(self):
+        """Import time - Data module loads client and service dependencies on demand"""
+        modules = importtime('clam.common.data')
+        for heavy in ('requests', 'flask', 'yaml', 'foliatools'):
+            self.assertNotIn(heavy, modules)
+        self.assertLess(modules['clam.common.data'], DATA_BUDGET)
+
+    def test3_service(self):
+        """Import time - Service loads optional dependencies on demand"""
+        modules = importtime('clam.clamservice')
+        for optional in ('requests_oauthlib', 'MySQLdb', 'foliatools'):
+            self.assertNotIn(optional, modules)
+        self.assertLess(modules['clam.clamservice'], SERVICE_BUDGET)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Job queue tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.jobqueue
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.queue = clam.common.jobqueue.JobQueue(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test1_push(self):
+        """Job queue - Projects are queued in order"""
+        self.assertEqual(self.queue.push('proycon', 'p1', 'cmd1'), 1)
+        self.assertEqual(self.queue.push('someoneelse', 'p1', 'cmd2'), 2)
+        self.assertEqual(self.queue.push('proycon', 'p2', 'cmd3'), 3)
+        self.assertEqual(self.queue.push('proycon', 'p1', 'cmd4'), 1) #already queued, keeps its position
+        self.assertEqual(len(self.queue), 3)
+        self.assertEqual([ (user, project) for user, project, _, _ in self.queue.jobs() ], [('proycon','p1'), ('someoneelse','p1'), ('proycon','p2')])
+
+    def test2_take(self):
+        """Job queue - Projects can be taken from the queue only once"""
+        self.queue.push('proycon', 'p1', 'cmd1')
+        self.queue.push('proycon', 'p2', 'cmd2')
+        other = clam.common.jobqueue.JobQueue(self.root)
+        self.assertEqual(other.take('proycon', 'p1'), 'cmd1')
+        self.assertIsNone(self.queue.take('proycon', 'p1'))
+        self.assertEqual(self.queue.position('proycon', 'p2'), 1)
+
+    def test3_remove(self):
+        """Job queue - Remove a project from the queue"""
+        self.queue.push('proycon', 'p1', 'cmd1')
+        self.queue.push('proycon', 'p2', 'cmd2')
+        self.assertTrue(self.queue.remove('proycon', 'p1'))
+        self.assertFalse(self.queue.remove('proycon', 'p1'))
+        self.assertIsNone(self.queue.position('proycon', 'p1'))
+        self.assertEqual(self.queue.position('proycon', 'p2'), 1)
+
+    def test4_persistent(self):
+        """Job queue - The queue persists"""
+        self.queue.push('proycon', 'p1', 'cmd1')
+        self.queue = clam.common.jobqueue.JobQueue(self.root)
+        self.assertEqual(self.queue.position('proycon', 'p1'), 1)
+
+    def test5_running(self):
+        """Job queue - Register running projects with their weight"""
+        self.queue.addrunning('proycon', 'p1', 100)
+        self.queue.addrunning('proycon', 'p2', 101, 2)
+        self.assertEqual(sorted(self.queue.running()), [('proycon','p1',100,1), ('proycon','p2',101,2)])
+        self.queue.removerunning('proycon', 'p1')
+        self.assertEqual(self.queue.running(), [('proycon','p2',101,2)])
+
+    def test6_shares(self):
+        """Job queue - Fair-share state per user"""
+        self.queue.setshare('proycon', 1.5, 1000.0)
+        self.queue.setshare('proycon', 0.5)
+        self.queue.setshare('someoneelse', served=2000.0)
+        self.assertEqual(self.queue.shares(), {'proycon': (0.5, 1000.0), 'someoneelse': (0.0, 2000.0)})
+
+    def test7_claim(self):
+        """Job queue - Workers claim projects fairly and only once"""
+        self.queue.push('proycon', 'p1', 'cmd1')
+        self.queue.push('proycon', 'p2', 'cmd2')
+        self.queue.push('someoneelse', 'p1', 'cmd3', 2)
+        other = clam.common.jobqueue.JobQueue(self.root)
+        self.assertEqual(self.queue.claim('w1'), ('proycon', 'p1', 'cmd1', 1))
+        self.assertEqual(other.claim('w2', maxweight=1), ('proycon', 'p2', 'cmd2', 1)) #the project of someoneelse does not fit
+        self.assertIsNone(other.claim('w2', maxweight=1))
+        self.assertEqual(self.queue.claim('w1'), ('someoneelse', 'p1', 'cmd3', 2))
+        self.assertIsNone(self.queue.claim('w1'))
+        self.assertEqual(sorted((user, project) for user, project, _, _ in self.queue.claimed('w1')), [('proycon','p1'), ('someoneelse','p1')])
+
+    def test8_claim_fair(self):
+        """Job queue - Workers serve the user that was served least recently first, within the per-user limit"""
+        self.queue.push('proycon', 'p1', 'cmd1')
+        self.queue.push('proycon', 'p2', 'cmd2')
+        self.queue.push('someoneelse', 'p1', 'cmd3')
+        self.assertEqual(self.queue.claim('w1')[:2], ('proycon', 'p1'))
+        self.assertEqual(self.queue.claim('w1')[:2], ('someoneelse', 'p1'))
+        self.queue.push('someoneelse', 'p2', 'cmd4')
+        self.assertEqual(self.queue.claim('w1', maxperuser=1), None) #both users already run a project
+        self.assertEqual(self.queue.claim('w1', maxperuser=2)[:2], ('proycon', 'p2'))
+
+    def test9_claim_maxtotal(self):
+        """Job queue - Workers together do not take more than the total number of slots"""
+        self.queue.push('proycon', 'p1', 'cmd1', 2)
+        self.queue.push('proycon', 'p2', 'cmd2')
+        self.queue.push('someoneelse', 'p1', 'cmd3', 8)
+        self.assertEqual(self.queue.claim('w1', maxtotal=3)[:2], ('proycon', 'p1'))
+        self.assertEqual(self.queue.claim('w2', maxtotal=3)[:2], ('proycon', 'p2'))
+        self.assertIsNone(self.queue.claim('w3', maxtotal=3)) #all slots in use
+        self.queue.removerunning('proycon', 'p1')
+        self.queue.removerunning('proycon', 'p2')
+        self.assertEqual(self.queue.claim('w3', maxtotal=3)[:2], ('someoneelse', 'p1')) #takes all slots, not more
+
+    def test10_workers(self):
+        """Job queue - Worker heartbeats"""
+        self.queue.heartbeat('w1', 'host1', 100, 4, 1)
+        self.queue.heartbeat('w2', 'host2', 200, 2, 0)
+        self.assertEqual([ worker[:5] for worker in self.queue.workers() ], [('w1','host1',100,4,1), ('w2','host2',200,2,0)])
+        self.assertIsNotNone(self.queue.worker('w1'))
+        self.queue.removeworker('w1')
+        self.assertIsNone(self.queue.worker('w1'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Project journal tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.journal
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.projectpath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.projectpath)
+
+    def test1_nojournal(self):
+        """Journal - Projects without journal"""
+        self.assertIsNone(clam.common.journal.read(self.projectpath))
+
+    def test2_run(self):
+        """Journal - Fold a complete run"""
+        clam.common.journal.append(self.projectpath, clam.common.journal.STARTED, pid=100)
+        clam.common.journal.append(self.projectpath, clam.common.journal.PID, pid=101)
+        state = clam.common.journal.read(self.projectpath)
+        self.assertEqual(state.pid, 101)
+        self.assertFalse(state.done)
+        clam.common.journal.append(self.projectpath, clam.common.journal.FINISHED, code=0, peakmem=2048)
+        state = clam.common.journal.read(self.projectpath)
+        self.assertTrue(state.done)
+        self.assertEqual(state.exitstatus, 0)
+        self.assertEqual(state.peakmem, 2048)
+        self.assertFalse(state.aborted)
+
+    def test3_abort(self):
+        """Journal - Abort and reset"""
+        journal = clam.common.journal.Journal(self.projectpath)
+        clam.common.journal.append(self.projectpath, clam.common.journal.STARTED, pid=100)
+        self.assertFalse(journal.read().abortrequested)
+        clam.common.journal.append(self.projectpath, clam.common.journal.ABORT)
+        self.assertTrue(journal.read().abortrequested)
+        clam.common.journal.append(self.projectpath, clam.common.journal.ABORTED)
+        clam.common.journal.append(self.projectpath, clam.common.journal.FINISHED, code=15)
+        state = journal.wait(lambda state: state.done, timeout=1)
+        self.assertTrue(state.aborted)
+        clam.common.journal.append(self.projectpath, clam.common.journal.RESET)
+        state = journal.read()
+        self.assertFalse(state.done)
+        self.assertFalse(state.aborted)
+        self.assertEqual(state.pid, 0)
+
+    def test4_corrupt(self):
+        """Journal - Corrupt and incomplete lines are skipped"""
+        clam.common.journal.append(self.projectpath, clam.common.journal.STARTED, pid=100)
+        with open(os.path.join(self.projectpath, clam.common.journal.JOURNALFILE),'a',encoding='utf-8') as f:
+            f.write("{\"event\": \"fini\n{\"event\": \"finished\"")
+        state = clam.common.journal.read(self.projectpath)
+        self.assertEqual(state.pid, 100)
+        self.assertFalse(state.done)
+
+    def test5_timeout(self):
+        """Journal - Waiting times out"""
+        journal = clam.common.journal.Journal(self.projectpath)
+        self.assertIsNone(journal.wait(lambda state: state.done, timeout=0.2))
+
+    def test6_queue(self):
+        """Journal - Queued, dequeued and started from the queue"""
+        journal = clam.common.journal.Journal(self.projectpath)
+        clam.common.journal.append(self.projectpath, clam.common.journal.QUEUED)
+        self.assertIsNotNone(journal.read().queued)
+        clam.common.journal.append(self.projectpath, clam.common.journal.DEQUEUED)
+        self.assertIsNone(journal.read().queued)
+        clam.common.journal.append(self.projectpath, clam.common.journal.QUEUED)
+        clam.common.journal.append(self.projectpath, clam.common.journal.STARTED, pid=100)
+        state = journal.read()
+        self.assertIsNone(state.queued)
+        self.assertEqual(state.pid, 100)
+        self.assertLessEqual(state.queuedtimestamp, state.startedtimestamp) #kept to compute the time spent in the queue
+
+    def test7_abortdelete(self):
+        """Journal - Abort with deletion, through the dispatcher"""
+        journal = clam.common.journal.Journal(self.projectpath)
+        clam.common.journal.append(self.projectpath, clam.common.journal.STARTED, pid=100)
+        clam.common.journal.append(self.projectpath, clam.common.journal.PID, pid=101, dispatcher=100)
+        state = journal.read()
+        self.assertEqual(state.dispatcher, 100)
+        self.assertFalse(state.deleterequested)
+        clam.common.journal.append(self.projectpath, clam.common.journal.ABORT, delete=True)
+        clam.common.journal.append(self.projectpath, clam.common.journal.ABORT) #a later plain abort does not cancel the deletion
+        state = journal.read()
+        self.assertTrue(state.abortrequested)
+        self.assertTrue(state.deleterequested)
+        clam.common.journal.append(self.projectpath, clam.common.journal.STARTED, pid=102)
+        self.assertFalse(journal.read().deleterequested)
+
+    def test8_abortqueued(self):
+        """Journal - Abort requested whilst the project is taken from the queue applies to the run that is started"""
+        journal = clam.common.journal.Journal(self.projectpath)
+        clam.common.journal.append(self.projectpath, clam.common.journal.QUEUED)
+        clam.common.journal.append(self.projectpath, clam.common.journal.ABORT, delete=True)
+        clam.common.journal.append(self.projectpath, clam.common.journal.STARTED, pid=100)
+        state = journal.read()
+        self.assertEqual(state.pid, 100)
+        self.assertTrue(state.abortrequested)
+        self.assertTrue(state.deleterequested)
+
+    def test9_wakeup(self):
+        """Journal - Waiting is woken by appended events (inotify)"""
+        watch = clam.common.journal.Watch(self.projectpath)
+        watch.close()
+        if watch.fd is None and not sys.platform.startswith('linux'):
+            self.skipTest("inotify not available")
+        journal = clam.common.journal.Journal(self.projectpath)
+        clam.common.journal.append(self.projectpath, clam.common.journal.STARTED, pid=100)
+        timer = threading.Timer(0.8, clam.common.journal.append, (self.projectpath, clam.common.journal.FINISHED), {'code': 0})
+        timer.start()
+        begin = time.time()
+        state = journal.wait(lambda state: state.done, timeout=10)
+        timer.join()
+        self.assertTrue(state.done)
+        self.assertLess(time.time() - begin, 1.3) #polling would only notice it after 1.55s
+
+if __name__ == '__main__':
+    unittest.main()
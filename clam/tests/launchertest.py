@@ -0,0 +1,107 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Dispatcher launcher tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.launcher
+import clam.common.journal
+
+SETTINGSMODULE = 'clam.config.textstats'
+
+class LauncherTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.socketpath = os.path.join(self.root, clam.common.launcher.LAUNCHERSOCKET)
+        self.process = subprocess.Popen([sys.executable, '-m', 'clam.clamdispatcher', '--serve', self.socketpath, SETTINGSMODULE], stderr=subprocess.DEVNULL)
+        for _ in range(200):
+            if clam.common.launcher.ping(self.socketpath):
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        clam.common.launcher.shutdown(self.socketpath)
+        self.process.wait(10)
+        shutil.rmtree(self.root)
+
+    def test1_ping(self):
+        """Launcher - Ping and shutdown"""
+        self.assertTrue(clam.common.launcher.ping(self.socketpath))
+        self.assertTrue(clam.common.launcher.ping(self.socketpath, SETTINGSMODULE))
+        self.assertFalse(clam.common.launcher.ping(self.socketpath, 'someother.settings'))
+        self.assertTrue(clam.common.launcher.shutdown(self.socketpath))
+        self.assertEqual(self.process.wait(10), 0)
+        self.assertFalse(os.path.exists(self.socketpath))
+        self.assertFalse(clam.common.launcher.ping(self.socketpath))
+
+    def test2_launch(self):
+        """Launcher - Launch a dispatcher"""
+        projectdir = os.path.join(self.root, 'projects', 'anonymous', 'project') + '/'
+        os.makedirs(projectdir + 'output')
+        stderr = projectdir + 'output/error.log'
+        pid = clam.common.launcher.launch(self.socketpath, [SETTINGSMODULE, projectdir, 'echo', 'hello'], stderr, self.root)
+        self.assertTrue(pid > 0)
+        for _ in range(200):
+            state = clam.common.journal.read(projectdir)
+            if state is not None and state.done:
+                break
+            time.sleep(0.05)
+        self.assertTrue(state.done)
+        self.assertEqual(state.exitstatus, 0)
+        with open(stderr,'r',encoding='utf-8') as f:
+            self.assertIn("[CLAM Dispatcher] Running echo", f.read())
+
+    def test3_shell(self):
+        """Launcher - The command is passed unsplit and run with the shell as it is"""
+        projectdir = os.path.join(self.root, 'projects', 'anonymous', 'project') + '/'
+        os.makedirs(projectdir + 'output')
+        cmd = "test '$HOME' != \"$HOME\" %PIPE%%PIPE% exit 7" #splitting and quoting the words again would expand both
+        clam.common.launcher.launch(self.socketpath, [SETTINGSMODULE, projectdir, cmd], projectdir + 'output/error.log', self.root)
+        state = clam.common.journal.Journal(projectdir).wait(lambda state: state.done, timeout=10)
+        self.assertTrue(state.done)
+        self.assertEqual(state.exitstatus, 0)
+
+    def test4_unreachable(self):
+        """Launcher - Launch fails without a launcher"""
+        with self.assertRaises(OSError):
+            clam.common.launcher.launch(os.path.join(self.root, 'nosuch.sock'), [SETTINGSMODULE, self.root, 'echo'], os.devnull, self.root)
+
+    def test5_abortdelete(self):
+        """Launcher - Signal a dispatcher to abort and delete its project"""
+        projectdir = os.path.join(self.root, 'projects', 'anonymous', 'project') + '/'
+        os.makedirs(projectdir + 'output')
+        clam.common.launcher.launch(self.socketpath, [SETTINGSMODULE, projectdir, 'sleep', '60'], projectdir + 'output/error.log', self.root)
+        journal = clam.common.journal.Journal(projectdir)
+        state = journal.wait(lambda state: state.dispatcher, timeout=10)
+        self.assertTrue(state.dispatcher > 0)
+        time.sleep(2) #by now the dispatcher only checks the journal every few seconds
+        begintime = time.time()
+        clam.common.journal.append(projectdir, clam.common.journal.ABORT, delete=True)
+        os.kill(state.dispatcher, clam.common.journal.ABORTSIGNAL)
+        for _ in range(200):
+            if not os.path.exists(projectdir):
+                break
+            time.sleep(0.01)
+        self.assertFalse(os.path.exists(projectdir))
+        self.assertLess(time.time() - begintime, 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Input manifest tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.manifest
+import clam.common.data
+import clam.common.formats
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.projectpath = tempfile.mkdtemp() + '/'
+        os.makedirs(self.projectpath + 'input/sub')
+
+    def tearDown(self):
+        shutil.rmtree(self.projectpath)
+
+    def addfile(self, filename):
+        with open(self.projectpath + 'input/' + filename, 'w', encoding='utf-8') as f:
+            f.write("test")
+
+    def test1_manifest(self):
+        """Input manifest - Adding, querying and removing files"""
+        with clam.common.manifest.Manifest(self.projectpath) as manifest:
+            self.assertEqual(manifest.files(), [])
+            manifest.add('a.txt', 'text', 2, 4, 'abc')
+            manifest.addfiles([('b.txt', 'text', 1, 4, None), ('sub/c.txt', 'text', 3, 4, None), ('d.xml', 'xml', 0, 10, None)])
+            self.assertEqual(manifest.files('text'), [(1, 'b.txt', 'text'), (2, 'a.txt', 'text'), (3, 'sub/c.txt', 'text')])
+            self.assertEqual(manifest.nextseq(), {'text': 4, 'xml': 1})
+            self.assertEqual(manifest.get('a.txt'), {'inputtemplate': 'text', 'seq': 2, 'size': 4, 'metadigest': 'abc'})
+            self.assertEqual(manifest.remove('sub'), 1)
+            self.assertEqual(manifest.remove('a.txt'), 1)
+            self.assertIsNone(manifest.get('a.txt'))
+        with clam.common.manifest.Manifest(self.projectpath) as manifest:
+            self.assertEqual(manifest.files(), [(0, 'd.xml', 'xml'), (1, 'b.txt', 'text')])
+            manifest.clear()
+            self.assertEqual(manifest.files(), [])
+
+    def test2_legacy(self):
+        """Input manifest - Symbolic links of older projects are imported, once"""
+        for filename, seq in (('a.txt', 1), ('b.txt', 2), ('sub/c.txt', 3)):
+            self.addfile(filename)
+            linkf = os.path.join(os.path.dirname(filename), '.' + os.path.basename(filename) + '.INPUTTEMPLATE.text.' + str(seq))
+            os.symlink(self.projectpath + 'input/' + filename, self.projectpath + 'input/' + linkf)
+        os.symlink(self.projectpath + 'input/gone.txt', self.projectpath + 'input/.gone.txt.INPUTTEMPLATE.text.4') #dead link
+        with clam.common.manifest.Manifest(self.projectpath) as manifest:
+            self.assertEqual(manifest.files('text'), [(1, 'a.txt', 'text'), (2, 'b.txt', 'text'), (3, 'sub/c.txt', 'text')])
+            self.assertEqual(manifest.get('b.txt')['size'], 4)
+            manifest.remove('a.txt')
+        self.assertEqual(len(os.listdir(self.projectpath + 'input')), 6) #the links are left alone
+        with clam.common.manifest.Manifest(self.projectpath) as manifest:
+            self.assertEqual(manifest.files('text'), [(2, 'b.txt', 'text'), (3, 'sub/c.txt', 'text')]) #imported only once
+
+    def test3_concurrentcreation(self):
+        """Input manifest - A manifest file created by another process but without schema yet is initialised"""
+        open(self.projectpath + clam.common.manifest.MANIFESTFILE, 'wb').close()
+        with clam.common.manifest.Manifest(self.projectpath) as manifest:
+            self.assertEqual(manifest.version(), clam.common.manifest.VERSION)
+            self.assertEqual(manifest.files(), [])
+        os.chmod(self.projectpath, 0o555) #opening an existing manifest needs no write access
+        try:
+            with clam.common.manifest.Manifest(self.projectpath) as manifest:
+                self.assertEqual(manifest.files(), [])
+        finally:
+            os.chmod(self.projectpath, 0o755)
+
+    def test4_matchingfiles(self):
+        """Input manifest - Input templates and file deletion use the manifest"""
+        inputtemplate = clam.common.data.InputTemplate('text', clam.common.formats.PlainTextFormat, "text", multi=True)
+        self.addfile('a.txt')
+        self.addfile('b.txt')
+        with clam.common.manifest.Manifest(self.projectpath) as manifest:
+            manifest.addfiles([('a.txt', 'text', 1, 4, None), ('b.txt', 'text', 2, 4, None)])
+        self.assertEqual(inputtemplate.matchingfiles(self.projectpath), [(1, 'a.txt', inputtemplate), (2, 'b.txt', inputtemplate)])
+        self.assertTrue(clam.common.data.CLAMInputFile(self.projectpath, 'a.txt', False).delete())
+        self.assertEqual(inputtemplate.matchingfiles(self.projectpath), [(2, 'b.txt', inputtemplate)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Project index tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.projectindex
+import clam.common.status
+
+class ProjectIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'projects', 'proycon'))
+        self.index = clam.common.projectindex.ProjectIndex(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test1_update(self):
+        """Project index - Add and update projects"""
+        self.index.update('proycon', 'p1', clam.common.status.READY)
+        self.index.setusage('proycon', 'p1', 'input', 1.5, 2)
+        self.index.update('proycon', 'p2', clam.common.status.READY)
+        self.index.setusage('proycon', 'p2', 'output', 2.0, 1)
+        self.index.update('proycon', 'p1', clam.common.status.RUNNING)
+        projects = self.index.projects('proycon')
+        self.assertEqual([ (p, size, status) for p, _, size, status in projects ], [('p1',1.5,clam.common.status.RUNNING), ('p2',2.0,clam.common.status.READY)])
+        self.assertEqual(self.index.totalsize('proycon'), 3.5)
+        self.assertEqual(self.index.projects('someoneelse'), [])
+
+    def test2_remove(self):
+        """Project index - Remove project"""
+        self.index.update('proycon', 'p1', clam.common.status.READY)
+        self.index.setusage('proycon', 'p1', 'input', 1.5, 2)
+        self.index.remove('proycon', 'p1')
+        self.assertIsNone(self.index.project('proycon','p1'))
+        self.assertEqual(self.index.totalsize('proycon'), 0.0)
+
+    def test3_adjust(self):
+        """Project index - Incremental disk usage accounting"""
+        self.index.update('proycon', 'p1', clam.common.status.READY)
+        self.index.adjust('proycon', 'p1', 'input', 1.0, 2)
+        self.index.adjust('proycon', 'p1', 'input', 0.5, 1)
+        self.index.adjust('proycon', 'p1', 'output', 2.0, 4)
+        self.index.adjust('proycon', 'p1', 'input', -1.0, -2)
+        self.assertEqual(self.index.usage('proycon','p1'), {'inputsize': 0.5, 'inputfiles': 1, 'outputsize': 2.0, 'outputfiles': 4})
+        self.index.adjust('proycon', 'p1', 'output', -3.0, -5) #counters never go negative
+        self.assertEqual(self.index.usage('proycon','p1'), {'inputsize': 0.5, 'inputfiles': 1, 'outputsize': 0.0, 'outputfiles': 0})
+        self.assertEqual(self.index.project('proycon','p1')[3], clam.common.status.READY)
+
+    def test4_reconcile(self):
+        """Project index - Full recount of disk usage"""
+        projectpath = os.path.join(self.root, 'projects', 'proycon', 'p1')
+        os.makedirs(os.path.join(projectpath, 'input'))
+        os.makedirs(os.path.join(projectpath, 'output'))
+        with open(os.path.join(projectpath, 'input', 'test.txt'),'wb') as f:
+            f.write(b'x' * 1024 * 1024)
+        self.index.adjust('proycon', 'p1', 'input', 5.0, 5) #drifted
+        self.assertEqual(self.index.reconcile('proycon', 'p1', projectpath), (1.0, 1))
+        self.assertEqual(self.index.usage('proycon','p1'), {'inputsize': 1.0, 'inputfiles': 1, 'outputsize': 0.0, 'outputfiles': 0})
+
+    def test5_migrate(self):
+        """Project index - Migration from legacy JSON index"""
+        legacyfile = os.path.join(self.root, 'projects', 'proycon', '.index')
+        with open(legacyfile,'w',encoding='utf-8') as f:
+            json.dump({'totalsize': 3.0, 'projects': [ ['p1', '2020-01-01 00:00:00', 1.0, 2], ['p2', '2020-01-01 00:00:00', 2.0, 0] ]}, f)
+        self.assertFalse(self.index.indexed('proycon'))
+        self.assertTrue(self.index.migrate('proycon', os.path.dirname(legacyfile)))
+        self.assertTrue(self.index.indexed('proycon'))
+        self.assertFalse(os.path.exists(legacyfile))
+        self.assertEqual(len(self.index.projects('proycon')), 2)
+        self.assertEqual(self.index.totalsize('proycon'), 3.0)
+
+    def test6_migrate_corrupt(self):
+        """Project index - Corrupt legacy JSON index is not migrated"""
+        legacyfile = os.path.join(self.root, 'projects', 'proycon', '.index')
+        with open(legacyfile,'w',encoding='utf-8') as f:
+            f.write("{\"projects\": [")
+        self.assertFalse(self.index.migrate('proycon', os.path.dirname(legacyfile)))
+        self.assertFalse(self.index.indexed('proycon'))
+
+    def test7_concurrent(self):
+        """Project index - Changes are visible to other connections"""
+        other = clam.common.projectindex.ProjectIndex(self.root)
+        self.index.update('proycon', 'p1', clam.common.status.READY)
+        other.update('proycon', 'p2', clam.common.status.READY)
+        self.assertEqual(len(self.index.projects('proycon')), 2)
+
+    def test8_jobs(self):
+        """Project index - Job history and summary"""
+        self.index.addjob('proycon', 'p1', {'walltime': 10.0, 'exitstatus': 0, 'aborted': 0, 'usertime': 8.0, 'systemtime': 1.0, 'maxrss': 1024})
+        self.index.addjob('proycon', 'p2', {'walltime': 20.0, 'exitstatus': 1, 'aborted': 0, 'usertime': 2.0, 'systemtime': 1.0, 'maxrss': 2048})
+        self.index.addjob('someoneelse', 'p1', {'walltime': 30.0, 'exitstatus': 0, 'aborted': 1})
+        self.assertEqual([ job['project'] for job in self.index.jobs('proycon') ], ['p2','p1'])
+        self.assertEqual(len(self.index.jobs()), 3)
+        summary = self.index.jobsummary()
+        self.assertEqual(summary[None]['jobs'], 3)
+        self.assertEqual(summary[None]['maxwalltime'], 30.0)
+        self.assertEqual(summary['proycon']['failed'], 1)
+        self.assertEqual(summary['proycon']['totalcputime'], 12.0)
+        self.assertEqual(summary['proycon']['maxrss'], 2048)
+        self.assertEqual(summary['someoneelse']['aborted'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
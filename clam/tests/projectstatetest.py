@@ -0,0 +1,158 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Project state tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.status
+import clam.common.journal
+import clam.config.textstats
+import clam.clamservice
+
+def deadpid():
+    """Returns the pid of a process that has ended"""
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+class ProjectStateTest(unittest.TestCase):
+    """Run state of a project, from its journal (journal=True) or from the sentinel files of legacy projects"""
+
+    journal = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp() + '/'
+        cls.settings = clam.clamservice.settings
+        cls.originalroot = clam.config.textstats.ROOT
+        clam.config.textstats.ROOT = cls.root
+        clam.clamservice.settings = clam.config.textstats
+        clam.clamservice.set_defaults()
+
+    @classmethod
+    def tearDownClass(cls):
+        clam.config.textstats.ROOT = cls.originalroot
+        clam.clamservice.settings = cls.settings
+        shutil.rmtree(cls.root)
+
+    def setUp(self):
+        self.path = self.root + "projects/anonymous/statetest/"
+        os.makedirs(self.path + "input")
+        os.makedirs(self.path + "output")
+        clam.config.textstats.LOST_GRACEPERIOD = 10
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def state(self):
+        return clam.clamservice.ProjectState('statetest', 'anonymous')
+
+    def write(self, filename, content=""):
+        with open(self.path + filename, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    def started(self, pid):
+        if self.journal:
+            clam.common.journal.append(self.path, clam.common.journal.STARTED, pid=pid)
+        else:
+            self.write('.pid', str(pid))
+
+    def finished(self, code, aborted=False):
+        if self.journal:
+            if aborted:
+                clam.common.journal.append(self.path, clam.common.journal.ABORTED)
+            clam.common.journal.append(self.path, clam.common.journal.FINISHED, code=code)
+        else:
+            if aborted:
+                self.write('.aborted')
+            self.write('.done', str(code))
+
+    def test1_ready(self):
+        """Project state - A project that was never started is ready"""
+        state = self.state()
+        self.assertTrue(state.exists)
+        self.assertFalse(state.running)
+        self.assertFalse(state.done)
+        self.assertEqual(state.simplestatus(), clam.common.status.READY)
+        self.assertEqual(state.status()[0], clam.common.status.READY)
+
+    def test2_running(self):
+        """Project state - A project whose process is alive is running"""
+        self.started(os.getpid())
+        state = self.state()
+        self.assertEqual(state.pid, os.getpid())
+        self.assertTrue(state.alive)
+        self.assertTrue(state.running)
+        self.assertFalse(state.done)
+        self.assertFalse(state.aborting)
+        self.assertEqual(state.simplestatus(), clam.common.status.RUNNING)
+
+    def test3_lost(self):
+        """Project state - A project whose process is gone is marked as lost, but only after LOST_GRACEPERIOD"""
+        self.started(deadpid())
+        state = self.state()
+        self.assertFalse(state.running)
+        self.assertFalse(state.done) #the dispatcher may still be finishing up
+        if not self.journal:
+            self.assertFalse(os.path.exists(self.path + clam.common.journal.JOURNALFILE)) #nothing recorded yet
+        past = time.time() - 60
+        os.utime(self.path + (clam.common.journal.JOURNALFILE if self.journal else '.pid'), (past, past))
+        state = self.state()
+        self.assertFalse(state.running)
+        self.assertTrue(state.done)
+        self.assertEqual(state.exitstatus, 1)
+        self.assertEqual(state.simplestatus(), clam.common.status.DONE)
+
+    def test4_done(self):
+        """Project state - A project whose process finished is done"""
+        self.started(deadpid())
+        self.finished(0)
+        state = self.state()
+        self.assertFalse(state.running)
+        self.assertTrue(state.done)
+        self.assertFalse(state.aborted)
+        self.assertEqual(state.exitstatus, 0)
+        self.assertEqual(state.status()[0], clam.common.status.DONE)
+
+    def test5_aborted(self):
+        """Project state - An aborted project reports that it is aborting, then that it was aborted"""
+        self.started(os.getpid())
+        if self.journal:
+            clam.common.journal.append(self.path, clam.common.journal.ABORT)
+        else:
+            self.write('.abort')
+        state = self.state()
+        self.assertTrue(state.running)
+        self.assertTrue(state.aborting)
+        self.assertTrue(state.status()[1].startswith("Aborting"))
+        self.finished(15, aborted=True)
+        state = self.state()
+        self.assertTrue(state.done)
+        self.assertTrue(state.aborted)
+        self.assertFalse(state.aborting)
+        self.assertEqual(state.status()[0], clam.common.status.DONE)
+        self.assertTrue(state.status()[1].startswith("Aborted"))
+
+class LegacyProjectStateTest(ProjectStateTest):
+    journal = False
+
+if __name__ == '__main__':
+    unittest.main()
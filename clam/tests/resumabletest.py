@@ -0,0 +1,106 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Resumable upload tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import io
+import json
+import shutil
+import tempfile
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.resumable
+
+class BrokenStream:
+    """A stream that breaks after a number of bytes, like a dropped connection"""
+    def __init__(self, data, breakafter):
+        self.stream = io.BytesIO(data[:breakafter])
+
+    def read(self, size):
+        data = self.stream.read(size)
+        if not data:
+            raise IOError("Connection reset")
+        return data
+
+class ResumableTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data = bytes(range(256)) * 1000
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test1_missing(self):
+        """Resumable - Merging received ranges and finding the gaps"""
+        self.assertEqual(clam.common.resumable.merge([[10,20],[0,5],[5,8],[15,30]]), [[0,8],[10,30]])
+        self.assertEqual(clam.common.resumable.missing([[0,8],[10,30]], 40), [[8,10],[30,40]])
+        self.assertEqual(clam.common.resumable.missing([[0,8],[10,30]], 40, 5, 20), [[8,10]])
+        self.assertEqual(clam.common.resumable.missing([], 40, 5, 20), [[5,20]])
+        self.assertEqual(clam.common.resumable.missing([[0,40]], 40), [])
+
+    def test2_outoforder(self):
+        """Resumable - Ranges are assembled regardless of the order they arrive in"""
+        session = clam.common.resumable.Session.create(self.directory, len(self.data), 'test.txt')
+        half = len(self.data) // 2
+        self.assertEqual(session.write(half, io.BytesIO(self.data[half:]), len(self.data) - half), len(self.data) - half)
+        self.assertFalse(session.complete())
+        self.assertEqual(session.offset(), 0)
+        session = clam.common.resumable.Session.load(self.directory, session.id)
+        self.assertEqual(session.name, 'test.txt')
+        session.write(0, io.BytesIO(self.data[:half]), half)
+        self.assertTrue(session.complete())
+        with open(session.datafile,'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        session.discard()
+        self.assertIsNone(clam.common.resumable.Session.load(self.directory, session.id))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test3_resume(self):
+        """Resumable - What was received before the connection dropped is kept"""
+        session = clam.common.resumable.Session.create(self.directory, len(self.data), 'test.txt')
+        self.assertEqual(session.write(0, BrokenStream(self.data, 100000), len(self.data)), 100000)
+        self.assertEqual(session.offset(), 100000)
+        self.assertEqual(clam.common.resumable.missing(session.received(), session.size), [[100000, len(self.data)]])
+        session.write(100000, io.BytesIO(self.data[100000:]), len(self.data) - 100000)
+        self.assertTrue(session.complete())
+        with open(session.datafile,'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test4_invalid(self):
+        """Resumable - Ranges beyond the end and invalid IDs are refused"""
+        session = clam.common.resumable.Session.create(self.directory, 10, 'test.txt')
+        self.assertRaises(ValueError, session.write, 5, io.BytesIO(b'0123456789'), 10)
+        self.assertIsNone(clam.common.resumable.Session.load(self.directory, '../' + session.id))
+        self.assertIsNone(clam.common.resumable.Session.load(self.directory, 'abc'))
+
+    def test5_expire(self):
+        """Resumable - Sessions that did not receive anything for a while are discarded"""
+        old = clam.common.resumable.Session.create(self.directory, 10, 'old.txt')
+        recent = clam.common.resumable.Session.create(self.directory, 10, 'recent.txt')
+        for session in (old, recent):
+            with open(session.statefile,'r',encoding='utf-8') as f:
+                state = json.load(f)
+            state['created'] -= 7200
+            with open(session.statefile,'w',encoding='utf-8') as f:
+                json.dump(state, f)
+        recent.write(0, io.BytesIO(b'01234'), 5)
+        self.assertEqual(sorted(session.name for session in clam.common.resumable.sessions(self.directory)), ['old.txt', 'recent.txt'])
+        self.assertEqual(clam.common.resumable.expire(self.directory, 3600), 1)
+        self.assertEqual([ session.name for session in clam.common.resumable.sessions(self.directory) ], ['recent.txt'])
+        self.assertFalse(os.path.exists(old.datafile))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Sendfile tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import flask
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.config.textstats
+import clam.clamservice
+
+FILENAME = "projects/anonymous/sendfiletest/output/un résumé.txt" #with a space and a non-ASCII character
+CONTENT = b"0123456789" * 100
+
+class SendfileTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp() + '/'
+        cls.settings = clam.clamservice.settings
+        cls.originalroot = clam.config.textstats.ROOT
+        clam.config.textstats.ROOT = cls.root
+        clam.clamservice.settings = clam.config.textstats
+        clam.clamservice.set_defaults()
+        os.makedirs(os.path.dirname(cls.root + FILENAME))
+        with open(cls.root + FILENAME, 'wb') as f:
+            f.write(CONTENT)
+        app = flask.Flask(__name__)
+        app.add_url_rule('/file', 'file', lambda: clam.clamservice.sendfile(cls.root + FILENAME, 'text/plain', {'allow_origin': '*'}))
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        clam.config.textstats.ROOT = cls.originalroot
+        clam.clamservice.settings = cls.settings
+        shutil.rmtree(cls.root)
+
+    def tearDown(self):
+        clam.config.textstats.SENDFILE = None
+        clam.config.textstats.SENDFILE_PREFIX = '/clamroot/'
+
+    def test1_xaccelredirect(self):
+        """Sendfile - X-Accel-Redirect points nginx to the file under SENDFILE_PREFIX, quoted"""
+        clam.config.textstats.SENDFILE = 'x-accel-redirect'
+        clam.config.textstats.SENDFILE_PREFIX = '/internal/data/'
+        r = self.client.get('/file')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['X-Accel-Redirect'], "/internal/data/projects/anonymous/sendfiletest/output/un%20r%C3%A9sum%C3%A9.txt")
+        self.assertEqual(r.headers['Content-Type'], 'text/plain')
+        self.assertEqual(r.headers['Access-Control-Allow-Origin'], '*')
+        self.assertEqual(r.data, b"") #the web server sends the file
+
+    def test2_xsendfile(self):
+        """Sendfile - X-Sendfile passes the absolute path of the file as raw bytes"""
+        clam.config.textstats.SENDFILE = 'x-sendfile'
+        r = self.client.get('/file')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['X-Sendfile'], os.fsencode(os.path.abspath(self.root + FILENAME)).decode('latin-1'))
+        self.assertEqual(r.headers['X-Sendfile'].encode('latin-1').decode('utf-8'), os.path.abspath(self.root + FILENAME))
+        self.assertEqual(r.data, b"")
+
+    def test3_conditional(self):
+        """Sendfile - Without SENDFILE the file is sent through the WSGI server, honouring conditional requests"""
+        r = self.client.get('/file')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data, CONTENT)
+        self.assertEqual(r.headers['Content-Type'], 'text/plain')
+        self.assertTrue(r.headers.get('ETag'))
+        self.assertTrue(r.headers.get('Last-Modified'))
+        r2 = self.client.get('/file', headers={'If-None-Match': r.headers['ETag']})
+        self.assertEqual(r2.status_code, 304)
+        self.assertEqual(r2.data, b"")
+        r2 = self.client.get('/file', headers={'If-Modified-Since': r.headers['Last-Modified']})
+        self.assertEqual(r2.status_code, 304)
+
+    def test4_range(self):
+        """Sendfile - Without SENDFILE the file is sent through the WSGI server, honouring range requests"""
+        r = self.client.get('/file', headers={'Range': 'bytes=10-19'})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.data, CONTENT[10:20])
+        self.assertEqual(r.headers['Content-Range'], 'bytes 10-19/' + str(len(CONTENT)))
+        r = self.client.get('/file', headers={'Range': 'bytes=990-'})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.data, CONTENT[990:])
+        r = self.client.get('/file', headers={'Range': 'bytes=5000-6000'})
+        self.assertEqual(r.status_code, 416)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,6 +21,10 @@ import time
 import unittest
 import io
 import zipfile
+import json
+import hashlib
+import xml.etree.ElementTree as ElementTree
+import requests
 
 
 #Import the CLAM Client API and CLAM Data API and other dependencies
@@ -155,6 +159,46 @@ class BasicServiceTest(unittest.TestCase):
         success = self.client.addinputfile('basicservicetest', data.inputtemplate('textinput'),'/tmp/servicetest.txt', language='fr', metafile='/tmp/servicetest.txt.METADATA')
         self.assertTrue(success)
 
+    def test2_B2_batchupload(self):
+        """Basic Service Test - Upload of multiple files in one request"""
+        for i in range(3):
+            f = io.open('/tmp/servicetest_batch' + str(i) + '.txt','w',encoding='utf-8')
+            f.write("Ceci est le fichier " + str(i))
+            f.close()
+        data = self.client.get('basicservicetest')
+        success = self.client.addinputfiles('basicservicetest', data.inputtemplate('textinput'), ['/tmp/servicetest_batch0.txt', '/tmp/servicetest_batch1.txt', ('/tmp/servicetest_batch2.txt', {'filename': 'servicetest_renamed.txt'})], language='fr')
+        self.assertTrue(success)
+        data = self.client.get('basicservicetest')
+        self.assertTrue('servicetest_batch0.txt' in [ x.filename for x in data.input ])
+        self.assertTrue('servicetest_batch1.txt' in [ x.filename for x in data.input ])
+        self.assertTrue('servicetest_renamed.txt' in [ x.filename for x in data.input ])
+
+    def test2_B2b_batchunknowntemplate(self):
+        """Basic Service Test - Upload of multiple files in one request, one with an unknown input template"""
+        for i in range(2):
+            f = io.open('/tmp/servicetest_batch' + str(i) + '.txt','w',encoding='utf-8')
+            f.write("Ceci est le fichier " + str(i))
+            f.close()
+        with open('/tmp/servicetest_batch0.txt','rb') as f0, open('/tmp/servicetest_batch1.txt','rb') as f1:
+            r = requests.post(self.url + '/basicservicetest/input/', files=[('file', ('servicetest_batch3.txt', f0)), ('file', ('servicetest_batch4.txt', f1))],
+                              data={'inputtemplate': 'textinput', 'language': 'fr', 'manifest': json.dumps([{}, {'inputtemplate': 'nosuchtemplate'}])})
+        self.assertEqual(r.status_code, 403)
+        upload = ElementTree.fromstring(r.content)
+        self.assertEqual([ node.attrib['filename'] for node in upload ], ['servicetest_batch3.txt', 'servicetest_batch4.txt'])
+        self.assertIn('nosuchtemplate', upload[1].find('error').text)
+
+    def test2_B3_dedupupload(self):
+        """Basic Service Test - Upload of a file the server may already have (with or without content-addressed store)"""
+        f = io.open('/tmp/servicetest_dedup.txt','w',encoding='utf-8')
+        f.write("Ceci est le fichier partagé")
+        f.close()
+        data = self.client.get('basicservicetest')
+        for filename in ('servicetest_dedup1.txt', 'servicetest_dedup2.txt'):
+            success = self.client.addinputfile('basicservicetest', data.inputtemplate('textinput'), '/tmp/servicetest_dedup.txt', filename=filename, language='fr', dedup=True)
+            self.assertTrue(success)
+        data = self.client.get('basicservicetest')
+        self.assertTrue('servicetest_dedup2.txt' in [ x.filename for x in data.input ])
+
     def test2_C_delete(self):
         """Basic Service Test - Project deletion"""
         success = self.client.delete('basicservicetest')
@@ -285,6 +329,120 @@ class ExtensiveServiceTest(unittest.TestCase):
 
 
 
+def readevents(response):
+    """Parse a stream of Server-Sent Events, returns a list of (id, event, data) tuples"""
+    events = []
+    eventid = eventtype = None
+    data = []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                events.append((eventid, eventtype, json.loads("\n".join(data))))
+            eventid = eventtype = None
+            data = []
+        elif line.startswith('id: '):
+            eventid = line[4:]
+        elif line.startswith('event: '):
+            eventtype = line[7:]
+        elif line.startswith('data: '):
+            data.append(line[6:])
+    return events
+
+class EventsTest(unittest.TestCase):
+    def setUp(self):
+        self.url = 'http://' + os.uname()[1] + ':8080'
+        self.client = CLAMClient(self.url)
+        self.project = 'eventstest'
+        self.client.create(self.project)
+        f = io.open('/tmp/servicetest.txt','w',encoding='utf-8')
+        f.write("On espère que tout ça marche bien.")
+        f.close()
+
+    def events(self, headers=None):
+        accesstoken = ElementTree.fromstring(requests.get(self.url + '/' + self.project + '/').content).attrib['accesstoken']
+        r = requests.get(self.url + '/' + self.project + '/events/', params={'user': 'anonymous', 'accesstoken': accesstoken}, headers=headers, stream=True, timeout=60)
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.headers['Content-Type'].startswith('text/event-stream'))
+        return readevents(r)
+
+    def test1_stream(self):
+        """Events Test - Stream the status until the project is done, resume with Last-Event-ID"""
+        data = self.client.get(self.project)
+        self.client.addinputfile(self.project, data.inputtemplate('textinput'),'/tmp/servicetest.txt', language='fr')
+        self.client.start(self.project)
+        events = self.events()
+        eventtype, done = events[-1][1:]
+        self.assertEqual(eventtype, 'done') #the stream is closed once the project is done
+        self.assertEqual(done['statuscode'], clam.common.status.DONE)
+        self.assertEqual(done['exitstatus'], 0)
+        self.assertFalse(done['aborted'])
+        log = [ entry for _, eventtype, entries in events if eventtype == 'log' for entry in entries ]
+        self.assertTrue(log)
+        for eventid, eventtype, entries in events:
+            if eventtype == 'log':
+                self.assertEqual(eventid, hashlib.sha1(json.dumps(entries[-1]).encode('utf-8')).hexdigest()[:16]) #identifies the newest entry sent
+
+        #reconnect after the oldest entry: only the entries after it are sent
+        events = self.events({'Last-Event-ID': hashlib.sha1(json.dumps(log[0]).encode('utf-8')).hexdigest()[:16]})
+        self.assertEqual([ entry for _, eventtype, entries in events if eventtype == 'log' for entry in entries ], log[1:])
+        self.assertEqual(events[-1][1], 'done')
+
+        #reconnect after the newest entry: no log entries at all
+        events = self.events({'Last-Event-ID': hashlib.sha1(json.dumps(log[-1]).encode('utf-8')).hexdigest()[:16]})
+        self.assertEqual([ eventtype for _, eventtype, _ in events ], ['done'])
+
+    def test2_accesstoken(self):
+        """Events Test - The stream requires the access token"""
+        r = requests.get(self.url + '/' + self.project + '/events/', params={'user': 'anonymous', 'accesstoken': 'wrong'})
+        self.assertEqual(r.status_code, 403)
+
+    def tearDown(self):
+        self.client.delete(self.project)
+
+class ProjectsStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.url = 'http://' + os.uname()[1] + ':8080'
+        self.client = CLAMClient(self.url)
+        self.projects = ['statustest1','statustest2']
+        for project in self.projects:
+            self.client.create(project)
+
+    def test1_all(self):
+        """Projects Status Test - All projects of the user"""
+        result = self.client.projectsstatus()
+        self.assertTrue(set(self.projects).issubset(entry['project'] for entry in result))
+
+    def test2_explicit(self):
+        """Projects Status Test - Explicit list of projects"""
+        result = self.client.projectsstatus(self.projects)
+        self.assertEqual([ entry['project'] for entry in result ], self.projects)
+        for entry in result:
+            self.assertEqual(entry['statuscode'], clam.common.status.READY)
+            self.assertEqual(entry['exitstatus'], None)
+            self.assertFalse('error' in entry)
+
+    def test3_commaseparated(self):
+        """Projects Status Test - Comma separated and repeated project IDs"""
+        r = requests.get(self.url + '/index/status/', params=[('projects', 'statustest1,statustest2'), ('projects','statustest1')])
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([ entry['project'] for entry in json.loads(r.text) ], ['statustest1','statustest2','statustest1'])
+
+    def test4_unknown(self):
+        """Projects Status Test - Unknown projects are reported with an error"""
+        result = self.client.projectsstatus(['statustest1','nonexistant'])
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0]['project'], 'statustest1')
+        self.assertEqual(result[1], {'project': 'nonexistant', 'error': "Project not found"})
+
+    def test5_running(self):
+        """Projects Status Test - Only running projects"""
+        result = self.client.projectsstatus(self.projects + ['nonexistant'], running=True)
+        self.assertEqual(result, []) #the projects are not started and unknown projects are left out
+
+    def tearDown(self):
+        for project in self.projects:
+            self.client.delete(project)
+
 class ArchiveUploadTest(unittest.TestCase):
     def setUp(self):
         self.url = 'http://' + os.uname()[1] + ':8080'
@@ -323,6 +481,24 @@ class ArchiveUploadTest(unittest.TestCase):
         self.assertTrue('servicetest2.txt' in [ x.filename for x in data.input ])
         self.assertTrue('servicetest3.txt' in [ x.filename for x in data.input ])
 
+    def test3_async(self):
+        """Archive Upload Test - Asynchronous validation"""
+        with open('/tmp/servicetest.tar.gz','rb') as f:
+            r = requests.post(self.url + '/' + self.project + '/input/servicetest.tar.gz', files={'file': ('servicetest.tar.gz', f)}, data={'inputtemplate': 'textinput', 'language': 'fr', 'async': '1'})
+        self.assertEqual(r.status_code, 202)
+        upload = json.loads(r.text)
+        self.assertEqual(upload['total'], 3)
+        for _ in range(100):
+            r = requests.get(upload['url'])
+            if r.status_code != 202:
+                break
+            time.sleep(0.1)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(requests.get(upload['url']).status_code, 404) #the result is handed out only once
+        data = self.client.get(self.project) #get status again
+        self.assertTrue('servicetest.txt' in [ x.filename for x in data.input ])
+        self.assertTrue('servicetest3.txt' in [ x.filename for x in data.input ])
+
     def tearDown(self):
         self.client.delete(self.project)
 
@@ -0,0 +1,103 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Status file tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.status
+
+class StatusReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.statusfile = os.path.join(self.dir, '.status')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test1_read(self):
+        """Status reader - Read status log"""
+        clam.common.status.write(self.statusfile, "Starting", 0, 1600000000)
+        clam.common.status.write(self.statusfile, "Processing", 50, 1600000001)
+        clam.common.status.write(self.statusfile, "Processing", 60, 1600000002) #duplicate messages are collapsed
+        log, completion = clam.common.status.StatusReader(self.statusfile).read()
+        self.assertEqual([ message for message, _, _ in log ], ["Processing", "Starting"])
+        self.assertEqual(log[0][2], 50)
+        self.assertEqual(completion, 60)
+
+    def test2_incremental(self):
+        """Status reader - Only appended lines are parsed"""
+        reader = clam.common.status.StatusReader(self.statusfile)
+        self.assertEqual(reader.read(), ([], 0))
+        clam.common.status.write(self.statusfile, "Starting", 0)
+        self.assertEqual(len(reader.read()[0]), 1)
+        offset = reader.offset
+        clam.common.status.write(self.statusfile, "Processing", 10)
+        log, completion = reader.read()
+        self.assertEqual(log[0][0], "Processing")
+        self.assertEqual(completion, 10)
+        self.assertGreater(reader.offset, offset)
+
+    def test3_partialline(self):
+        """Status reader - Incomplete last line is left for the next read"""
+        reader = clam.common.status.StatusReader(self.statusfile)
+        with open(self.statusfile,'w',encoding='utf-8') as f:
+            f.write("10%\t1600000000\tStarting\n20%\t1600000001\tProc")
+        self.assertEqual([ message for message, _, _ in reader.read()[0] ], ["Starting"])
+        offset = reader.offset
+        self.assertEqual(offset, len("10%\t1600000000\tStarting\n"))
+        with open(self.statusfile,'a',encoding='utf-8') as f:
+            f.write("ess")
+        parsed = []
+        parseline = clam.common.status.parseline
+        clam.common.status.parseline = lambda line: parsed.append(line) or parseline(line)
+        try:
+            self.assertEqual([ message for message, _, _ in reader.read()[0] ], ["Starting"])
+        finally:
+            clam.common.status.parseline = parseline
+        self.assertEqual(parsed, []) #not parsed again from the start
+        self.assertEqual(reader.offset, offset)
+        with open(self.statusfile,'a',encoding='utf-8') as f:
+            f.write("ing\n")
+        self.assertEqual([ message for message, _, _ in reader.read()[0] ], ["Processing", "Starting"])
+
+    def test4_replaced(self):
+        """Status reader - Replaced or truncated file is read from the start"""
+        reader = clam.common.status.StatusReader(self.statusfile)
+        clam.common.status.write(self.statusfile, "Old run", 100)
+        self.assertEqual(reader.read()[0][0][0], "Old run")
+        os.unlink(self.statusfile)
+        self.assertEqual(reader.read(), ([], 0))
+        clam.common.status.write(self.statusfile, "New run", 5)
+        log, completion = reader.read()
+        self.assertEqual([ message for message, _, _ in log ], ["New run"])
+        self.assertEqual(completion, 5)
+
+    def test5_bounded(self):
+        """Status reader - Status log is bounded"""
+        reader = clam.common.status.StatusReader(self.statusfile, maxlength=10)
+        for i in range(25):
+            clam.common.status.write(self.statusfile, "Step " + str(i), i)
+        log, completion = reader.read()
+        self.assertEqual(len(log), 10)
+        self.assertEqual(log[0][0], "Step 24")
+        self.assertEqual(log[-1][0], "Step 15")
+        self.assertEqual(completion, 24)
+
+if __name__ == '__main__':
+    unittest.main()
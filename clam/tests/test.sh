@@ -61,6 +61,111 @@ if ! python datatest.py; then
    GOOD=0
 fi
 
+echo "Running project index tests:" >&2
+if ! python projectindextest.py; then
+   echo "ERROR: Project index test failed!!" >&2
+   FAILMSG="$FAILMSG projectindextest"
+   GOOD=0
+fi
+
+echo "Running status tests:" >&2
+if ! python statustest.py; then
+   echo "ERROR: Status test failed!!" >&2
+   FAILMSG="$FAILMSG statustest"
+   GOOD=0
+fi
+
+echo "Running project state tests:" >&2
+if ! python projectstatetest.py; then
+   echo "ERROR: Project state test failed!!" >&2
+   FAILMSG="$FAILMSG projectstatetest"
+   GOOD=0
+fi
+
+echo "Running journal tests:" >&2
+if ! python journaltest.py; then
+   echo "ERROR: Journal test failed!!" >&2
+   FAILMSG="$FAILMSG journaltest"
+   GOOD=0
+fi
+
+echo "Running job queue tests:" >&2
+if ! python jobqueuetest.py; then
+   echo "ERROR: Job queue test failed!!" >&2
+   FAILMSG="$FAILMSG jobqueuetest"
+   GOOD=0
+fi
+
+echo "Running launcher tests:" >&2
+if ! python launchertest.py; then
+   echo "ERROR: Launcher test failed!!" >&2
+   FAILMSG="$FAILMSG launchertest"
+   GOOD=0
+fi
+
+echo "Running worker tests:" >&2
+if ! python workertest.py; then
+   echo "ERROR: Worker test failed!!" >&2
+   FAILMSG="$FAILMSG workertest"
+   GOOD=0
+fi
+
+echo "Running trash tests:" >&2
+if ! python trashtest.py; then
+   echo "ERROR: Trash test failed!!" >&2
+   FAILMSG="$FAILMSG trashtest"
+   GOOD=0
+fi
+
+echo "Running resumable upload tests:" >&2
+if ! python resumabletest.py; then
+   echo "ERROR: Resumable upload test failed!!" >&2
+   FAILMSG="$FAILMSG resumabletest"
+   GOOD=0
+fi
+
+echo "Running input manifest tests:" >&2
+if ! python manifesttest.py; then
+   echo "ERROR: Input manifest test failed!!" >&2
+   FAILMSG="$FAILMSG manifesttest"
+   GOOD=0
+fi
+
+echo "Running content-addressed store tests:" >&2
+if ! python blobstoretest.py; then
+   echo "ERROR: Content-addressed store test failed!!" >&2
+   FAILMSG="$FAILMSG blobstoretest"
+   GOOD=0
+fi
+
+echo "Running URL fetcher tests:" >&2
+if ! python fetchertest.py; then
+   echo "ERROR: URL fetcher test failed!!" >&2
+   FAILMSG="$FAILMSG fetchertest"
+   GOOD=0
+fi
+
+echo "Running sendfile tests:" >&2
+if ! python sendfiletest.py; then
+   echo "ERROR: Sendfile test failed!!" >&2
+   FAILMSG="$FAILMSG sendfiletest"
+   GOOD=0
+fi
+
+echo "Running dispatcher tests:" >&2
+if ! python dispatchertest.py; then
+   echo "ERROR: Dispatcher test failed!!" >&2
+   FAILMSG="$FAILMSG dispatchertest"
+   GOOD=0
+fi
+
+echo "Running import time tests:" >&2
+if ! python importtimetest.py; then
+   echo "ERROR: Import time test failed!!" >&2
+   FAILMSG="$FAILMSG importtimetest"
+   GOOD=0
+fi
+
 echo "Stopping all running clam services" >&2
 pkill -f clamservice
 sleep 2
@@ -0,0 +1,82 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Trash tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.common.trash
+
+class TrashTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def maketree(self, path, dirs=3, files=10):
+        """Create a small directory tree, returns the number of files and directories in it (including the directory itself)"""
+        os.makedirs(path)
+        for i in range(dirs):
+            os.makedirs(os.path.join(path, 'd' + str(i), 'sub'))
+            for j in range(files):
+                with open(os.path.join(path, 'd' + str(i), 'sub', 'f' + str(j)), 'w', encoding='utf-8') as f:
+                    f.write("test")
+        os.symlink('/', os.path.join(path, 'link')) #not followed
+        return 1 + dirs * (2 + files) + 1
+
+    def test1_move(self):
+        """Trash - Move into the trash"""
+        path = os.path.join(self.root, 'projects', 'proycon', 'p1')
+        self.maketree(path)
+        target = clam.common.trash.move(self.root, path)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.isdir(target))
+        self.assertEqual(clam.common.trash.entries(self.root), [target])
+        with self.assertRaises(FileNotFoundError):
+            clam.common.trash.move(self.root, path)
+
+    def test2_purge(self):
+        """Trash - Purge everything, in order"""
+        count = 0
+        for project in ('p1','p2'):
+            path = os.path.join(self.root, 'projects', 'proycon', project)
+            count += self.maketree(path)
+            clam.common.trash.move(self.root, path)
+        filepath = os.path.join(self.root, 'projects', 'proycon', 'file')
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write("test")
+        clam.common.trash.move(self.root, filepath)
+        entries = clam.common.trash.entries(self.root)
+        self.assertEqual([ os.path.basename(entry).split('-')[-1] for entry in entries ], ['p1','p2','file'])
+        self.assertEqual(clam.common.trash.purge(self.root), count + 1)
+        self.assertEqual(clam.common.trash.entries(self.root), [])
+        self.assertTrue(os.path.isdir('/')) #symlink was not followed
+
+    def test3_rate(self):
+        """Trash - Purging is rate limited"""
+        path = os.path.join(self.root, 'project')
+        count = self.maketree(path, 2, 24) #52 entries
+        clam.common.trash.move(self.root, path)
+        begintime = time.time()
+        self.assertEqual(clam.common.trash.purge(self.root, rate=200), count)
+        self.assertGreaterEqual(time.time() - begintime, (count - 2) / 200)
+
+if __name__ == '__main__':
+    unittest.main()
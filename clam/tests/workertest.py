@@ -0,0 +1,116 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Worker agent tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import types
+
+#We may need to do some path magic in order to find the clam.* imports
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+import clam.clamworker
+import clam.common.journal
+import clam.common.jobqueue
+
+SETTINGSMODULE = 'clam.config.textstats' #only passed on to the dispatcher
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp() + '/'
+        self.settings = types.SimpleNamespace(ROOT=self.root)
+        self.queue = clam.common.jobqueue.JobQueue(self.root, wal=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def newproject(self, user, project, cmd):
+        """Create a project directory and queue it, as the webservice does"""
+        projectpath = os.path.join(self.root, 'projects', user, project) + '/'
+        os.makedirs(projectpath + 'output')
+        self.queue.push(user, project, cmd)
+        clam.common.journal.append(projectpath, clam.common.journal.QUEUED)
+        return projectpath
+
+    def worker(self, name, capacity=1):
+        return clam.clamworker.Worker(SETTINGSMODULE, name, capacity, settings=self.settings)
+
+    def test1_run(self):
+        """Worker - Several local agents share the queue"""
+        projectpaths = [ self.newproject('proycon', 'p' + str(i), 'sleep 0.5') for i in range(3) ]
+        workers = [ self.worker('w1'), self.worker('w2') ]
+        self.assertEqual(workers[0].step(), 1)
+        self.assertEqual(workers[1].step(), 1)
+        self.assertEqual(workers[0].step(), 0) #no free slots
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(sorted(worker[0] for worker in self.queue.workers()), ['w1','w2'])
+        for _ in range(200):
+            for worker in workers:
+                worker.step()
+            states = [ clam.common.journal.read(projectpath) for projectpath in projectpaths ]
+            if all(state.done for state in states) and not any(worker.processes for worker in workers):
+                break
+            time.sleep(0.05)
+        for state in states:
+            self.assertTrue(state.done)
+            self.assertEqual(state.exitstatus, 0)
+        self.assertEqual({ state.worker for state in states }, {'w1','w2'})
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.running(), [])
+
+    def test2_lost(self):
+        """Worker - Projects of workers that stopped checking in are marked as lost"""
+        projectpath = self.newproject('proycon', 'p1', 'sleep 10')
+        self.queue.heartbeat('ghost', 'elsewhere', 1, 1, 1)
+        self.assertEqual(self.queue.claim('ghost')[:2], ('proycon', 'p1'))
+        clam.common.journal.append(projectpath, clam.common.journal.STARTED, pid=1, worker='ghost')
+        worker = self.worker('w1')
+        worker.timeout = 0
+        time.sleep(0.01)
+        worker.step()
+        state = clam.common.journal.read(projectpath)
+        self.assertTrue(state.done)
+        self.assertEqual(state.exitstatus, 1)
+        self.assertIsNone(self.queue.worker('ghost'))
+        self.assertEqual(self.queue.running(), [])
+
+    def test3_shell(self):
+        """Worker - The command is run with the shell as it is"""
+        projectpath = self.newproject('proycon', 'p1', "test '$HOME' != \"$HOME\"")
+        worker = self.worker('w1')
+        self.assertEqual(worker.step(), 1)
+        state = clam.common.journal.Journal(projectpath).wait(lambda state: state.done, timeout=10)
+        self.assertTrue(state.done)
+        self.assertEqual(state.exitstatus, 0)
+
+    def test4_maxconcurrentprojects(self):
+        """Worker - Workers together run no more than MAXCONCURRENTPROJECTS projects"""
+        self.settings.MAXCONCURRENTPROJECTS = 1
+        for i in range(2):
+            self.newproject('proycon', 'p' + str(i), 'sleep 0.5')
+        workers = [ self.worker('w1'), self.worker('w2') ]
+        self.assertEqual(workers[0].step(), 1)
+        self.assertEqual(workers[1].step(), 0)
+        self.assertEqual(len(self.queue), 1)
+        for _ in range(200):
+            workers[0].reap()
+            if not workers[0].processes:
+                break
+            time.sleep(0.05)
+        self.assertEqual(workers[1].step(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -43,6 +43,7 @@ setup(
             'startclamservice = clam.clamservice:main', #alias
             'clamnewproject = clam.clamnewproject:main', #alias
             'clamdispatcher = clam.clamdispatcher:main',
+            'clamworker = clam.clamworker:main',
             'clamclient = clam.clamclient:main'
         ]
     },